@@ -11,7 +11,67 @@
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import bisect
+
 from ooi.logging import log
+from mi.core.exceptions import NotImplementedException
+
+class ResumableSieve(object):
+    """
+    A sieve that can pick up where it left off. Instead of just the list of
+    (start, end) tuples a plain data_sieve_fn returns, scan() also returns a
+    watermark: the index in the scanned data before which no incomplete
+    data block can start. The Chunker starts the next scan at the
+    watermark, so bytes that have already been ruled out are not sieved
+    again each time a fragment comes in.
+    
+    A resumable sieve is still callable like a plain sieve function.
+    """
+    def __call__(self, raw_data):
+        (result, watermark) = self.scan(raw_data)
+        return result
+    
+    def scan(self, raw_data):
+        """
+        Sieve a block of raw data
+        
+        @param raw_data The data to sieve
+        @retval A tuple of (list of (start, end) tuples, watermark). Indices
+            are with respect to raw_data.
+        """
+        raise NotImplementedException("scan() not implemented")
+    
+class SieveAdapter(ResumableSieve):
+    """
+    Adapts a plain data_sieve_fn to the resumable sieve protocol. Without a
+    maximum record length the only thing known for sure is that nothing
+    before the end of the last data block found needs another look, which
+    is what the Chunker has always done. With one, anything further than
+    that from the end of the data would already have been a complete block,
+    so only that much overlap is rescanned.
+    """
+    def __init__(self, data_sieve_fn, max_record_length=None):
+        """
+        @param data_sieve_fn A plain sieve function, see Chunker
+        @param max_record_length The longest data block the sieve can match,
+            None if unbounded
+        """
+        self.data_sieve_fn = data_sieve_fn
+        self.max_record_length = max_record_length
+    
+    def scan(self, raw_data):
+        result = self.data_sieve_fn(raw_data)
+        
+        if result == []:
+            watermark = 0
+        else:
+            watermark = result[-1][1]
+        
+        if self.max_record_length != None:
+            watermark = max(watermark,
+                            len(raw_data) - self.max_record_length + 1)
+        
+        return (result, watermark)
 
 class Chunker(object):
     """
@@ -21,12 +81,19 @@ class Chunker(object):
     breaks apart collections of data segments so they can be broken into
     individual blocks.
     """
-    def __init__(self, data_sieve_fn):
+    def __init__(self, data_sieve_fn, compact_threshold=0):
         """
         Initialize the buffer and indexing structures 
         The lists keep track of the start and stop index values (inclusive)
         of the particular type in the data buffer. The lists are tuples with
         (start, stop)
+
+        Consumed data is not cut out of the buffer right away. Instead an
+        offset to the first live byte is kept and the buffer is only
+        compacted (and the index lists rebased) once the dead prefix grows
+        past compact_threshold and is at least as big as the live data. The
+        default threshold of 0 compacts on every fetch, so the buffer and
+        index lists look just as they did before the offset was kept.
         
         @param data_sieve_fn A function that takes in a chunk of raw data (in
             whatever format is needed by the Chunker subclass) and spits out
@@ -36,45 +103,84 @@ class Chunker(object):
             buffer[start_index:end_index] to properly describe the data block.
             If no data is present, return and empty list. If multiple data
             blocks are found, the returned list will contain multiple tuples.
+            A ResumableSieve can be supplied instead to avoid rescanning
+            data that has already been sieved.
+        @param compact_threshold The number of consumed bytes that may sit at
+            the front of the buffer before it is compacted.
         """
         self.sieve = data_sieve_fn
+        if isinstance(data_sieve_fn, ResumableSieve):
+            self._resumable_sieve = data_sieve_fn
+        else:
+            self._resumable_sieve = SieveAdapter(data_sieve_fn)
+        self.compact_threshold = compact_threshold
+        
+        # buffer index the next sieve scan starts from
+        self._sieve_index = 0
+        
+        # index of the first live item in the buffer, everything before it
+        # has been consumed and is waiting for compaction
+        self._offset = 0
         
         self.raw_chunk_list = []
         self.data_chunk_list = []
         self.nondata_chunk_list = []
         
+        # start index and timestamp of each fragment added, kept in step
+        # so a block can be traced back to the fragment holding its start
+        self._timestamp_index = []
+        self._timestamp_list = []
+        
         """ To be filled out by the subclass """
         self.buffer = None
         
-    def add_chunk(self, raw_data):
+    def add_chunk(self, raw_data, timestamp=None):
         """
         Adds a chunk of data to the end of the buffer, includes the new indices
-        in the raw_chunk_list. This base class method handles strings and lists.
+        in the raw_chunk_list. This base class method handles strings, lists
+        and bytearrays.
         Improve or subclass for more capabilities.
         
         @param raw_data The bunch of raw data as a list (or something that can be
             treated as a list...like a string)
+        @param timestamp The time the chunk arrived (usually the port agent
+            timestamp of the packet carrying it), None if not known. Blocks
+            fetched with the get_next_*_with_timestamp methods carry the
+            timestamp of the chunk holding their first byte.
         """
-        assert isinstance(self.buffer, str) or isinstance(self.buffer, list)
+        assert isinstance(self.buffer, (str, list, bytearray))
         # Append raw
         start_index = len(self.buffer)
         
         if self.data_chunk_list == []:
-            last_data_index = 0
+            last_data_index = self._offset
         else:
             last_data_index = self.data_chunk_list[-1][1] 
         end_index = start_index + len(raw_data)
         
         if isinstance(self.buffer, str):
             self.buffer += raw_data
+        elif isinstance(self.buffer, bytearray):
+            try:
+                self.buffer.extend(raw_data)
+            except BufferError:
+                # a memoryview handed out earlier pins the buffer, leave it
+                # to the view and carry on with a copy
+                self.buffer = self.buffer + raw_data
         else:
             self.buffer.append(raw_data)
             
         self.raw_chunk_list.append((start_index, end_index))
+        if raw_data:
+            self._timestamp_index.append(start_index)
+            self._timestamp_list.append(timestamp)
 
-        # find data
-        result = self._generate_data_lists(start_index=last_data_index)
+        # find data, skipping what the sieve has already ruled out
+        sieve_index = max(last_data_index, self._sieve_index)
+        result = self._generate_data_lists(start_index=last_data_index,
+                                           sieve_index=sieve_index)
         assert result != None
+        self._sieve_index = result['sieve_index']
         
         # rebase onto existing buffer
         for (s, e) in result['data_chunk_list']:
@@ -110,32 +216,41 @@ class Chunker(object):
             log.debug("Added chunk, data_chunk_list: %s, nondata_chunk_list: %s",
                       self.data_chunk_list, self.nondata_chunk_list)
          
-    def _generate_data_lists(self, start_index=0):
+    def _generate_data_lists(self, start_index=None, sieve_index=None):
         """
         From some starting place in the raw data buffer, go through and
         find the blocks of data and non-data in the list.
         
         @param start_index The beginning index to start generating lists from.
-            Default is the beginning of the buffer
+            Default is the first live index of the buffer
+        @param sieve_index The index to start sieving from, at or after
+            start_index. Nothing between the two can start a data block.
+            Default is start_index
         @retval A dict with keys "data_chunk_list" and "non_data_chunk_list"
-            that include the full data chunk lists for this block of data.
+            that include the full data chunk lists for this block of data,
+            and "sieve_index", where the next sieve scan can start.
             Indices are respect to the buffer, not the chunk
         """
-        log.debug("Generating data lists with start index %s", start_index)
+        if start_index == None:
+            start_index = self._offset
+        if sieve_index == None:
+            sieve_index = start_index
+        log.debug("Generating data lists with start index %s, sieve index %s",
+                  start_index, sieve_index)
         return_list = {'data_chunk_list':[], 'non_data_chunk_list':[]}
-        result = self.sieve(self.buffer[start_index:])
+        (result, watermark) = self._resumable_sieve.scan(
+            self._get_sieve_block(sieve_index))
 
         # rebase to buffer coordinates
-        return_list['data_chunk_list'] = [(s+start_index, e+start_index) for (s, e) in result]
+        result = [(s+sieve_index, e+sieve_index) for (s, e) in result]
+        return_list['data_chunk_list'] = result
+        return_list['sieve_index'] = sieve_index + watermark
         
         if result == []:
             return_list['non_data_chunk_list'].append((start_index,
                                                        len(self.buffer)))
         previous_end = start_index        
         for (s, e) in result:
-            # rebase to buffer as long as we are walking through
-            s += start_index
-            e += start_index
             assert(s >= previous_end)
             if (s == previous_end):
                 previous_end = e
@@ -163,19 +278,82 @@ class Chunker(object):
         else:
             (next_start, next_end) = self.data_chunk_list[0]
         
-        next_block = self.buffer[next_start:next_end]
+        next_block = self._get_block(next_start, next_end)
 
         if clean:    
             self._clean_buffer(next_end)
-            self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
+            self.raw_chunk_list = self._trim_chunk_list(self.raw_chunk_list,
+                                                        next_end)
+            self.data_chunk_list = self._trim_chunk_list(self.data_chunk_list,
                                                          next_end)
-            self.data_chunk_list = self._clean_chunk_list(self.data_chunk_list,
-                                                         next_end)
-            self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
-                                                             next_end)
+            self.nondata_chunk_list = self._trim_chunk_list(self.nondata_chunk_list,
+                                                            next_end)
+            self._compact_buffer()
                 
         return next_block
     
+    def get_next_data_with_timestamp(self, clean=True):
+        """
+        Get the next chunk of data from the buffer along with the timestamp
+        of the chunk its first byte arrived in. See get_next_data.
+        
+        @param clean Remove the buffer contents before and including this data
+        @return A (timestamp, data) tuple, (None, None) if no data
+        """
+        return self._get_next_with_timestamp(self.data_chunk_list,
+                                             self.get_next_data, clean)
+    
+    def get_next_non_data_with_timestamp(self, clean=True):
+        """
+        Get the next chunk of non-data from the buffer along with the
+        timestamp of the chunk its first byte arrived in. See
+        get_next_non_data.
+        
+        @param clean Remove the buffer contents before and including this data
+        @return A (timestamp, data) tuple, (None, None) if no data
+        """
+        return self._get_next_with_timestamp(self.nondata_chunk_list,
+                                             self.get_next_non_data, clean)
+    
+    def get_next_raw_with_timestamp(self, clean=True):
+        """
+        Get the next chunk of raw characters from the buffer along with the
+        timestamp it arrived with. See get_next_raw.
+        
+        @param clean Remove the buffer contents before and including this data
+        @return A (timestamp, data) tuple, (None, None) if no data
+        """
+        return self._get_next_with_timestamp(self.raw_chunk_list,
+                                             self.get_next_raw, clean)
+    
+    def _get_next_with_timestamp(self, chunk_list, get_next_fn, clean):
+        """
+        Look up the timestamp of the next block in a chunk list, then fetch
+        the block
+        
+        @param chunk_list The chunk list the block comes from
+        @param get_next_fn The get_next_* method that fetches the block
+        @param clean Passed on to get_next_fn
+        @return A (timestamp, data) tuple, (None, None) if no data
+        """
+        if chunk_list == []:
+            return (None, None)
+        
+        timestamp = self._get_timestamp(chunk_list[0][0])
+        return (timestamp, get_next_fn(clean=clean))
+    
+    def _get_timestamp(self, index):
+        """
+        Find the timestamp of the chunk that holds a buffer index
+        
+        @param index The buffer index
+        @retval The timestamp given with the chunk, None if there was none
+        """
+        position = bisect.bisect_right(self._timestamp_index, index) - 1
+        if position < 0:
+            return None
+        return self._timestamp_list[position]
+    
     def _clean_chunk_list(self, list, end_index):
         """
         Cleans up the given chunk list based on the start and end indexes of
@@ -230,16 +408,97 @@ class Chunker(object):
         
         self.nondata_chunk_list = new_nondata_list
     
+    def _trim_chunk_list(self, list, end_index):
+        """
+        Drop the entries of a chunk list that end at or before end_index and
+        clip an entry that straddles it. Unlike _clean_chunk_list, indices
+        are not rebased, so only the consumed entries at the front of the
+        (sorted) list are touched.
+        
+        @param list A list of (start, end) tuples of indices in buffer order
+        @param end_index The end index of what is being removed.
+        @retval The list after it has been trimmed
+        """
+        count = 0
+        for (s, e) in list:
+            if e > end_index:
+                break
+            count += 1
+        if count:
+            del list[:count]
+        if list and list[0][0] < end_index:
+            list[0] = (end_index, list[0][1])
+        return list
+    
+    def _get_block(self, start_index, end_index):
+        """
+        Fetch a block of the buffer. Subclasses can override this to hand
+        back the block in a different form than the buffer stores it.
+        
+        @param start_index The buffer index of the first item
+        @param end_index One more than the buffer index of the last item
+        @retval The block of data
+        """
+        return self.buffer[start_index:end_index]
+    
+    def _get_sieve_block(self, start_index):
+        """
+        Fetch the tail of the buffer to hand to the sieve
+        
+        @param start_index The buffer index to start from
+        @retval The data from start_index to the end of the buffer
+        """
+        return self._get_block(start_index, len(self.buffer))
+    
     def _clean_buffer(self, end_index):
         """
-        Clean up the buffer only...usually followed by some list cleaning
+        Clean up the buffer only...usually followed by some list cleaning.
+        This only marks the data as consumed, the space is reclaimed by
+        _compact_buffer once the index lists are cleaned up.
         @param end_index the last index used...clean up to here
         """
-        # Clean up buffer
+        self._offset = end_index
+        
+        # drop timestamps of chunks that have been consumed entirely
+        position = bisect.bisect_right(self._timestamp_index, end_index) - 1
+        if position > 0:
+            del self._timestamp_index[:position]
+            del self._timestamp_list[:position]
+        
+    def _compact_buffer(self):
+        """
+        Drop the consumed prefix from the buffer and rebase the index lists
+        onto the compacted buffer. With a compact threshold this is skipped
+        until the dead prefix passes it and outweighs the live data, so the
+        copying is amortized over many fetches. With a threshold of 0 it is
+        done every time.
+        """
+        if self._offset == 0:
+            return
+        if self.compact_threshold and \
+           (self._offset <= self.compact_threshold or
+            self._offset < len(self.buffer) - self._offset):
+            return
+        
+        end_index = self._offset
         if isinstance(self.buffer, str):
             self.buffer = self.buffer[end_index:]
         else:
-            self.buffer[0:end_index] = []
+            try:
+                del self.buffer[0:end_index]
+            except BufferError:
+                # pinned by a memoryview, see add_chunk
+                self.buffer = self.buffer[end_index:]
+        self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
+                                                     end_index)
+        self.data_chunk_list = self._clean_chunk_list(self.data_chunk_list,
+                                                      end_index)
+        self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
+                                                         end_index)
+        self._sieve_index = max(self._sieve_index - end_index, 0)
+        self._timestamp_index = [max(s - end_index, 0)
+                                 for s in self._timestamp_index]
+        self._offset = 0
         
     def get_next_non_data(self, clean=True):
         """
@@ -258,16 +517,17 @@ class Chunker(object):
         else:
             (next_start, next_end) = self.nondata_chunk_list[0]
         
-        next_block = self.buffer[next_start:next_end]
+        next_block = self._get_block(next_start, next_end)
 
         if clean:    
             self._clean_buffer(next_end)
-            self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
-                                                         next_end)
-            self.data_chunk_list = self._clean_chunk_list(self.data_chunk_list,
+            self.raw_chunk_list = self._trim_chunk_list(self.raw_chunk_list,
+                                                        next_end)
+            self.data_chunk_list = self._trim_chunk_list(self.data_chunk_list,
                                                          next_end)
-            self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
-                                                             next_end)
+            self.nondata_chunk_list = self._trim_chunk_list(self.nondata_chunk_list,
+                                                            next_end)
+            self._compact_buffer()
                         
         return next_block
     
@@ -288,15 +548,16 @@ class Chunker(object):
         else:
             (next_start, next_end) = self.raw_chunk_list[0]
         
-        next_block = self.buffer[next_start:next_end]
+        next_block = self._get_block(next_start, next_end)
 
         if clean:
             self._clean_buffer(next_end)
-            self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
-                                                         next_end)
+            self.raw_chunk_list = self._trim_chunk_list(self.raw_chunk_list,
+                                                        next_end)
             self._clean_data_list(next_end)
-            self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
-                                                             next_end)
+            self.nondata_chunk_list = self._trim_chunk_list(self.nondata_chunk_list,
+                                                            next_end)
+            self._compact_buffer()
 
         return next_block
     
@@ -305,17 +566,70 @@ class StringChunker(Chunker):
     A version of the chunker that handles a string buffer. Methods are tuned
     for easy interaction with strings instead of binary byte blocks.
     """
-    def __init__(self, data_sieve_fn):
-        Chunker.__init__(self, data_sieve_fn)
-        self.buffer = ""
+    def __init__(self, data_sieve_fn, ring_buffer=False, compact_threshold=4096):
+        """
+        @param data_sieve_fn The sieve function, see Chunker
+        @param ring_buffer If True, keep the data in a bytearray that is
+            appended to in place and only compacted once compact_threshold
+            bytes have been consumed. Blocks are still returned as strings.
+            If False, the buffer is a string trimmed on every fetch.
+        @param compact_threshold Consumed bytes to hold before compacting,
+            only used in ring buffer mode
+        """
+        if ring_buffer:
+            Chunker.__init__(self, data_sieve_fn,
+                             compact_threshold=compact_threshold)
+            self.buffer = bytearray()
+        else:
+            Chunker.__init__(self, data_sieve_fn)
+            self.buffer = ""
+    
+    def _get_block(self, start_index, end_index):
+        """
+        Hand back string blocks regardless of how the buffer is stored
+        """
+        if isinstance(self.buffer, bytearray):
+            return str(self.buffer[start_index:end_index])
+        return self.buffer[start_index:end_index]
     
     
 class BinaryChunker(Chunker):
     """
     A version of the chunker that handles a binary buffer and therefore
-    binary data blocks that fall out of it.
+    binary data blocks that fall out of it. The buffer is a bytearray indexed
+    by byte, appended to in place and compacted lazily.
+
+    In zero copy mode blocks are handed back as memoryview slices of the
+    buffer rather than copied out. A view stays valid after the chunker moves
+    on: if the buffer needs to grow or shrink while a view holds it, the
+    chunker switches to a copy and leaves the old buffer to the view. Views
+    do not support find() or regex matching, but struct.unpack_from() and
+    bytearray() take them directly.
     """
-    def __init__(self, data_sieve_fn):
-        Chunker.__init__(self, data_sieve_fn)
-        self.buffer = []
+    def __init__(self, data_sieve_fn, zero_copy=False, compact_threshold=4096):
+        """
+        @param data_sieve_fn The sieve function, see Chunker. It is handed a
+            bytearray.
+        @param zero_copy If True, return memoryview slices of the buffer
+            instead of strings
+        @param compact_threshold Consumed bytes to hold before compacting
+        """
+        Chunker.__init__(self, data_sieve_fn,
+                         compact_threshold=compact_threshold)
+        self.buffer = bytearray()
+        self.zero_copy = zero_copy
+
+    def _get_block(self, start_index, end_index):
+        """
+        Hand back a string, or a memoryview in zero copy mode
+        """
+        if self.zero_copy:
+            return memoryview(self.buffer)[start_index:end_index]
+        return str(self.buffer[start_index:end_index])
+
+    def _get_sieve_block(self, start_index):
+        """
+        Sieves need find() and regex support, so they get a bytearray
+        """
+        return self.buffer[start_index:]
     
\ No newline at end of file
@@ -13,11 +13,13 @@ __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
 import time
-import copy
-import ntplib
 import base64
 import json
+import struct
+import threading
+from json.encoder import encode_basestring_ascii
 
+from mi.core import ntp_clock
 from mi.core.common import BaseEnum
 from mi.core.exceptions import SampleException, ReadOnlyException, NotImplementedException
 from mi.core.log import get_logger ; log = get_logger()
@@ -35,9 +37,12 @@ class DataParticleKey(BaseEnum):
     VALUE_ID = "value_id"
     VALUE = "value"
     BINARY = "binary"
+    COUNT = "count"
 
 class DataParticleValue(BaseEnum):
     JSON_DATA = "JSON_Data"
+    BINARY_DATA = "Binary_Data"
+    JSON_BATCH = "JSON_Batch"
     RAW = "raw"
     PARSED = "parsed"
     ENG = "eng"
@@ -47,6 +52,401 @@ class DataParticleValue(BaseEnum):
     INVALID = "invalid"
     QUESTIONABLE = "questionable"
     
+def _encode_float(value):
+    """
+    Encode a float the way json.dumps does
+    """
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return 'Infinity'
+    if value == -float('inf'):
+        return '-Infinity'
+    return repr(value)
+
+"""
+Encoders for the value types that appear in particles, keyed by exact type.
+Each gives the same text json.dumps would.
+"""
+_VALUE_ENCODERS = {
+    float: _encode_float,
+    int: str,
+    long: str,
+    bool: lambda value: 'true' if value else 'false',
+    str: encode_basestring_ascii,
+    unicode: encode_basestring_ascii,
+    type(None): lambda value: 'null'
+}
+
+def _encode_value(value):
+    """
+    Encode any value the way json.dumps(value, sort_keys=True) does
+    """
+    encoder = _VALUE_ENCODERS.get(type(value))
+    if encoder:
+        return encoder(value)
+    return json.dumps(value, sort_keys=True)
+
+class ParticleEncoder(object):
+    """
+    Serializes particle structures to exactly the text
+    json.dumps(structure, sort_keys=True) gives, without the generic
+    encoder's sorting and type checks. The header keys are laid out in
+    sorted order ahead of time, and the text around each value in the
+    values list is precompiled from a value schema: a list of
+    (value_id, type) in the order the particle builds its values. Anything
+    that does not fit the expected layout is handed to json.dumps.
+    """
+
+    # The header keys, in sorted order. The optional timestamps are left
+    # out when missing.
+    _HEADER_KEYS = sorted([DataParticleKey.DRIVER_TIMESTAMP,
+                           DataParticleKey.INTERNAL_TIMESTAMP,
+                           DataParticleKey.PKT_FORMAT_ID,
+                           DataParticleKey.PKT_VERSION,
+                           DataParticleKey.PORT_TIMESTAMP,
+                           DataParticleKey.PREFERRED_TIMESTAMP,
+                           DataParticleKey.QUALITY_FLAG,
+                           DataParticleKey.STREAM_NAME])
+    _OPTIONAL_KEYS = (DataParticleKey.INTERNAL_TIMESTAMP,
+                      DataParticleKey.PORT_TIMESTAMP)
+    _VALUE_KEYS = set([DataParticleKey.VALUE_ID, DataParticleKey.VALUE])
+    _RAW_KEYS = set([DataParticleKey.VALUE_ID, DataParticleKey.VALUE,
+                     DataParticleKey.BINARY])
+
+    def __init__(self, schema=None):
+        """
+        @param schema A list of (value_id, type) for the parsed values, or
+            None if the particle does not declare one.
+        """
+        self._prefixes = [(key, '"%s": ' % key) for key in self._HEADER_KEYS]
+        self._values_prefix = '"%s": [' % DataParticleKey.VALUES
+        self._value_prefix = '{"%s": ' % DataParticleKey.VALUE
+        self._value_id_prefix = ', "%s": ' % DataParticleKey.VALUE_ID
+
+        # (value_id, text after the value, encoder for the declared type)
+        self._schema = []
+        for (value_id, value_type) in schema or []:
+            self._schema.append((value_id,
+                                 '%s%s}' % (self._value_id_prefix,
+                                            encode_basestring_ascii(value_id)),
+                                 _VALUE_ENCODERS.get(value_type),
+                                 value_type))
+
+        self._raw_template = '{"%s": true, "%s": %%s, "%s": "%s"}' % (
+            DataParticleKey.BINARY, DataParticleKey.VALUE,
+            DataParticleKey.VALUE_ID, DataParticleValue.RAW)
+
+    def encode(self, structure):
+        """
+        Serialize a particle structure.
+        @param structure The dict built by a DataParticle.
+        @retval The same string json.dumps(structure, sort_keys=True) gives.
+        """
+        size = len(self._HEADER_KEYS) + 1
+        for key in self._OPTIONAL_KEYS:
+            if key not in structure:
+                size -= 1
+        values = structure.get(DataParticleKey.VALUES)
+        if len(structure) != size or type(values) is not list:
+            return json.dumps(structure, sort_keys=True)
+
+        parts = []
+        for (key, prefix) in self._prefixes:
+            if key in structure:
+                parts.append(prefix + _encode_value(structure[key]))
+            elif key not in self._OPTIONAL_KEYS:
+                return json.dumps(structure, sort_keys=True)
+
+        parts.append(self._values_prefix + self._encode_values(values) + ']')
+        return '{' + ', '.join(parts) + '}'
+
+    def _encode_values(self, values):
+        """
+        Serialize the items of a values list, without the brackets.
+        """
+        schema = self._schema
+        items = []
+        for (index, item) in enumerate(values):
+            if type(item) is not dict:
+                items.append(json.dumps(item, sort_keys=True))
+                continue
+            if len(item) == 2 and set(item) == self._VALUE_KEYS:
+                value_id = item[DataParticleKey.VALUE_ID]
+                value = item[DataParticleKey.VALUE]
+                if index < len(schema) and schema[index][0] == value_id:
+                    (schema_id, suffix, encoder, value_type) = schema[index]
+                    if encoder and type(value) is value_type:
+                        items.append(self._value_prefix + encoder(value) + suffix)
+                    else:
+                        items.append(self._value_prefix + _encode_value(value) + suffix)
+                else:
+                    items.append(self._value_prefix + _encode_value(value) +
+                                 self._value_id_prefix + _encode_value(value_id) + '}')
+            elif len(item) == 3 and set(item) == self._RAW_KEYS and \
+                 item[DataParticleKey.BINARY] is True and \
+                 item[DataParticleKey.VALUE_ID] == DataParticleValue.RAW:
+                items.append(self._raw_template %
+                             _encode_value(item[DataParticleKey.VALUE]))
+            else:
+                items.append(json.dumps(item, sort_keys=True))
+        return ', '.join(items)
+
+"""
+Binary particle layout. All numbers are big endian.
+
+    header      '>2sBBHd'  BINARY_MAGIC, BINARY_VERSION, flags, pkt_version,
+                           driver_timestamp
+                '>d'       internal_timestamp, if flags & HAS_INTERNAL
+                '>d'       port_timestamp, if flags & HAS_PORT
+                           stream_name, preferred_timestamp, quality_flag as
+                           short strings: '>B' length then the bytes
+    values      '>H'       number of values, then for each value:
+                           value_id as a short string, a one byte type code
+                           and the value as given by BINARY_TYPES
+
+Raw data is carried as its bytes rather than base64 text.
+"""
+BINARY_MAGIC = 'DP'
+BINARY_VERSION = 1
+HAS_INTERNAL = 0x01
+HAS_PORT = 0x02
+
+_BINARY_HEADER = struct.Struct('>2sBBHd')
+_DOUBLE = struct.Struct('>d')
+_INT64 = struct.Struct('>q')
+_COUNT = struct.Struct('>H')
+_LENGTH = struct.Struct('>L')
+
+class BinaryType(BaseEnum):
+    """
+    Type codes for binary particle values
+    """
+    NONE = 'N'          # no payload
+    TRUE = 'T'          # no payload
+    FALSE = 'F'         # no payload
+    INT = 'q'           # '>q'
+    FLOAT = 'd'         # '>d'
+    STRING = 's'        # '>L' length then the bytes
+    UNICODE = 'u'       # '>L' length then UTF-8
+    BYTES = 'b'         # '>L' length then the bytes, a binary raw value
+    JSON = 'j'          # '>L' length then the value as JSON
+    ITEM = 'J'          # '>L' length then the whole item as JSON, for items
+                        # with keys other than value_id and value
+
+def _short_string(value):
+    """
+    Pack a string of up to 255 bytes with a one byte length
+    """
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    if len(value) > 255:
+        raise SampleException("String too long for binary particle: %s" % value)
+    return chr(len(value)) + value
+
+def _long_string(value):
+    return _LENGTH.pack(len(value)) + value
+
+class BinaryParticleEncoder(object):
+    """
+    Serializes particle structures to the compact binary layout above. Used
+    for particle classes whose _pkt_format_id is BINARY_DATA.
+    """
+    _VALUE_KEYS = ParticleEncoder._VALUE_KEYS
+    _RAW_KEYS = ParticleEncoder._RAW_KEYS
+
+    def encode(self, structure):
+        """
+        Serialize a particle structure.
+        @param structure The dict built by a DataParticle.
+        @retval The binary packet string
+        @throws SampleException If a string is too long for its field
+        """
+        flags = 0
+        optional = []
+        internal = structure.get(DataParticleKey.INTERNAL_TIMESTAMP)
+        if internal is not None:
+            flags |= HAS_INTERNAL
+            optional.append(_DOUBLE.pack(internal))
+        port = structure.get(DataParticleKey.PORT_TIMESTAMP)
+        if port is not None:
+            flags |= HAS_PORT
+            optional.append(_DOUBLE.pack(port))
+
+        parts = [_BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, flags,
+                                     structure[DataParticleKey.PKT_VERSION],
+                                     structure[DataParticleKey.DRIVER_TIMESTAMP])]
+        parts.extend(optional)
+        parts.append(_short_string(structure[DataParticleKey.STREAM_NAME]))
+        parts.append(_short_string(structure[DataParticleKey.PREFERRED_TIMESTAMP]))
+        parts.append(_short_string(structure[DataParticleKey.QUALITY_FLAG]))
+
+        values = structure[DataParticleKey.VALUES]
+        parts.append(_COUNT.pack(len(values)))
+        for item in values:
+            parts.append(self._encode_item(item))
+        return ''.join(parts)
+
+    def _encode_item(self, item):
+        """
+        Pack one entry of a values list
+        """
+        if type(item) is dict:
+            keys = set(item)
+            if keys == self._VALUE_KEYS:
+                return _short_string(item[DataParticleKey.VALUE_ID]) + \
+                       self._encode_value(item[DataParticleKey.VALUE])
+            if keys == self._RAW_KEYS and item[DataParticleKey.BINARY] is True \
+               and isinstance(item[DataParticleKey.VALUE], str):
+                return _short_string(item[DataParticleKey.VALUE_ID]) + \
+                       BinaryType.BYTES + _long_string(item[DataParticleKey.VALUE])
+        return _short_string('') + BinaryType.ITEM + \
+               _long_string(json.dumps(item, sort_keys=True))
+
+    def _encode_value(self, value):
+        """
+        Pack a type code and a value
+        """
+        value_type = type(value)
+        if value is None:
+            return BinaryType.NONE
+        if value_type is bool:
+            return BinaryType.TRUE if value else BinaryType.FALSE
+        if value_type is float:
+            return BinaryType.FLOAT + _DOUBLE.pack(value)
+        if value_type in (int, long) and -2**63 <= value < 2**63:
+            return BinaryType.INT + _INT64.pack(value)
+        if value_type is str:
+            return BinaryType.STRING + _long_string(value)
+        if value_type is unicode:
+            return BinaryType.UNICODE + _long_string(value.encode('utf-8'))
+        return BinaryType.JSON + _long_string(json.dumps(value, sort_keys=True))
+
+class BinaryParticleDecoder(object):
+    """
+    Reads binary particle packets back into the structure they were
+    built from, with pkt_format_id set to BINARY_DATA.
+    """
+    def decode(self, data):
+        """
+        @param data A binary particle packet
+        @retval The particle structure
+        @throws SampleException If the packet is not a whole binary particle
+        """
+        try:
+            (structure, offset) = self._decode(data)
+        except (struct.error, IndexError, ValueError), e:
+            raise SampleException("Invalid binary particle: %s" % e)
+        if offset != len(data):
+            raise SampleException("Invalid binary particle: %d extra bytes" %
+                                  (len(data) - offset))
+        return structure
+
+    def _decode(self, data):
+        (magic, version, flags, pkt_version, driver_timestamp) = \
+            _BINARY_HEADER.unpack_from(data)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise SampleException("Not a version %d binary particle" %
+                                  BINARY_VERSION)
+        offset = _BINARY_HEADER.size
+
+        structure = {
+            DataParticleKey.PKT_FORMAT_ID: DataParticleValue.BINARY_DATA,
+            DataParticleKey.PKT_VERSION: pkt_version,
+            DataParticleKey.DRIVER_TIMESTAMP: driver_timestamp
+        }
+        if flags & HAS_INTERNAL:
+            structure[DataParticleKey.INTERNAL_TIMESTAMP] = \
+                _DOUBLE.unpack_from(data, offset)[0]
+            offset += _DOUBLE.size
+        if flags & HAS_PORT:
+            structure[DataParticleKey.PORT_TIMESTAMP] = \
+                _DOUBLE.unpack_from(data, offset)[0]
+            offset += _DOUBLE.size
+        for key in (DataParticleKey.STREAM_NAME,
+                    DataParticleKey.PREFERRED_TIMESTAMP,
+                    DataParticleKey.QUALITY_FLAG):
+            (structure[key], offset) = self._short_string(data, offset)
+
+        (count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        values = []
+        for i in range(count):
+            (item, offset) = self._decode_item(data, offset)
+            values.append(item)
+        structure[DataParticleKey.VALUES] = values
+        return (structure, offset)
+
+    def _short_string(self, data, offset):
+        length = ord(data[offset])
+        end = offset + 1 + length
+        if end > len(data):
+            raise ValueError("string runs past the end")
+        return (data[offset + 1:end], end)
+
+    def _long_string(self, data, offset):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        start = offset + _LENGTH.size
+        if start + length > len(data):
+            raise ValueError("string runs past the end")
+        return (data[start:start + length], start + length)
+
+    def _decode_item(self, data, offset):
+        (value_id, offset) = self._short_string(data, offset)
+        code = data[offset]
+        offset += 1
+
+        if code == BinaryType.ITEM:
+            (text, offset) = self._long_string(data, offset)
+            return (json.loads(text), offset)
+
+        item = {DataParticleKey.VALUE_ID: value_id}
+        if code == BinaryType.NONE:
+            value = None
+        elif code == BinaryType.TRUE:
+            value = True
+        elif code == BinaryType.FALSE:
+            value = False
+        elif code == BinaryType.INT:
+            value = _INT64.unpack_from(data, offset)[0]
+            offset += _INT64.size
+        elif code == BinaryType.FLOAT:
+            value = _DOUBLE.unpack_from(data, offset)[0]
+            offset += _DOUBLE.size
+        elif code == BinaryType.STRING:
+            (value, offset) = self._long_string(data, offset)
+        elif code == BinaryType.UNICODE:
+            (value, offset) = self._long_string(data, offset)
+            value = value.decode('utf-8')
+        elif code == BinaryType.BYTES:
+            (value, offset) = self._long_string(data, offset)
+            item[DataParticleKey.BINARY] = True
+        elif code == BinaryType.JSON:
+            (text, offset) = self._long_string(data, offset)
+            value = json.loads(text)
+        else:
+            raise ValueError("unknown type code %r" % code)
+        item[DataParticleKey.VALUE] = value
+        return (item, offset)
+
+def decode_particle(packet):
+    """
+    Decode a particle packet in either format. Binary packets start with
+    BINARY_MAGIC, JSON packets with '{'.
+    @param packet A string from generate_raw, generate_parsed or
+        generate_all
+    @retval The particle structure
+    @throws SampleException If a binary packet is not valid
+    """
+    if packet.startswith(BINARY_MAGIC):
+        return BinaryParticleDecoder().decode(packet)
+    return json.loads(packet)
+
+"""
+The encoder compiled for each particle class
+"""
+_encoders = {}
+
 class DataParticle(object):
     """
     This class is responsible for storing and ultimately generating data
@@ -57,8 +457,35 @@ class DataParticle(object):
     It is the intent that this class is subclassed as needed if an instrument must
     modify fields in the outgoing packet. The hope is to have most of the superclass
     code be called by the child class with just values overridden as needed.
+
+    The header fields are kept in slots rather than a contents dict, and the
+    header of each output is built straight from them. Subclasses declare
+    an empty __slots__ to go without a per particle __dict__.
     """
 
+    __slots__ = ('raw_data', '_port_timestamp', '_internal_timestamp',
+                 '_driver_timestamp', '_preferred_timestamp', '_quality_flag')
+
+    # Set to DataParticleValue.BINARY_DATA in a subclass to publish its
+    # streams in the binary format
+    _pkt_format_id = DataParticleValue.JSON_DATA
+    _pkt_version = 1
+
+    # A list of (value_id, type) in the order _build_parsed_values builds
+    # them, used to compile a faster JSON encoder. Optional.
+    _value_schema = None
+
+    # The slot or class attribute behind each header key
+    _HEADER_ATTRIBUTES = {
+        DataParticleKey.PKT_FORMAT_ID: '_pkt_format_id',
+        DataParticleKey.PKT_VERSION: '_pkt_version',
+        DataParticleKey.PORT_TIMESTAMP: '_port_timestamp',
+        DataParticleKey.INTERNAL_TIMESTAMP: '_internal_timestamp',
+        DataParticleKey.DRIVER_TIMESTAMP: '_driver_timestamp',
+        DataParticleKey.PREFERRED_TIMESTAMP: '_preferred_timestamp',
+        DataParticleKey.QUALITY_FLAG: '_quality_flag'
+    }
+
     def __init__(self, raw_data,
                  port_timestamp=None,
                  internal_timestamp=None,
@@ -68,16 +495,40 @@ class DataParticle(object):
         
         @param raw_data The raw data used in the particle
         """
-        self.contents = {
-            DataParticleKey.PKT_FORMAT_ID: DataParticleValue.JSON_DATA,
-            DataParticleKey.PKT_VERSION: 1,
-            DataParticleKey.PORT_TIMESTAMP: port_timestamp,
-            DataParticleKey.INTERNAL_TIMESTAMP: internal_timestamp,
-            DataParticleKey.DRIVER_TIMESTAMP: ntplib.system_to_ntp_time(time.time()),
-            DataParticleKey.PREFERRED_TIMESTAMP: preferred_timestamp,
-            DataParticleKey.QUALITY_FLAG: quality_flag
-        }
+        self._port_timestamp = port_timestamp
+        self._internal_timestamp = internal_timestamp
+        self._driver_timestamp = ntp_clock.ntp_time()
+        self._preferred_timestamp = preferred_timestamp
+        self._quality_flag = quality_flag
         self.raw_data = raw_data
+
+    def _get_contents(self):
+        """
+        The header fields as a dict keyed by DataParticleKey. A new dict is
+        built on each access, so changing it does not change the particle;
+        assign a dict to contents instead.
+        """
+        return dict([(key, getattr(self, attribute)) for (key, attribute)
+                     in self._HEADER_ATTRIBUTES.iteritems()])
+
+    def _set_contents(self, contents):
+        """
+        Set the header fields from a dict keyed by DataParticleKey. Keys
+        not given keep their values.
+        @raises ReadOnlyException If a key is not a header field, or is the
+        packet format or version, which are set on the class.
+        """
+        for (key, value) in contents.iteritems():
+            attribute = self._HEADER_ATTRIBUTES.get(key)
+            if attribute == None:
+                raise ReadOnlyException("%s is not a particle header field" % key)
+            if attribute in ('_pkt_format_id', '_pkt_version'):
+                if value != getattr(self, attribute):
+                    raise ReadOnlyException("%s is set on the particle class" % key)
+                continue
+            setattr(self, attribute, value)
+
+    contents = property(_get_contents, _set_contents)
     
     def set_value(self, id, value):
         """
@@ -88,7 +539,7 @@ class DataParticle(object):
         @raises ReadOnlyException If the parameter cannot be set
         """
         if (id == DataParticleKey.INTERNAL_TIMESTAMP) and (self._check_timestamp(value)):
-            self.contents[DataParticleKey.INTERNAL_TIMESTAMP] = value
+            self._internal_timestamp = value
         else:
             raise ReadOnlyException("Parameter %s not able to be set to %s after object creation!" %
                                     (id, value))
@@ -100,7 +551,7 @@ class DataParticle(object):
         @raises NotImplementedException If there is an invalid id
         """
         if DataParticleKey.has(id):
-            return self.contents[id]
+            return getattr(self, self._HEADER_ATTRIBUTES[id])
         else:
             raise NotImplementedException("Value %s not available in particle!", id)
         
@@ -113,28 +564,19 @@ class DataParticle(object):
            and driver timestamp
         @throws SampleException If there is a problem with the inputs
         """
-        for time in [DataParticleKey.INTERNAL_TIMESTAMP,
-                     DataParticleKey.DRIVER_TIMESTAMP,
-                     DataParticleKey.PORT_TIMESTAMP]:
-            if  not self._check_timestamp(self.contents[time]):
-                raise SampleException("Invalid port agent timestamp in raw packet")
+        self._validate()
 
-        # verify preferred timestamp exists in the structure...
-        if not self._check_preferred_timestamps():
-            raise SampleException("Preferred timestamp, %s, not in particle!" %
-                                  self.contents[DataParticleKey.PREFERRED_TIMESTAMP])
-        
         # build response structure
         result = self._build_base_structure()
         result[DataParticleKey.STREAM_NAME] = DataParticleValue.RAW
         result[DataParticleKey.VALUES] = self._build_raw_values()
         
         # JSONify response, sorting is nice for testing
-        json_result = json.dumps(result, sort_keys=True)
+        json_result = self._encode(result)
         
         # return result
         return json_result
-        
+
     def _build_raw_values(self):
         """
         Build just the values list for a raw data structure. This will be
@@ -145,9 +587,14 @@ class DataParticle(object):
         @returns A list that is ready to be added to the "values" tag before
            the structure is JSONified
         """
+        # the binary format carries the bytes as they are
+        if self._pkt_format_id == DataParticleValue.BINARY_DATA:
+            value = self.raw_data
+        else:
+            value = base64.b64encode(self.raw_data)
         result = [{
             DataParticleKey.VALUE_ID: DataParticleValue.RAW,
-            DataParticleKey.VALUE: base64.b64encode(self.raw_data),
+            DataParticleKey.VALUE: value,
             DataParticleKey.BINARY: True}]
 
         return result
@@ -163,15 +610,7 @@ class DataParticle(object):
            and driver timestamp
         @throws InstrumentDriverException If there is a problem with the inputs
         """
-        for time in [DataParticleKey.INTERNAL_TIMESTAMP,
-                     DataParticleKey.DRIVER_TIMESTAMP,
-                     DataParticleKey.PORT_TIMESTAMP]:
-            if  not self._check_timestamp(self.contents[time]):
-                raise SampleException("Invalid port agent timestamp in raw packet")
-
-        # verify preferred timestamp exists in the structure...
-        if not self._check_preferred_timestamps():
-            raise SampleException("Preferred timestamp not in particle!")
+        self._validate()
         
         # build response structure
         result = self._build_base_structure()
@@ -179,11 +618,65 @@ class DataParticle(object):
         result[DataParticleKey.VALUES] = self._build_parsed_values()
         
         # JSONify response, sorting is nice for testing
-        json_result = json.dumps(result, sort_keys=True)
+        json_result = self._encode(result)
         
         # return result
         return json_result
         
+    def generate_all(self):
+        """
+        Generates both the raw and the parsed packets in one pass. The
+        timestamps are validated and the header is built once, each packet
+        is serialized once, and the structures that were serialized are
+        returned along with the JSON so callers need not decode it again.
+
+        @return (raw JSON string, parsed JSON string,
+            {'raw': raw structure, 'parsed': parsed structure})
+        @throws SampleException If there is a problem with the inputs
+        """
+        structures = self.generate_structures()
+        return (self._encode(structures[DataParticleValue.RAW]),
+                self._encode(structures[DataParticleValue.PARSED]),
+                structures)
+
+    def generate_structures(self):
+        """
+        Builds the raw and parsed structures without serializing them, for
+        callers such as DataParticleBatch that publish them another way.
+
+        @return {'raw': raw structure, 'parsed': parsed structure}
+        @throws SampleException If there is a problem with the inputs
+        """
+        self._validate()
+
+        parsed = self._build_base_structure()
+        raw = dict(parsed)
+        raw[DataParticleKey.STREAM_NAME] = DataParticleValue.RAW
+        raw[DataParticleKey.VALUES] = self._build_raw_values()
+        parsed[DataParticleKey.STREAM_NAME] = DataParticleValue.PARSED
+        parsed[DataParticleKey.VALUES] = self._build_parsed_values()
+
+        return {DataParticleValue.RAW: raw, DataParticleValue.PARSED: parsed}
+        
+    def _encode(self, structure):
+        """
+        Serialize an output structure in this class's packet format: JSON
+        with sorted keys, or the binary layout if _pkt_format_id is
+        BINARY_DATA.
+
+        @param structure The structure to serialize
+        @return The packet string
+        """
+        cls = self.__class__
+        encoder = _encoders.get(cls)
+        if encoder == None:
+            if cls._pkt_format_id == DataParticleValue.BINARY_DATA:
+                encoder = BinaryParticleEncoder()
+            else:
+                encoder = ParticleEncoder(cls._value_schema)
+            _encoders[cls] = encoder
+        return encoder.encode(structure)
+
     def _build_parsed_values(self):
         """
         Build values of a parsed structure. Just the values are built so
@@ -203,19 +696,38 @@ class DataParticle(object):
         
         @return A fresh copy of a core structure to be exported
         """
-        # set the driver time
-        driver_time = ntplib.system_to_ntp_time(time.time())
-        result = {}
-        result[DataParticleKey.DRIVER_TIMESTAMP] = driver_time
-        
-        result = copy.deepcopy(self.contents)
-        # clean out optional fields that were missing
-        if not self.contents[DataParticleKey.PORT_TIMESTAMP]:
-            del result[DataParticleKey.PORT_TIMESTAMP]
-        if not self.contents[DataParticleKey.INTERNAL_TIMESTAMP]:
-            del result[DataParticleKey.INTERNAL_TIMESTAMP]
+        result = {
+            DataParticleKey.PKT_FORMAT_ID: self._pkt_format_id,
+            DataParticleKey.PKT_VERSION: self._pkt_version,
+            DataParticleKey.DRIVER_TIMESTAMP: self._driver_timestamp,
+            DataParticleKey.PREFERRED_TIMESTAMP: self._preferred_timestamp,
+            DataParticleKey.QUALITY_FLAG: self._quality_flag
+        }
+        # leave out optional fields that were missing
+        if self._port_timestamp:
+            result[DataParticleKey.PORT_TIMESTAMP] = self._port_timestamp
+        if self._internal_timestamp:
+            result[DataParticleKey.INTERNAL_TIMESTAMP] = self._internal_timestamp
         return result
     
+    def _validate(self):
+        """
+        Check the timestamps before a packet is generated
+
+        @throws SampleException If a timestamp is unreasonable or the
+            preferred timestamp is missing
+        """
+        for timestamp in (self._internal_timestamp,
+                          self._driver_timestamp,
+                          self._port_timestamp):
+            if  not self._check_timestamp(timestamp):
+                raise SampleException("Invalid port agent timestamp in raw packet")
+
+        # verify preferred timestamp exists in the structure...
+        if not self._check_preferred_timestamps():
+            raise SampleException("Preferred timestamp, %s, not in particle!" %
+                                  self._preferred_timestamp)
+
     def _check_timestamp(self, timestamp):
         """
         Check to make sure the timestamp is reasonable
@@ -229,7 +741,7 @@ class DataParticle(object):
             return False
         
         # is it sufficiently in the future to be unreasonable?
-        if timestamp > ntplib.system_to_ntp_time(time.time()+(86400*365)):
+        if timestamp > ntp_clock.future_bound():
             return False
         else:
             return True
@@ -243,11 +755,200 @@ class DataParticle(object):
         @throws SampleException When there is a problem with the preferred
             timestamp in the sample.
         """        
-        if self.contents[DataParticleKey.PREFERRED_TIMESTAMP] == None:
+        preferred = self._preferred_timestamp
+        if preferred == None:
             raise SampleException("Missing preferred timestamp, %s, in particle" %
-                                  self.contents[DataParticleKey.PREFERRED_TIMESTAMP])
-        if self.contents[self.contents[DataParticleKey.PREFERRED_TIMESTAMP]] == None:
+                                  preferred)
+        if getattr(self, self._HEADER_ATTRIBUTES[preferred]) == None:
             raise SampleException("Preferred timestamp, %s, is not defined" %
-                                  self.contents[DataParticleKey.PREFERRED_TIMESTAMP])
+                                  preferred)
         
-        return True
\ No newline at end of file
+        return True
+
+class DataParticleBatch(object):
+    """
+    Accumulates samples of one particle class into columns and publishes
+    them as a single JSON_Batch packet, rather than a raw and a parsed
+    packet per sample. The packet holds the sample count, a list per
+    header timestamp and flag, and a values list with one
+    {value_id, value: [...]} column per parsed value plus a base64 raw
+    column. A column is None in the rows that did not have its value.
+
+    A batch is flushed when it holds size samples, or max_age seconds
+    after its first sample arrived, whichever comes first, so max_age
+    bounds the latency of the stream. The age is watched by one timer
+    thread per batch, started with the first sample and stopped by
+    close(). Packets are handed to the callback one at a time, in the
+    order they were taken, whichever thread flushes them.
+    """
+    # Header fields kept as a column, one entry per sample
+    _COLUMN_KEYS = (DataParticleKey.DRIVER_TIMESTAMP,
+                    DataParticleKey.PORT_TIMESTAMP,
+                    DataParticleKey.INTERNAL_TIMESTAMP,
+                    DataParticleKey.PREFERRED_TIMESTAMP,
+                    DataParticleKey.QUALITY_FLAG)
+
+    def __init__(self, particle_class, callback, size=100, max_age=1.0):
+        """
+        @param particle_class The DataParticle class of the samples
+        @param callback Called with each batch packet, usually a function
+            that publishes it as a DriverAsyncEvent.SAMPLE.
+        @param size The most samples in one batch
+        @param max_age The most seconds a sample waits to be published, or
+            None to flush on size alone.
+        """
+        self._particle_class = particle_class
+        self._callback = callback
+        self._size = size
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._aged = threading.Condition(self._lock)
+        self._publish_lock = threading.Lock()
+        self._timer = None
+        self._closed = False
+        self._reset()
+
+    def _reset(self):
+        self._count = 0
+        self._first_time = None
+        self._columns = dict([(key, []) for key in self._COLUMN_KEYS])
+        self._value_ids = []
+        self._values = {}
+        self._raw = []
+
+    def __len__(self):
+        return self._count
+
+    def add(self, particle):
+        """
+        Add a sample to the batch, flushing the batch if it is full.
+        @param particle A particle of the batch's class
+        @retval The sample's {'raw': raw, 'parsed': parsed} structures
+        @throws SampleException If the particle is not valid
+        """
+        structures = particle.generate_structures()
+        parsed = structures[DataParticleValue.PARSED]
+
+        with self._lock:
+            for key in self._COLUMN_KEYS:
+                self._columns[key].append(parsed.get(key))
+            self._raw.append(base64.b64encode(particle.raw_data))
+
+            for item in parsed[DataParticleKey.VALUES]:
+                value_id = item[DataParticleKey.VALUE_ID]
+                column = self._values.get(value_id)
+                if column == None:
+                    # a value first seen in this row
+                    column = self._values[value_id] = [None] * self._count
+                    self._value_ids.append(value_id)
+                column.append(item[DataParticleKey.VALUE])
+            self._count += 1
+            for column in self._values.itervalues():
+                if len(column) < self._count:
+                    column.append(None)
+
+            if self._count == 1:
+                self._first_time = time.time()
+                self._start_timer()
+                self._aged.notify()
+
+            packet = None
+            if self._count >= self._size or (self._max_age != None and
+                    time.time() - self._first_time >= self._max_age):
+                packet = self._take()
+
+        if packet:
+            self._publish(packet)
+        return structures
+
+    def flush(self):
+        """
+        Publish the samples held, if any.
+        """
+        with self._lock:
+            packet = self._take()
+        if packet:
+            self._publish(packet)
+
+    def close(self):
+        """
+        Publish the samples held and stop the age timer. Samples added
+        after the batch is closed are flushed on size, or on age when the
+        next one arrives.
+        """
+        with self._lock:
+            self._closed = True
+            self._aged.notify()
+            packet = self._take()
+        if packet:
+            self._publish(packet)
+
+    def _start_timer(self):
+        """
+        Start the age timer thread if it is needed and not running. Called
+        with the lock held.
+        """
+        if self._max_age != None and self._timer == None and not self._closed:
+            self._timer = threading.Thread(target=self._run_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_timer(self):
+        """
+        Flush the batch each time its first sample reaches max_age, until
+        the batch is closed. The callback is called without the lock.
+        """
+        while True:
+            with self._lock:
+                while not self._closed and self._first_time == None:
+                    self._aged.wait()
+                if self._closed:
+                    return
+                remaining = self._first_time + self._max_age - time.time()
+                if remaining > 0:
+                    self._aged.wait(remaining)
+                    continue
+                packet = self._take()
+            if packet:
+                self._publish(packet)
+
+    def _publish(self, packet):
+        """
+        Hand a packet from _take to the callback, then release the publish
+        lock _take acquired for it. Called without the lock.
+        """
+        try:
+            self._callback(packet)
+        finally:
+            self._publish_lock.release()
+
+    def _take(self):
+        """
+        Build the packet for the samples held and empty the batch. Called
+        with the lock held. A packet is returned with the publish lock
+        held, so the previous packet's callback has returned and no later
+        packet can be published before this one; _publish releases it.
+        @retval The JSON packet, or None if the batch is empty
+        """
+        if not self._count:
+            return None
+
+        structure = {
+            DataParticleKey.PKT_FORMAT_ID: DataParticleValue.JSON_BATCH,
+            DataParticleKey.PKT_VERSION: self._particle_class._pkt_version,
+            DataParticleKey.STREAM_NAME: DataParticleValue.PARSED,
+            DataParticleKey.COUNT: self._count
+        }
+        structure.update(self._columns)
+        values = [{DataParticleKey.VALUE_ID: value_id,
+                   DataParticleKey.VALUE: self._values[value_id]}
+                  for value_id in self._value_ids]
+        values.append({DataParticleKey.VALUE_ID: DataParticleValue.RAW,
+                       DataParticleKey.VALUE: self._raw,
+                       DataParticleKey.BINARY: True})
+        structure[DataParticleKey.VALUES] = values
+        self._reset()
+
+        packet = json.dumps(structure, sort_keys=True)
+        self._publish_lock.acquire()
+        return packet
@@ -98,6 +98,17 @@ class DriverProcess(object):
         """
         pass
 
+    def shutdown_driver(self):
+        """
+        Let the driver send the events it still holds while messaging is
+        running.
+        """
+        if self.driver:
+            try:
+                self.driver._shutdown()
+            except Exception:
+                log.error('Driver shutdown failed:\n%s' % traceback.format_exc())
+
     def shutdown(self):
         """
         Shutdown function prior to process exit.
@@ -141,6 +152,7 @@ class DriverProcess(object):
         cmd_func = getattr(self.driver, cmd, None)
         log.debug("DriverProcess.cmd_driver(): cmd=%s, cmd_func=%s" %(cmd, cmd_func))
         if cmd == 'stop_driver_process':
+            self.shutdown_driver()
             self.stop_messaging()
             return'stop_driver_process'
         elif cmd == 'test_events':
@@ -213,6 +225,7 @@ class DriverProcess(object):
                 if self.check_parent():
                     time.sleep(2)
                 else:
+                    self.shutdown_driver()
                     self.stop_messaging()
                     break
             
@@ -21,6 +21,8 @@ from mi.core.exceptions import InstrumentParameterException
 from mi.core.instrument.instrument_fsm import InstrumentFSM
 from mi.core.instrument.logger_client import LoggerClient
 from mi.core.instrument.port_agent_client import PortAgentClient
+from mi.core.instrument.port_agent_hub import HubPortAgentClient
+from mi.core.instrument.port_agent_capture import CaptureWriter
 
 
 from mi.core.log import get_logger,LoggerManager
@@ -291,6 +293,13 @@ class InstrumentDriver(object):
         """
         raise NotImplementedException('execute_resource() not implemented.')
 
+    def _shutdown(self):
+        """
+        Called by the driver process before it stops messaging, so events
+        the driver still holds can be sent. Overridden by subclasses.
+        """
+        pass
+
     ########################################################################
     # Event interface.
     ########################################################################
@@ -556,6 +565,33 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         # know which is better.
         self._protocol._protocol_fsm.current_state = state
 
+    def _shutdown(self):
+        """
+        Publish the samples the protocol holds in batches before the driver
+        process stops messaging, and close the capture file.
+        """
+        if self._protocol:
+            self._protocol._flush_sample_batches(close=True)
+        self._close_capture()
+
+    def _close_capture(self):
+        """
+        Close the capture file of the connection, if it records one. The
+        capture outlives disconnects so it is only closed when the
+        connection itself is dropped or the driver shuts down.
+        """
+        if isinstance(self._connection, PortAgentClient):
+            self._connection.close_capture()
+
+    def _drop_protocol(self):
+        """
+        Publish the samples the protocol holds in batches, stop their
+        timers and destroy the protocol.
+        """
+        if self._protocol:
+            self._protocol._flush_sample_batches(close=True)
+        self._protocol = None
+
     ########################################################################
     # Unconfigured handlers.
     ########################################################################
@@ -639,6 +675,7 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         next_state = None
         result = None
         
+        self._close_capture()
         self._connection = None
         next_state = DriverConnectionState.UNCONFIGURED
         
@@ -667,7 +704,9 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
             raise InstrumentParameterException('Missing comms config parameter.')
 
         # Verify configuration dict, and update connection if possible.
-        self._connection = self._build_connection(config)
+        connection = self._build_connection(config)
+        self._close_capture()
+        self._connection = connection
 
         return (next_state, result)
 
@@ -683,7 +722,10 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         result = None
         
         self._build_protocol()
-        self._connection.init_comms(self._protocol.got_data)
+        if getattr(self._connection, 'batch', False):
+            self._connection.init_comms(self._protocol.got_data_batch)
+        else:
+            self._connection.init_comms(self._protocol.got_data)
         self._protocol._connection = self._connection
         next_state = DriverConnectionState.CONNECTED
         
@@ -717,7 +759,7 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         result = None
         
         self._connection.stop_comms()
-        self._protocol = None
+        self._drop_protocol()
         next_state = DriverConnectionState.DISCONNECTED
         
         return (next_state, result)
@@ -733,7 +775,7 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         result = None
 
         self._connection.stop_comms()
-        self._protocol = None
+        self._drop_protocol()
         next_state = DriverConnectionState.DISCONNECTED
         
         return (next_state, result)
@@ -765,7 +807,13 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         and also to self._protocol._connection upon entering in the
         DriverConnectionState.CONNECTED state.
 
-        @param config configuration dict
+        @param config configuration dict. If 'port_agent_hub' is True the
+                connection shares the process wide PortAgentHub thread
+                instead of starting a listener thread of its own. If
+                'batch_packets' is True the protocol's got_data_batch is
+                called with each read's packets instead of got_data. If
+                'port_agent_capture' names a file, every packet received
+                is recorded to it for later replay.
 
         @retval a Connection instance, which will be assigned to
                   self._connection
@@ -783,7 +831,14 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
 
             if isinstance(addr, str) and isinstance(port, int) and len(addr)>0:
                 #return LoggerClient(addr, port)
-                return PortAgentClient(addr, port)
+                batch = config.get('batch_packets', False)
+                capture = None
+                if config.get('port_agent_capture', None):
+                    capture = CaptureWriter(config['port_agent_capture'])
+                if config.get('port_agent_hub', False):
+                    return HubPortAgentClient(addr, port, batch=batch,
+                                              capture=capture)
+                return PortAgentClient(addr, port, batch=batch, capture=capture)
             else:
                 raise InstrumentParameterException('Invalid comms config dict.')
 
@@ -18,12 +18,15 @@ import time
 import os
 import signal
 import re
-import json
+import threading
 
 from mi.core.common import BaseEnum, InstErrorCode
 from mi.core.instrument.data_particle import DataParticleKey
+from mi.core.instrument.data_particle import DataParticleBatch
 
 from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.port_agent_client import PortAgentClient
+from mi.core.instrument.prompt_detector import PromptDetector
 
 from mi.core.instrument.protocol_param_dict import ProtocolParameterDict
 from mi.core.exceptions import InstrumentTimeoutException
@@ -64,6 +67,9 @@ class InstrumentProtocol(object):
         # The parameter dictionary.
         self._param_dict = ProtocolParameterDict()
 
+        # The DataParticleBatch for each particle class published in batches.
+        self._sample_batches = {}
+
     ########################################################################
     # Helper methods
     ########################################################################
@@ -73,8 +79,45 @@ class InstrumentProtocol(object):
          Defined in subclasses.
         """
         pass
+
+    def got_data_batch(self, packets):
+        """
+        Called by the instrument connection in batch mode with every packet
+        that arrived in one read. Passes each packet to got_data in turn.
+        Overridden by subclasses that can parse a batch at once.
+        @param packets A list of port agent packets in the order received.
+        """
+        for paPacket in packets:
+            self.got_data(paPacket)
     
-    def _extract_sample(self, particle_class, regex, line, publish=True):
+    def _batch_samples(self, particle_class, size=100, max_age=1.0):
+        """
+        Publish samples of a particle class from _extract_sample in
+        batches rather than one raw and one parsed event per sample.
+        @param particle_class The DataParticle class to batch
+        @param size The most samples in one batch event
+        @param max_age The most seconds a sample waits to be published
+        """
+        self._sample_batches[particle_class] = DataParticleBatch(
+            particle_class,
+            lambda packet: self._driver_event(DriverAsyncEvent.SAMPLE, packet),
+            size=size, max_age=max_age)
+
+    def _flush_sample_batches(self, close=False):
+        """
+        Publish the samples held in every batch. Called when autosample
+        stops and when the protocol is dropped.
+        @param close True to also stop the batch age timers, when the
+            protocol will not be used again.
+        """
+        for batch in self._sample_batches.itervalues():
+            if close:
+                batch.close()
+            else:
+                batch.flush()
+
+    def _extract_sample(self, particle_class, regex, line, publish=True,
+                        timestamp=None):
         """
         Extract sample from a response line if present and publish "raw" and
         "parsed" sample events to agent. 
@@ -86,7 +129,12 @@ class InstrumentProtocol(object):
         @param line string to match for sample.
         @param publish boolean to publish samples (default True). If True,
                two different events are published: one to notify raw data and
-               the other to notify parsed data.
+               the other to notify parsed data. If the particle class is
+               batched by _batch_samples the sample is added to its batch
+               instead.
+        @param timestamp The port agent timestamp of the sample, as returned
+               by Chunker.get_next_data_with_timestamp(). If given it is the
+               preferred timestamp, otherwise the driver timestamp is.
 
         @retval dict of dicts {'parsed': parsed_sample, 'raw': raw_sample} if
                 the line can be parsed for a sample. Otherwise, None.
@@ -97,11 +145,18 @@ class InstrumentProtocol(object):
         sample = None
         if regex.match(line):
         
-            particle = particle_class(line,
-                preferred_timestamp=DataParticleKey.DRIVER_TIMESTAMP)
+            if timestamp == None:
+                particle = particle_class(line,
+                    preferred_timestamp=DataParticleKey.DRIVER_TIMESTAMP)
+            else:
+                particle = particle_class(line, port_timestamp=timestamp,
+                    preferred_timestamp=DataParticleKey.PORT_TIMESTAMP)
             
-            raw_sample = particle.generate_raw()
-            parsed_sample = particle.generate_parsed()
+            batch = self._sample_batches.get(particle_class)
+            if publish and self._driver_event and batch != None:
+                return batch.add(particle)
+
+            (raw_sample, parsed_sample, sample) = particle.generate_all()
             
             if publish and self._driver_event:
                 self._driver_event(DriverAsyncEvent.SAMPLE, raw_sample)
@@ -109,7 +164,6 @@ class InstrumentProtocol(object):
             if publish and self._driver_event:
                 self._driver_event(DriverAsyncEvent.SAMPLE, parsed_sample)
     
-            sample = dict(parsed=json.loads(parsed_sample), raw=json.loads(raw_sample))
             return sample
         return sample
 
@@ -257,19 +311,64 @@ class InstrumentProtocol(object):
         else:
             return '%e' % v
 
+"""
+Default high-water mark, in bytes, of the line and prompt buffers
+"""
+DEFAULT_BUFFER_LIMIT = 262144
+
 class CommandResponseInstrumentProtocol(InstrumentProtocol):
     """
     Base class for text-based command-response instruments.
     """
     
-    def __init__(self, prompts, newline, driver_event):
+    # Set by the constructor; notified whenever the line or prompt buffer
+    # is assigned, so waiters wake as soon as data arrives.
+    _buffer_changed = None
+
+    # Fed the prompt buffer as it grows, to find prompts in it without
+    # rescanning it.
+    _prompt_detector = None
+
+    # The high-water mark of the line and prompt buffers, or None for no
+    # limit. A buffer that grows past it is cut back to its newest half.
+    _buffer_limit = None
+
+    # True if the line buffer has been cut back since it was last
+    # cleared, so a response read from it would be missing its front.
+    _linebuf_cut = False
+
+    # Seconds after the device last ended its output with a prompt during
+    # which it is taken to be awake still, so _wakeup returns that prompt
+    # without waking it again. None to wake it every time.
+    _awake_window = None
+
+    # The (prompt, time) the device last ended its output with, or None
+    # if something has been sent or received since.
+    _last_prompt = None
+
+    # Seconds within which an awake device answers a wakeup, the first
+    # wait of _wakeup. None to wait the whole delay each time. A wakeup
+    # answered after _wakeup has returned would be taken as the end of
+    # the next response, so this must not be shorter than the device
+    # really takes.
+    _wakeup_wait = None
+
+    def __init__(self, prompts, newline, driver_event,
+                 buffer_limit=DEFAULT_BUFFER_LIMIT):
         """
         Constructor.
         @param prompts Enum class containing possible device prompts used for
         command response logic.
         @param newline The device newline.
         @driver_event The callback for asynchronous driver events.
+        @param buffer_limit The most bytes the line and prompt buffers hold
+        before their oldest data is dropped, or None for no limit.
         """
+        self._buffer_changed = threading.Condition()
+        self._buffer_limit = buffer_limit
+
+        # Bytes dropped from the front of each buffer to keep it in bounds.
+        self._buffer_overflow = {'linebuf': 0, 'promptbuf': 0}
         
         # Construct superclass.
         InstrumentProtocol.__init__(self, driver_event)
@@ -279,6 +378,8 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
     
         # Class of prompts used by device.
         self._prompts = prompts
+        self._prompt_list = prompts.list()
+        self._prompt_detector = PromptDetector(self._prompt_list)
     
         # Line buffer for input from device.
         self._linebuf = ''
@@ -298,6 +399,118 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
 
         self._last_data_receive_timestamp = None
         
+    def _set_linebuf(self, value):
+        self._set_buffer('linebuf', value)
+
+    def _set_promptbuf(self, value):
+        self._set_buffer('promptbuf', value, detect=True)
+
+    def _set_buffer(self, name, value, detect=False):
+        """
+        Assign a buffer and wake any thread waiting on the buffers. A buffer
+        past the high-water mark is cut back to its newest half, and the
+        bytes dropped are counted in _buffer_overflow. Cutting the line
+        buffer sets _linebuf_cut until it is next cleared, so the response
+        being read fails rather than coming back without its front.
+        @param name 'linebuf' or 'promptbuf'.
+        @param detect True to feed the prompt detector what was appended,
+            or the whole buffer if it was replaced.
+        """
+        attribute = '_%s_data' % name
+        if self._buffer_changed == None:
+            setattr(self, attribute, value)
+            return
+        with self._buffer_changed:
+            detector = self._prompt_detector
+            if detect and detector:
+                old = getattr(self, attribute, '')
+                if value.startswith(old):
+                    appended = value[len(old):]
+                    if appended:
+                        detector.feed(appended)
+                        prompt = detector.endswith(self._prompt_list)
+                        if prompt != None:
+                            self._last_prompt = (prompt, time.time())
+                        else:
+                            self._last_prompt = None
+                else:
+                    detector.reset()
+                    detector.feed(value)
+
+            # The detector keeps what it needs of the data, so the buffer
+            # can be trimmed without it noticing.
+            limit = self._buffer_limit
+            if limit and len(value) > limit:
+                keep = limit // 2
+                dropped = len(value) - keep
+                value = value[dropped:]
+                self._buffer_overflow[name] += dropped
+                if name == 'linebuf':
+                    self._linebuf_cut = True
+                log.warn('%s overflowed, dropped %d bytes, %d in all' %
+                         (name, dropped, self._buffer_overflow[name]))
+            elif name == 'linebuf' and value == '':
+                self._linebuf_cut = False
+
+            setattr(self, attribute, value)
+            self._buffer_changed.notify_all()
+
+    def get_buffer_overflow(self):
+        """
+        @retval A dict of the bytes dropped from the front of the line and
+        prompt buffers to keep them under the high-water mark, keyed by
+        'linebuf' and 'promptbuf'.
+        """
+        return dict(self._buffer_overflow)
+
+    def _detect_prompts(self, prompts):
+        """
+        Rebuild the prompt detector if it does not match all of the given
+        prompts yet, feeding the new one the prompt buffer.
+        @param prompts A list of prompts about to be looked for.
+        """
+        with self._buffer_changed:
+            detector = self._prompt_detector
+            if not detector.prompts.issuperset(prompts):
+                detector = PromptDetector(detector.prompts.union(prompts))
+                detector.feed(self._promptbuf)
+                self._prompt_detector = detector
+
+    # Drivers append to and clear these directly, so every assignment
+    # goes through a setter that wakes the waiters.
+    _linebuf = property(lambda self: self._linebuf_data, _set_linebuf)
+    _promptbuf = property(lambda self: self._promptbuf_data, _set_promptbuf)
+
+    def _check_linebuf_cut(self, where):
+        """
+        @param where The method reading a response, for the error.
+        @throw InstrumentProtocolException if the line buffer was cut back
+        while the response was arriving.
+        """
+        if self._linebuf_cut:
+            raise InstrumentProtocolException(
+                'Response longer than the %d byte buffer limit in %s'
+                % (self._buffer_limit, where))
+
+    def _wait_for_data(self, test, timeout):
+        """
+        Wait until a test of the buffers passes. The test is made now and
+        again each time a buffer changes, with the buffers held still.
+        @param test A function returning a true value when the wait is over.
+        @param timeout Seconds to wait.
+        @retval The test's true value, or None if the timeout passed first.
+        """
+        endtime = time.time() + timeout
+        with self._buffer_changed:
+            while True:
+                result = test()
+                if result:
+                    return result
+                remaining = endtime - time.time()
+                if remaining <= 0:
+                    return None
+                self._buffer_changed.wait(remaining)
+
     def _get_response(self, timeout=10, expected_prompt=None):
         """
         Get a response from the instrument
@@ -306,10 +519,10 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         @param expected_prompt Only consider the specific expected prompt as
         presented by this string
         @throw InstrumentProtocolExecption on timeout
+        @throw InstrumentProtocolException if the response overflowed the
+        line buffer
         """
-        # Grab time for timeout and wait for prompt.
-
-        starttime = time.time()
+        # Wait for the prompt, waking each time data arrives.
         if expected_prompt == None:
             prompt_list = self._prompts.list()
         else:
@@ -318,40 +531,39 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
             else:
                 prompt_list = expected_prompt
 
+        self._detect_prompts(prompt_list)
 
-        while True:
-            for item in prompt_list:
-                if self._promptbuf.endswith(item):
-
-                    return (item, self._linebuf)
-                else:
-                    time.sleep(.1)
-
-            if time.time() > starttime + timeout:
-                raise InstrumentTimeoutException("in _get_response()")
-
+        def found_prompt():
+            self._check_linebuf_cut('_get_response()')
+            item = self._prompt_detector.endswith(prompt_list)
+            if item != None:
+                return (item, self._linebuf)
 
+        response = self._wait_for_data(found_prompt, timeout)
+        if response == None:
+            raise InstrumentTimeoutException("in _get_response()")
+        return response
 
     def _get_line_of_response(self, timeout=10, line_delimiter='\r\n', expected_prompt=None):
 
+        expected = [expected_prompt] if expected_prompt else []
+        self._detect_prompts(expected)
 
-
-        starttime = time.time()
-        while True:
+        def found_line():
+            self._check_linebuf_cut('_get_line_of_response()')
             if line_delimiter in self._linebuf:
                 (chunk, pat, remainder) = self._linebuf.partition(line_delimiter)
                 self._linebuf = remainder
                 return(None, chunk + pat)
 
-            elif self._promptbuf.endswith(expected_prompt):
+            elif self._prompt_detector.endswith(expected):
                 (chunk, pat, remainder) = self._linebuf.partition(expected_prompt)
                 return(pat, None)
 
-            else:
-                time.sleep(.1)
-
-            if time.time() > starttime + timeout:
-                raise InstrumentTimeoutException("in _get_line_of_response()")
+        response = self._wait_for_data(found_line, timeout)
+        if response == None:
+            raise InstrumentTimeoutException("in _get_line_of_response()")
+        return response
 
     def _do_cmd_resp(self, cmd, *args, **kwargs):
         """
@@ -361,30 +573,21 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         @param timeout=timeout optional wakeup and command timeout.
         @retval resp_result The (possibly parsed) response result.
         @raises InstrumentTimeoutException if the response did not occur in time.
-        @raises InstrumentProtocolException if command could not be built or if response
-        was not recognized.
+        @raises InstrumentProtocolException if command could not be built, if response
+        was not recognized, or if it overflowed the line buffer.
         """
 
         # Get timeout and initialize response.
         timeout = kwargs.get('timeout', 10)
         expected_prompt = kwargs.get('expected_prompt', None)
         write_delay = kwargs.get('write_delay', 0)
-        retval = None
-        
-        # Get the build handler.
-        build_handler = self._build_handlers.get(cmd, None)
-        if not build_handler:
-            raise InstrumentProtocolException('Cannot build command: %s' % cmd)
 
-        cmd_line = build_handler(cmd, *args)
+        cmd_line = self._build_cmd_line(cmd, args)
 
         # Wakeup the device, pass up exception if timeout
-
         prompt = self._wakeup(timeout)
-        
-        # Clear line and prompt buffers for result.
-
 
+        # Clear line and prompt buffers for result.
         self._linebuf = ''
         self._promptbuf = ''
 
@@ -392,19 +595,107 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         log.debug('_do_cmd_resp: %s, timeout=%s, write_delay=%s, expected_prompt=%s,' %
                         (repr(cmd_line), timeout, write_delay, expected_prompt))
 
-        if (write_delay == 0):
-            self._connection.send(cmd_line)
-        else:
-            for char in cmd_line:
-                self._connection.send(char)
-                time.sleep(write_delay)
+        self._send_data(cmd_line, write_delay, timeout)
 
         # Wait for the prompt, prepare result and return, timeout exception
-
         (prompt, result) = self._get_response(timeout,
                                               expected_prompt=expected_prompt)
 
+        return self._handle_response(cmd, result, prompt)
+
+    def _do_cmd_resp_sequence(self, commands, **kwargs):
+        """
+        Perform a sequence of command-responses on the device, waking it
+        only once. Each command is sent once the prompt ending the previous
+        response has arrived. Pipelined, every command is sent before any
+        response is read, and the data that comes back is split into
+        responses at each prompt, so a prompt must not appear within a
+        response.
+        @param commands A list of commands to execute. Each is a command,
+        or a tuple of a command and the arguments to its build handler.
+        @param timeout=timeout optional wakeup timeout, and the timeout
+        for each response.
+        @param expected_prompt optional prompt or list of prompts ending
+        each response.
+        @param write_delay optional inter-character transmit delay.
+        @param pipeline optional, True to send every command without
+        waiting for the responses, for devices known to buffer input while
+        they answer. Defaults to False.
+        @retval A list of the (possibly parsed) response results, in the
+        order of the commands.
+        @raises InstrumentTimeoutException if a response did not occur in time.
+        @raises InstrumentProtocolException if a command could not be built,
+        if a response was not recognized, or if the responses overflowed the
+        line buffer.
+        """
+        timeout = kwargs.get('timeout', 10)
+        expected_prompt = kwargs.get('expected_prompt', None)
+        write_delay = kwargs.get('write_delay', 0)
+        pipeline = kwargs.get('pipeline', False)
+
+        # Build every command first, so a bad one is found before any is
+        # sent.
+        steps = []
+        for command in commands:
+            if isinstance(command, tuple):
+                (cmd, args) = (command[0], command[1:])
+            else:
+                (cmd, args) = (command, ())
+            steps.append((cmd, self._build_cmd_line(cmd, args)))
+
+        if not steps:
+            return []
+
+        # Wakeup the device once, pass up exception if timeout
+        self._wakeup(timeout)
+
+        log.debug('_do_cmd_resp_sequence: %s, timeout=%s, write_delay=%s, expected_prompt=%s, pipeline=%s' %
+                  (repr([cmd_line for (cmd, cmd_line) in steps]), timeout,
+                   write_delay, expected_prompt, pipeline))
+
+        results = []
+        if pipeline:
+            self._linebuf = ''
+            self._promptbuf = ''
+            for (cmd, cmd_line) in steps:
+                self._send_data(cmd_line, write_delay, timeout)
+            for (cmd, cmd_line) in steps:
+                (prompt, result) = self._get_next_response(timeout,
+                                                           expected_prompt)
+                results.append(self._handle_response(cmd, result, prompt))
+        else:
+            for (cmd, cmd_line) in steps:
+                self._linebuf = ''
+                self._promptbuf = ''
+                self._send_data(cmd_line, write_delay, timeout)
+                (prompt, result) = self._get_response(timeout,
+                                                      expected_prompt=expected_prompt)
+                results.append(self._handle_response(cmd, result, prompt))
+
+        return results
 
+    def _build_cmd_line(self, cmd, args):
+        """
+        Build a command with its build handler.
+        @param cmd The command to build.
+        @param args positional arguments to pass to the build handler.
+        @retval The command line to send to the device.
+        @raises InstrumentProtocolException if there is no build handler.
+        """
+        build_handler = self._build_handlers.get(cmd, None)
+        if not build_handler:
+            raise InstrumentProtocolException('Cannot build command: %s' % cmd)
+        return build_handler(cmd, *args)
+
+    def _handle_response(self, cmd, result, prompt):
+        """
+        Pass a response to the handler for its command, in the current
+        state if there is one for it.
+        @param cmd The command the response is to.
+        @param result The response.
+        @param prompt The prompt ending the response.
+        @retval The handler's result, or None if there is no handler.
+        """
         resp_handler = self._response_handlers.get((self.get_current_state(), cmd), None) or \
             self._response_handlers.get(cmd, None)
         resp_result = None
@@ -412,7 +703,50 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
             resp_result = resp_handler(result, prompt)
 
         return resp_result
-            
+
+    def _get_next_response(self, timeout=10, expected_prompt=None):
+        """
+        Take the oldest response off the front of the line buffer: the data
+        up to and including the first prompt in it.
+        @param timeout The timeout in seconds
+        @param expected_prompt Only consider the specific expected prompt, or
+        list of prompts
+        @retval (prompt, response) tuple
+        @throw InstrumentTimeoutException on timeout
+        @throw InstrumentProtocolException if the responses overflowed the
+        line buffer
+        """
+        if expected_prompt == None:
+            prompt_list = self._prompts.list()
+        elif isinstance(expected_prompt, str):
+            prompt_list = [expected_prompt]
+        else:
+            prompt_list = expected_prompt
+
+        # Longest first, so a prompt is not cut short by one it ends with.
+        prompt_regex = re.compile('|'.join([re.escape(prompt) for prompt in
+                                            sorted(prompt_list, key=len, reverse=True)]))
+        overlap = max([len(prompt) for prompt in prompt_list]) - 1
+
+        # Where the search resumes, past data already searched
+        searched = [0]
+
+        def found_prompt():
+            self._check_linebuf_cut('_get_next_response()')
+            match = prompt_regex.search(self._linebuf,
+                                        min(searched[0], len(self._linebuf)))
+            if match == None:
+                searched[0] = max(0, len(self._linebuf) - overlap)
+                return None
+            response = self._linebuf[:match.end()]
+            self._linebuf = self._linebuf[match.end():]
+            return (match.group(0), response)
+
+        response = self._wait_for_data(found_prompt, timeout)
+        if response == None:
+            raise InstrumentTimeoutException("in _get_next_response()")
+        return response
+
     def _do_cmd_no_resp(self, cmd, *args, **kwargs):
         """
         Issue a command to the instrument after a wake up and clearing of
@@ -445,12 +779,7 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
 
         # Send command.
         log.debug('_do_cmd_no_resp: %s, timeout=%s' % (repr(cmd_line), timeout))
-        if (write_delay == 0):
-            self._connection.send(cmd_line)
-        else:
-            for char in cmd_line:
-                self._connection.send(char)
-                time.sleep(write_delay)
+        self._send_data(cmd_line, write_delay, timeout)
     
     def _do_cmd_direct(self, cmd):
         """
@@ -463,8 +792,35 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
 
         # Send command.
         log.debug('_do_cmd_direct: <%s>' % cmd)
+        self._last_prompt = None
         self._connection.send(cmd)
  
+    def _send_data(self, data, write_delay=0, timeout=10):
+        """
+        Send data to the instrument, either all at once or one character at
+        a time with a delay after each. Paced data is sent by the
+        connection's I/O loop; this waits for it to go out.
+        @param data The string to send.
+        @param write_delay Seconds to wait after each character, 0 to send
+        the data all at once.
+        @param timeout Seconds to allow for a paced send beyond the pacing
+        itself.
+        @throws InstrumentTimeoutException if a paced send did not finish in
+        time.
+        """
+        self._last_prompt = None
+        if write_delay == 0:
+            self._connection.send(data)
+        elif isinstance(self._connection, PortAgentClient):
+            self._connection.send_paced(data, write_delay)
+            if not self._connection.drain(len(data) * write_delay + timeout):
+                raise InstrumentTimeoutException('in _send_data(), sending %s'
+                                                 % repr(data))
+        else:
+            for char in data:
+                self._connection.send(char)
+                time.sleep(write_delay)
+
     ########################################################################
     # Incomming data callback.
     ########################################################################            
@@ -495,33 +851,61 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         
     def  _wakeup(self, timeout, delay=1):
         """
-        Clear buffers and send a wakeup command to the instrument
+        Clear buffers and send a wakeup command to the instrument, returning
+        as soon as a prompt arrives. Unanswered wakeups are repeated, the
+        wait after the first being _wakeup_wait and doubling each time up
+        to delay, or delay each time if _wakeup_wait is None. If the device ended its output with a prompt within the awake
+        window, that prompt is returned without waking it.
         @param timeout The timeout to wake the device.
-        @param delay The time to wait between consecutive wakeups.
+        @param delay The longest time to wait between consecutive wakeups.
+        @retval The prompt the device answered with.
         @throw InstrumentTimeoutException if the device could not be woken.
         """
-        # Clear the prompt buffer.
-
+        prompt = self._awake_prompt()
+        if prompt != None:
+            log.debug('wakeup skipped, awake at prompt: %s' % repr(prompt))
+            return prompt
 
+        # Clear the prompt buffer.
         self._promptbuf = ''
         
         # Grab time for timeout.
         starttime = time.time()
         
+        prompt_list = self._prompts.list()
+        self._detect_prompts(prompt_list)
+
+        def found_prompt():
+            return self._prompt_detector.endswith(prompt_list)
+
+        wait = min(self._wakeup_wait or delay, delay)
         while True:
-            # Send a line return and wait a sec.
+            # Send a line return and wait for a prompt, longer each time.
             log.debug('Sending wakeup.')
             self._send_wakeup()
-            time.sleep(delay)
-
-            for item in self._prompts.list():
-                #log.debug("GOT " + repr(self._promptbuf))
-                if self._promptbuf.endswith(item):
-                    log.debug('wakeup got prompt: %s' % repr(item))
-                    return item
+            prompt = self._wait_for_data(found_prompt, wait)
+            if prompt:
+                log.debug('wakeup got prompt: %s' % repr(prompt))
+                return prompt
 
             if time.time() > starttime + timeout:
                 raise InstrumentTimeoutException("in _wakeup()")
+            wait = min(wait * 2, delay)
+
+    def _awake_prompt(self):
+        """
+        @retval The prompt the device last ended its output with, if that
+        was within the awake window and nothing has been sent or received
+        since, otherwise None.
+        """
+        window = self._awake_window
+        last = self._last_prompt
+        if window == None or last == None:
+            return None
+        (prompt, when) = last
+        if time.time() - when > window:
+            return None
+        return prompt
 
     def _wakeup_until(self, timeout, desired_prompt, delay=1, no_tries=5):
         """
@@ -542,6 +926,8 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
             if prompt == desired_prompt:
                 break
             else:
+                # Wake the device again rather than trust the same prompt.
+                self._last_prompt = None
                 time.sleep(delay)
                 count += 1
                 if count >= no_tries:
@@ -664,11 +1050,14 @@ class MenuInstrumentProtocol(CommandResponseInstrumentProtocol):
         @param driver_event The callback for asynchronous driver events.
         @param read_delay optional kwarg specifying amount of time to delay before
                attempting to read response from instrument (in _get_response).
+        @param buffer_limit optional kwarg, the high-water mark of the line and
+               prompt buffers.
 
         """
         
         # Construct superclass.
-        CommandResponseInstrumentProtocol.__init__(self, prompts, newline, driver_event)
+        CommandResponseInstrumentProtocol.__init__(self, prompts, newline, driver_event,
+            buffer_limit=kwargs.get('buffer_limit', DEFAULT_BUFFER_LIMIT))
         self._menu = menu
 
         # The end of line delimiter.                
@@ -707,6 +1096,8 @@ class MenuInstrumentProtocol(CommandResponseInstrumentProtocol):
         @param expected_prompt Only consider the specific expected prompt as
         presented by this string
         @throw InstrumentProtocolExecption on timeout
+        @throw InstrumentProtocolException if the response overflowed the
+        line buffer
         """
 
         """
@@ -719,9 +1110,6 @@ class MenuInstrumentProtocol(CommandResponseInstrumentProtocol):
         if self._read_delay is not None:
             time.sleep(self._read_delay)
             
-        # Grab time for timeout and wait for prompt.
-        starttime = time.time()
-        
         """
         DHE: It doesn't seem right to go through the list of prompts
         because one wasn't given.  Seems like if you have an expected 
@@ -738,21 +1126,23 @@ class MenuInstrumentProtocol(CommandResponseInstrumentProtocol):
                   %(timeout, expected_prompt, expected_prompt.encode("hex")))
             assert isinstance(expected_prompt, str)
             prompt_list = [expected_prompt]            
-        while True:
-            for item in prompt_list:
-                # DHE: this doesn't work well; changing for now.
-                #if self._promptbuf.endswith(item):
-                log.debug('MenuInstrumentProtocol._get_response: looking for item: %s in promptbuf: %s' 
-                          %(item, self._promptbuf))
-                if item in self._promptbuf:
-                    log.debug('MenuInstrumentProtocol._get_response: FOUND IT!') 
-                    return (item, self._linebuf)
-                else:
-                    time.sleep(.1)
-            if time.time() > starttime + timeout:
-                log.error('MenuInstrumentProtocol._get_response TIMEOUT waiting for item: %s in promptbuf!' 
-                          %(item))
-                raise InstrumentTimeoutException("in _get_response()")
+        self._detect_prompts(prompt_list)
+
+        def found_prompt():
+            # DHE: this doesn't work well; changing for now.
+            #if self._promptbuf.endswith(item):
+            self._check_linebuf_cut('_get_response()')
+            item = self._prompt_detector.contains(prompt_list)
+            if item != None:
+                log.debug('MenuInstrumentProtocol._get_response: FOUND IT!') 
+                return (item, self._linebuf)
+
+        response = self._wait_for_data(found_prompt, timeout)
+        if response == None:
+            log.error('MenuInstrumentProtocol._get_response TIMEOUT waiting for items: %s in promptbuf!' 
+                      %(prompt_list))
+            raise InstrumentTimeoutException("in _get_response()")
+        return response
                
     def _navigate_and_execute(self, cmd, **kwargs):
         """
@@ -835,13 +1225,7 @@ class MenuInstrumentProtocol(CommandResponseInstrumentProtocol):
 
         log.debug('_do_cmd_resp: cmd=%s, timeout=%s, write_delay=%s, expected_prompt=%s,' %
                         (repr(cmd_line), timeout, write_delay, expected_prompt))
-        if (write_delay == 0):
-            self._connection.send(cmd_line)
-        else:
-            #print "---> DHE: do_cmd_resp() sending cmd_line: " + cmd_line
-            for char in cmd_line:
-                self._connection.send(char)
-                time.sleep(write_delay)
+        self._send_data(cmd_line, write_delay, timeout)
 
         # Wait for the prompt, prepare result and return, timeout exception
         (prompt, result) = self._get_response(timeout, expected_prompt=expected_prompt)
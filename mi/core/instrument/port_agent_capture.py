@@ -0,0 +1,600 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.port_agent_capture
+@file mi/core/instrument/port_agent_capture.py
+@brief Record the packets a port agent sends to a capture file, and replay a
+capture file to a PortAgentClient in place of the port agent.
+
+A capture file is a small file header, then every packet exactly as it came
+from the port agent, header and data, then an index and a footer:
+
+    file header  '>5sBH'   magic 'PACAP', version, index interval
+    packets      the 16 byte port agent header followed by the data
+    index        '>QQd'    packet number, file offset, timestamp; one entry
+                           for every index interval packets
+    footer       '>QQL4s'  index offset, packet count, index entry count,
+                           magic 'PAIX'
+
+Packets carry the port agent timestamp in their header, so the capture needs
+no timing of its own. A capture that was not closed has no index or footer;
+the reader rebuilds the index by scanning the packets.
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import mmap
+import errno
+import socket
+import select
+import struct
+import threading
+import time
+
+from mi.core.log import get_logger ; log = get_logger()
+from mi.core.exceptions import InstrumentDataException
+from mi.core.instrument.port_agent_client import PortAgentPacket
+from mi.core.instrument.port_agent_client import HEADER_SIZE
+from mi.core.instrument.port_agent_client import SYNC_BYTES
+from mi.core.instrument.port_agent_client import NTP_FRACTION_SCALE
+from mi.core.instrument.port_agent_client import RETRY_ERRNOS
+
+MAGIC = 'PACAP'
+VERSION = 1
+FILE_HEADER = struct.Struct('>5sBH')
+
+INDEX_MAGIC = 'PAIX'
+INDEX_ENTRY = struct.Struct('>QQd')
+FOOTER = struct.Struct('>QQL4s')
+
+"""
+Packets between index entries
+"""
+DEFAULT_INDEX_INTERVAL = 256
+
+"""
+The most data the replay server sends at once when running as fast as
+possible
+"""
+REPLAY_CHUNK_SIZE = 65536
+
+PACKET_LENGTH = struct.Struct('>H')
+PACKET_TIMESTAMP = struct.Struct('>LL')
+
+def _packet_timestamp(data, offset):
+    """
+    The port agent timestamp of the packet at offset, in NTP seconds.
+    """
+    (high, low) = PACKET_TIMESTAMP.unpack_from(data, offset + 8)
+    return high + low / NTP_FRACTION_SCALE
+
+class CaptureWriter(object):
+    """
+    Writes port agent packets to a capture file. Packets are written in the
+    order given; the index is written when the capture is closed.
+    """
+
+    def __init__(self, path, index_interval=DEFAULT_INDEX_INTERVAL):
+        """
+        Create the capture file, replacing any file already there.
+        @param path The file to write.
+        @param index_interval Packets between index entries.
+        """
+        self.path = path
+        self._interval = index_interval
+        self._file = open(path, 'wb')
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, index_interval))
+        self._offset = FILE_HEADER.size
+        self._count = 0
+        self._index = []
+        self._lock = threading.Lock()
+
+    def write_packet(self, paPacket):
+        """
+        Record a packet received from the port agent.
+        @param paPacket A PortAgentPacket with its header unpacked.
+        """
+        self.write_raw(str(bytearray(paPacket.get_header())) +
+                       paPacket.get_data())
+
+    def write_raw(self, packet):
+        """
+        Record a packet as it came off the wire.
+        @param packet A string holding one packet, header and data.
+        """
+        with self._lock:
+            if self._file == None:
+                return
+            if self._count % self._interval == 0:
+                self._index.append((self._count, self._offset,
+                                    _packet_timestamp(packet, 0)))
+            self._file.write(packet)
+            self._offset += len(packet)
+            self._count += 1
+
+    def get_count(self):
+        """
+        @retval The number of packets written.
+        """
+        return self._count
+
+    def close(self):
+        """
+        Write the index and close the file.
+        """
+        with self._lock:
+            if self._file == None:
+                return
+            for entry in self._index:
+                self._file.write(INDEX_ENTRY.pack(*entry))
+            self._file.write(FOOTER.pack(self._offset, self._count,
+                                         len(self._index), INDEX_MAGIC))
+            self._file.close()
+            self._file = None
+        log.info('Captured %d port agent packets to %s' % (self._count, self.path))
+
+class CaptureReader(object):
+    """
+    Reads a capture file. The file is memory mapped, so packets are sliced
+    straight out of it and seeking by packet number or time only touches
+    the packets after the nearest index entry.
+    """
+
+    def __init__(self, path):
+        """
+        Open and map a capture file.
+        @param path The file to read.
+        @raises InstrumentDataException if the file is not a capture file.
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            self._file.close()
+            raise InstrumentDataException('%s is not a port agent capture' % path)
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, interval) = FILE_HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise InstrumentDataException('%s is not a version %d port agent capture'
+                                          % (path, VERSION))
+        self._interval = interval
+        if not self._read_index(size):
+            log.warn('%s has no index, scanning for packets' % path)
+            self._scan(size)
+
+    def _read_index(self, size):
+        """
+        Load the index from the end of the file.
+        @retval False if the capture has no valid footer.
+        """
+        if size < FILE_HEADER.size + FOOTER.size:
+            return False
+        (end, count, entries, magic) = FOOTER.unpack_from(self._data,
+                                                          size - FOOTER.size)
+        if magic != INDEX_MAGIC or \
+           end + entries * INDEX_ENTRY.size + FOOTER.size != size:
+            return False
+        self._end = end
+        self._count = count
+        self._index = [INDEX_ENTRY.unpack_from(self._data, end + i * INDEX_ENTRY.size)
+                       for i in xrange(entries)]
+        return True
+
+    def _scan(self, size):
+        """
+        Rebuild the index of a capture that was not closed. A packet cut off
+        by the end of the file is ignored.
+        """
+        data = self._data
+        offset = FILE_HEADER.size
+        count = 0
+        index = []
+        while offset + HEADER_SIZE <= size:
+            if data[offset:offset + len(SYNC_BYTES)] != SYNC_BYTES:
+                raise InstrumentDataException('%s is corrupt at offset %d'
+                                              % (self.path, offset))
+            length = PACKET_LENGTH.unpack_from(data, offset + 4)[0]
+            if length < HEADER_SIZE or offset + length > size:
+                break
+            if count % self._interval == 0:
+                index.append((count, offset, _packet_timestamp(data, offset)))
+            offset += length
+            count += 1
+        self._end = offset
+        self._count = count
+        self._index = index
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        """
+        Unmap and close the file.
+        """
+        self._data.close()
+        self._file.close()
+
+    def _start_of(self, entry):
+        """
+        @retval (packet number, offset) to scan forward from for an index
+        entry number.
+        """
+        if not self._index:
+            return (0, FILE_HEADER.size)
+        return self._index[entry][0:2]
+
+    def offset_of(self, number):
+        """
+        @param number A packet number.
+        @retval The file offset of the packet.
+        """
+        (current, offset) = self._start_of(min(number // self._interval,
+                                                len(self._index) - 1))
+        data = self._data
+        while current < number and offset < self._end:
+            offset += PACKET_LENGTH.unpack_from(data, offset + 4)[0]
+            current += 1
+        return offset
+
+    def find_time(self, timestamp):
+        """
+        Find the first packet at or after a time.
+        @param timestamp An NTP timestamp.
+        @retval The packet number, the packet count if no packet is that late.
+        """
+        entry = 0
+        for (i, (number, offset, time_stamp)) in enumerate(self._index):
+            if time_stamp > timestamp:
+                break
+            entry = i
+        (current, offset) = self._start_of(entry)
+        data = self._data
+        while offset < self._end and _packet_timestamp(data, offset) < timestamp:
+            offset += PACKET_LENGTH.unpack_from(data, offset + 4)[0]
+            current += 1
+        return current
+
+    def raw_packets(self, start=0, stop=None):
+        """
+        Iterate over the packets as they came off the wire.
+        @param start The first packet number.
+        @param stop The packet number to stop before, the end if None.
+        @retval A generator of (timestamp, raw packet string).
+        """
+        if stop == None or stop > self._count:
+            stop = self._count
+        data = self._data
+        offset = self.offset_of(start)
+        for number in xrange(start, stop):
+            length = PACKET_LENGTH.unpack_from(data, offset + 4)[0]
+            yield (_packet_timestamp(data, offset), data[offset:offset + length])
+            offset += length
+
+    def packets(self, start=0, stop=None):
+        """
+        Iterate over the packets.
+        @param start The first packet number.
+        @param stop The packet number to stop before, the end if None.
+        @retval A generator of PortAgentPacket objects.
+        """
+        for (timestamp, raw) in self.raw_packets(start, stop):
+            paPacket = PortAgentPacket()
+            paPacket.unpack_header(raw[:HEADER_SIZE])
+            paPacket.attach_data(raw[HEADER_SIZE:])
+            yield paPacket
+
+    def __iter__(self):
+        return self.packets()
+
+class PortAgentServer(object):
+    """
+    Stands in for a port agent, serving port agent packets to each client
+    that connects, one at a time, until stopped. A stopped server can be
+    started again on the same port. Subclasses say what to send in _serve.
+    Whatever the client sends is handed to _received.
+    """
+
+    def __init__(self, port=0, host='127.0.0.1'):
+        """
+        @param port The port to listen on, any free port if 0.
+        @param host The address to listen on.
+        """
+        self.host = host
+        self.port = port
+        self._listen_sock = None
+        self._listen()
+
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.elapsed = None
+        self._conn = None
+        self._thread = None
+        self._done = False
+        self._finished = threading.Event()
+
+    def _listen(self):
+        """
+        Open the listening socket. The port is kept, so a restarted server
+        listens where it did before.
+        """
+        self._listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listen_sock.bind((self.host, self.port))
+        self._listen_sock.listen(1)
+        self.port = self._listen_sock.getsockname()[1]
+
+    def start(self):
+        """
+        Start waiting for clients on a thread of its own, unless already
+        started.
+        """
+        if self._thread:
+            return
+        if self._listen_sock == None:
+            self._listen()
+        self._done = False
+        self._finished.clear()
+        self._thread = threading.Thread(target=self.run,
+                                        name=self.__class__.__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving, close the sockets and wait for the thread to end.
+        """
+        self._done = True
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        if self._listen_sock:
+            self._listen_sock.close()
+            self._listen_sock = None
+
+    def wait(self, timeout=None):
+        """
+        Wait for everything to be served.
+        @param timeout Seconds to wait, forever if None.
+        @retval True if everything was sent.
+        """
+        self._finished.wait(timeout)
+        return self._finished.is_set()
+
+    def run(self):
+        """
+        Accept clients and serve each in turn until stopped.
+        """
+        while not self._done:
+            (readable, writable, errored) = select.select(
+                [self._listen_sock], [], [], 0.5)
+            if readable and not self._done:
+                self._serve_client()
+
+    def _serve_client(self):
+        """
+        Accept a client, serve it and close the connection.
+        """
+        name = self.__class__.__name__
+        try:
+            (self._conn, addr) = self._listen_sock.accept()
+            self._conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            log.info('%s: serving %s:%i' % (name, addr[0], addr[1]))
+
+            started = time.time()
+            self._serve(started)
+            self.elapsed = time.time() - started
+            if not self._done:
+                self._finished.set()
+            log.info('%s: sent %d packets, %d bytes in %.3f s'
+                     % (name, self.packets_sent, self.bytes_sent, self.elapsed))
+        except socket.error as e:
+            log.error('%s: connection failed: %s' % (name, str(e)))
+        finally:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+    def _serve(self, started):
+        """
+        Send the client its packets. Overridden by subclasses.
+        @param started The time the client connected.
+        """
+        pass
+
+    def _received(self, data):
+        """
+        Called with what the client sends. Dropped unless overridden.
+        """
+        pass
+
+    def _send_at(self, due, data, count):
+        """
+        Wait until a time, taking what the client sends meanwhile, then
+        send.
+        @retval False if serving was stopped or the client went away.
+        """
+        while not self._done:
+            remaining = due - time.time()
+            if remaining <= 0:
+                return self._send(data, count)
+            if not self._read_input(min(remaining, 0.5)):
+                return False
+        return False
+
+    def _read_input(self, timeout):
+        """
+        Wait up to timeout for the client to send, and take what it sends.
+        @retval False if the client closed the connection.
+        """
+        (readable, writable, errored) = select.select([self._conn], [], [], timeout)
+        if not readable:
+            return True
+        try:
+            data = self._conn.recv(4096)
+        except socket.error as e:
+            if e.args and e.args[0] in RETRY_ERRNOS:
+                return True
+            raise
+        self.bytes_received += len(data)
+        if data:
+            self._received(data)
+        return len(data) > 0
+
+    def _send(self, data, count):
+        """
+        Send data, taking client data first so neither side stalls.
+        @param data One or more packets.
+        @param count The number of packets in data.
+        @retval False if serving was stopped or the client went away.
+        """
+        if self._done:
+            return False
+        self._read_input(0)
+        return self._send_now(data, count)
+
+    def _send_now(self, data, count):
+        """
+        Send data without taking client data first.
+        @retval False if the client went away.
+        """
+        try:
+            self._conn.sendall(data)
+        except socket.error as e:
+            if e.args and e.args[0] in (errno.EPIPE, errno.ECONNRESET):
+                log.info('%s: client closed the connection'
+                         % self.__class__.__name__)
+                return False
+            raise
+        self.packets_sent += count
+        self.bytes_sent += len(data)
+        return True
+
+class ReplayServer(PortAgentServer):
+    """
+    Serves a capture file in place of the port agent. Packets are sent at
+    their recorded timing, scaled by speed, or as fast as the client takes
+    them when speed is None.
+    """
+
+    def __init__(self, path, port=0, host='127.0.0.1', speed=None,
+                 start=0, stop=None):
+        """
+        @param path The capture file to serve.
+        @param port The port to listen on, any free port if 0.
+        @param host The address to listen on.
+        @param speed How many times faster than recorded to replay, or None
+        to replay as fast as possible.
+        @param start The first packet number to replay.
+        @param stop The packet number to stop before, the end if None.
+        """
+        self._path = path
+        self.reader = CaptureReader(path)
+        PortAgentServer.__init__(self, port, host)
+        self.speed = speed
+        self._start = start
+        self._stop = stop
+
+    def start(self):
+        """
+        Start replaying, opening the capture again if the server was stopped.
+        """
+        if self.reader == None:
+            self.reader = CaptureReader(self._path)
+        PortAgentServer.start(self)
+
+    def stop(self):
+        """
+        Stop replaying and close the capture.
+        """
+        PortAgentServer.stop(self)
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+
+    def _serve(self, started):
+        """
+        Send the capture.
+        """
+        if self.speed:
+            self._replay_timed(started)
+        else:
+            self._replay_fast()
+
+    def _replay_fast(self):
+        """
+        Send the packets back to back, a chunk at a time.
+        """
+        chunk = []
+        size = 0
+        for (timestamp, raw) in self.reader.raw_packets(self._start, self._stop):
+            chunk.append(raw)
+            size += len(raw)
+            if size >= REPLAY_CHUNK_SIZE:
+                if not self._send(''.join(chunk), len(chunk)):
+                    return
+                chunk = []
+                size = 0
+        if chunk:
+            self._send(''.join(chunk), len(chunk))
+
+    def _replay_timed(self, started):
+        """
+        Send each packet when it comes due. Packets due at once go out in
+        one send.
+        """
+        first = None
+        chunk = []
+        due = started
+        for (timestamp, raw) in self.reader.raw_packets(self._start, self._stop):
+            if first == None:
+                first = timestamp
+            packet_due = started + (timestamp - first) / self.speed
+            if chunk and packet_due > due:
+                if not self._send_at(due, ''.join(chunk), len(chunk)):
+                    return
+                chunk = []
+            due = packet_due
+            chunk.append(raw)
+        if chunk:
+            self._send_at(due, ''.join(chunk), len(chunk))
+
+def benchmark(path, callback, batch=False, start=0, stop=None):
+    """
+    Time a callback, such as a driver protocol's got_data, over a capture.
+    The packets are read and checksummed before the clock starts, so only
+    the callback is timed.
+    @param path The capture file.
+    @param callback Called with each PortAgentPacket, or with the list of
+    all of them if batch is True.
+    @param batch If True, make one call with every packet.
+    @param start The first packet number.
+    @param stop The packet number to stop before, the end if None.
+    @retval A dict of packets, bytes, seconds, packets_per_sec and
+    bytes_per_sec.
+    """
+    reader = CaptureReader(path)
+    try:
+        packets = list(reader.packets(start, stop))
+    finally:
+        reader.close()
+    for paPacket in packets:
+        paPacket.verify_checksum()
+    size = sum([paPacket.get_data_size() for paPacket in packets])
+
+    started = time.time()
+    if batch:
+        callback(packets)
+    else:
+        for paPacket in packets:
+            callback(paPacket)
+    seconds = time.time() - started
+
+    return {'packets': len(packets),
+            'bytes': size,
+            'seconds': seconds,
+            'packets_per_sec': len(packets) / seconds if seconds else None,
+            'bytes_per_sec': size / seconds if seconds else None}
@@ -11,21 +11,47 @@ and logging.
 __author__ = 'David Everett'
 __license__ = 'Apache 2.0'
 
+import os
 import socket
+import select
+import errno
 import threading
 import time
 import struct
 import array
 import binascii
+from collections import deque
 
 from mi.core.log import get_logger ; log = get_logger()
 from mi.core.exceptions import InstrumentConnectionException
 
 HEADER_SIZE = 16
 
+"""
+Every header starts with these sync bytes
+"""
+SYNC_BYTES = '\xa3\x9d\x7a'
+
+"""
+The packet length field is 16 bits, so a receive buffer this size always
+has room for a whole packet.
+"""
+RECV_BUFFER_SIZE = 65536
+
+"""
+How long the listener waits for data before checking if it should stop
+"""
+SELECT_TIMEOUT = 0.5
+
+"""
+Socket errors that just mean try again
+"""
+RETRY_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
 """
 Packet Types
 """
+DATA_FROM_INSTRUMENT = 1
 DATA_FROM_DRIVER = 2
 
 """
@@ -40,6 +66,23 @@ Offsets into the unpacked header fields
 OFFSET_UP_TYPE = 3
 OFFSET_UP_LENGTH = 4
 OFFSET_UP_CHECKSUM = 5
+OFFSET_UP_TIMESTAMP_UPPER = 6
+OFFSET_UP_TIMESTAMP_LOWER = 7
+
+"""
+The port agent timestamp is a 64 bit NTP time, the lower word is the
+fraction of a second
+"""
+NTP_FRACTION_SCALE = float(2**32)
+
+def _sum_bytes(data):
+    """
+    Sum the byte values of a string, bytearray or array of bytes. The sum is
+    done in C rather than unpacking a byte at a time.
+    """
+    if isinstance(data, array.array):
+        return sum(data)
+    return sum(bytearray(data))
 
 class PortAgentPacket():
     """
@@ -63,10 +106,15 @@ class PortAgentPacket():
         self.__type = up_header[OFFSET_UP_TYPE]
         self.__length = int(up_header[OFFSET_UP_LENGTH]) - HEADER_SIZE
         self.__recv_checksum  = int(up_header[OFFSET_UP_CHECKSUM])
+        self.__timestamp_high = up_header[OFFSET_UP_TIMESTAMP_UPPER]
+        self.__timestamp_low = up_header[OFFSET_UP_TIMESTAMP_LOWER]
 
-    def pack_header(self, packet_type):
+    def pack_header(self, packet_type, timestamp=None):
         """
         Given a type and length, pack a header to be sent to the port agent.
+        @param packet_type The packet type.
+        @param timestamp The NTP time to put in the header, as the port agent
+        does for data it received, or None to leave it 0.
         """
         if self.__data == None:
             log.error('pack_header: no data!')
@@ -76,8 +124,14 @@ class PortAgentPacket():
         else:
             self.__type = packet_type
             self.__length = len(self.__data)
+            if timestamp == None:
+                (high, low) = (0, 0)
+            else:
+                high = int(timestamp)
+                low = int((timestamp - high) * NTP_FRACTION_SCALE)
+                (self.__timestamp_high, self.__timestamp_low) = (high, low)
             
-            up_header = (0xa3, 0x9d, 0x7a, self.__type, self.__length + HEADER_SIZE, 0, 0, 0)
+            up_header = (0xa3, 0x9d, 0x7a, self.__type, self.__length + HEADER_SIZE, 0, high, low)
             format = '>BBBBHHLL'
             size = struct.calcsize(format)
             self.__header = array.array('B', '\0' * HEADER_SIZE)
@@ -89,32 +143,27 @@ class PortAgentPacket():
             populated header fields
             """
             self.__checksum = self.calculate_checksum()
+            self.__recv_checksum = self.__checksum & 0xFFFF
+            struct.pack_into('>H', self.__header, OFFSET_P_CHECKSUM_LOW,
+                             self.__recv_checksum)
         
     def attach_data(self, data):
         self.__data = data
 
     def calculate_checksum(self):
-        checksum = 0
-        for i in range(HEADER_SIZE):
-            if i < OFFSET_P_CHECKSUM_LOW or i > OFFSET_P_CHECKSUM_HIGH:
-                checksum += struct.unpack_from('B', str(self.__header[i]))[0]
-                
-        for i in range(self.__length):
-            checksum += struct.unpack_from('B', str(self.__data[i]))[0]
-            
-        return checksum
-            
+        """
+        Sum the header bytes, skipping the checksum field itself, and the
+        data bytes.
+        """
+        return _sum_bytes(self.__header[:OFFSET_P_CHECKSUM_LOW]) + \
+               _sum_bytes(self.__header[OFFSET_P_CHECKSUM_HIGH + 1:HEADER_SIZE]) + \
+               _sum_bytes(self.__data[:self.__length])
                                 
     def verify_checksum(self):
-        checksum = 0
-        for i in range(HEADER_SIZE):
-            if i < OFFSET_P_CHECKSUM_LOW or i > OFFSET_P_CHECKSUM_HIGH:
-                checksum += struct.unpack_from('B', self.__header[i])[0]
-                
-        for i in range(self.__length):
-            checksum += struct.unpack_from('B', self.__data[i])[0]
+        checksum = self.calculate_checksum()
             
-        if checksum == self.__recv_checksum:
+        # the header only has room for the low 16 bits of the sum
+        if checksum & 0xFFFF == self.__recv_checksum:
             self.__isValid = True
         else:
             self.__isValid = False
@@ -130,6 +179,15 @@ class PortAgentPacket():
     def get_data(self):
         return self.__data
     
+    def get_timestamp(self):
+        """
+        The time the port agent received the data, as an NTP timestamp in
+        seconds. None if the packet did not come from the port agent.
+        """
+        if self.__timestamp_high == None:
+            return None
+        return self.__timestamp_high + self.__timestamp_low / NTP_FRACTION_SCALE
+    
     def is_valid(self):
         return self.__isValid
                     
@@ -140,11 +198,18 @@ class PortAgentClient(object):
     of port agent. From the instrument driver's perspective, data is sent 
     to the port agent with this client's send method, and data is received 
     asynchronously via a callback from this client's listener thread.
+    In batch mode the callback is handed a list of every packet that arrived
+    in one read instead of being called once per packet. Given a capture,
+    every packet received is recorded to it before being handed on.
     """
     
-    def __init__(self, host, port, delim=None):
+    def __init__(self, host, port, delim=None, batch=False, capture=None):
         """
         Logger client constructor.
+        @param batch If True the callback is called with a list of packets.
+        @param capture A CaptureWriter to record the received packets to. It
+        stays open across stop_comms and init_comms, so a reconnect keeps
+        recording to the same file; close_capture closes it.
         """
         self.host = host
         self.port = port
@@ -152,6 +217,9 @@ class PortAgentClient(object):
         self.listener_thread = None
         self.stop_event = None
         self.delim = delim
+        self.batch = batch
+        self.capture = capture
+        self.writer = None
         
     def init_comms(self, callback=None):
         """
@@ -167,9 +235,9 @@ class PortAgentClient(object):
             self.sock.connect((self.host, self.port))
             self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.sock.setblocking(0)
+            self.writer = PacketWriter()
             self.user_callback = callback        
-            self.listener_thread = Listener(self.sock, self.delim, self.callback)
-            self.listener_thread.start()
+            self._start_listener()
             log.info('PortAgentClient.init_comms(): connected to port agent at %s:%i.'
                            % (self.host, self.port))        
         except:
@@ -183,13 +251,44 @@ class PortAgentClient(object):
         logger. This is called by the done function.
         """
         log.info('Logger shutting down comms.')
-        self.listener_thread.done()
-        self.listener_thread.join()
+        self._stop_listener()
         #-self.sock.shutdown(socket.SHUT_RDWR)
         self.sock.close()
         self.sock = None
         log.info('Logger client comms stopped.')
 
+    def close_capture(self):
+        """
+        Close the capture, if any, once the client will not be connected
+        again. Packets received afterwards are not recorded.
+        """
+        if self.capture:
+            self.capture.close()
+            self.capture = None
+
+    def _start_listener(self):
+        """
+        Start listening for packets on the connected socket, with a listener
+        thread of our own.
+        """
+        if self.batch:
+            self.listener_thread = Listener(self.sock, self.delim,
+                                            batch_callback=self.batch_callback,
+                                            writer=self.writer)
+        else:
+            self.listener_thread = Listener(self.sock, self.delim, self.callback,
+                                            writer=self.writer)
+        self.listener_thread.start()
+
+    def _stop_listener(self):
+        """
+        Stop the listener thread and wait for it to finish.
+        """
+        self.listener_thread.done()
+        self.listener_thread.join()
+        self.listener_thread.close()
+        self.listener_thread = None
+
     def done(self):
         """
         Synonym for stop_comms.
@@ -202,42 +301,385 @@ class PortAgentClient(object):
         contained in a packet object.  
         """
         paPacket.verify_checksum()
+        if self.capture:
+            self.capture.write_packet(paPacket)
         self.user_callback(paPacket)
-        
-    def send(self, data):
+
+    def batch_callback(self, packets):
         """
-        Send data to the port agent.
+        One or more packets have been received from the port agent in a
+        single read. Used in place of callback in batch mode.
+        @param packets A list of packet objects in the order received.
         """
+        for paPacket in packets:
+            paPacket.verify_checksum()
+            if self.capture:
+                self.capture.write_packet(paPacket)
+        self.user_callback(packets)
         
+    def send(self, data, block=True, timeout=None):
+        """
+        Send data to the port agent, after anything sent before it. By
+        default this waits until the data has been written to the socket.
+        With block False it returns right away: whatever the socket does
+        not take is buffered and sent by the listener as the socket drains,
+        and a failed write is only logged. A send from the listener's own
+        thread, such as from a data callback, never blocks, since that
+        thread is the one that has to send what is buffered.
+        @param data The string to send.
+        @param block False to return without waiting for the write.
+        @param timeout Seconds to wait for the write, None for no limit.
+        @raises InstrumentConnectionException if a blocking send failed or
+        timed out.
+        """
+        if not self.sock:
+            return
+        if not block or self._on_listener_thread():
+            self.writer.write(data)
+            self._flush()
+            return
+
+        self.writer.write(data)
+        try:
+            pending = self.writer.flush_to(self.sock)
+        except socket.error as e:
+            raise InstrumentConnectionException(
+                'Error sending to port agent at %s:%i: %s'
+                % (self.host, self.port, str(e)))
+        if pending:
+            if not self._listener_running():
+                raise InstrumentConnectionException(
+                    'Port agent listener at %s:%i is not running'
+                    % (self.host, self.port))
+            self._wakeup_listener()
+            if not self.writer.drain(timeout):
+                raise InstrumentConnectionException(
+                    'Could not send to port agent at %s:%i'
+                    % (self.host, self.port))
+
+    def send_paced(self, data, delay):
+        """
+        Send data to the port agent one character at a time, waiting delay
+        seconds after each, for instruments that cannot keep up. Returns
+        right away; the characters are sent by the listener. Anything sent
+        afterwards goes out after the last paced character and its delay.
+        Use drain to wait for them to go out.
+        """
         if self.sock:
-            while len(data) > 0:
-                try:
-                    sent = self.sock.send(data)
-                    gone = data[:sent]
-                    data = data[sent:]
-                except socket.error:
-                    time.sleep(.1)
+            self.writer.write_paced(data, delay)
+            self._flush()
+
+    def drain(self, timeout):
+        """
+        Wait for everything sent so far to go out to the port agent.
+        @param timeout Seconds to wait, None for no limit.
+        @retval True if everything was sent.
+        """
+        if not self.sock:
+            return True
+        return self.writer.drain(timeout)
+
+    def _flush(self):
+        """
+        Send what can be sent now and leave the rest for the listener.
+        """
+        try:
+            pending = self.writer.flush_to(self.sock)
+        except socket.error as e:
+            # the listener notices and reports the broken connection
+            log.error('Error sending to port agent at %s:%i: %s'
+                      % (self.host, self.port, str(e)))
+            pending = True
+        if pending:
+            self._wakeup_listener()
+
+    def _wakeup_listener(self):
+        """
+        Tell the listener there is data for it to send.
+        """
+        if self.listener_thread:
+            self.listener_thread.wakeup()
+
+    def _on_listener_thread(self):
+        """
+        @retval True if called from the thread that sends what the socket
+        has not taken yet.
+        """
+        return threading.current_thread() is self.listener_thread
+
+    def _listener_running(self):
+        """
+        @retval True if the listener is there to send what the socket
+        has not taken yet.
+        """
+        return self.listener_thread != None and self.listener_thread.is_alive()
 
                 
+class PacketReader(object):
+    """
+    Reads port agent packets off a socket into a preallocated buffer with
+    recv_into, then splits out every complete packet in the buffer at once.
+    Partial packets stay in the buffer until the rest arrives.
+    """
+    
+    def __init__(self, buffer_size=RECV_BUFFER_SIZE):
+        """
+        @param buffer_size The size of the receive buffer. It must be able to
+        hold the largest packet.
+        """
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # the unparsed data is self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = 0
+        
+    def read_from(self, sock):
+        """
+        Receive whatever the socket has ready, as much as fits in the buffer.
+        @param sock The socket to read from.
+        @retval The number of bytes read, 0 if the other end closed.
+        @raises socket.error if the receive failed.
+        """
+        if self._end == len(self._buffer):
+            self._compact()
+        count = sock.recv_into(self._view[self._end:])
+        self._end += count
+        return count
+        
+    def get_packets(self):
+        """
+        Split the complete packets out of the buffer. Data before a header
+        that does not start with the sync bytes is dropped.
+        @retval A list of PortAgentPacket objects, possibly empty.
+        """
+        packets = []
+        buffer = self._buffer
+        view = self._view
+        start = self._start
+        end = self._end
+        
+        while end - start >= HEADER_SIZE:
+            if buffer[start:start + len(SYNC_BYTES)] != SYNC_BYTES:
+                start = self._resync(start + 1, end)
+                continue
+            
+            length = struct.unpack_from('>H', buffer, start + 4)[0]
+            if length < HEADER_SIZE:
+                log.error('Invalid port agent packet length %d, resyncing' % length)
+                start = self._resync(start + 1, end)
+                continue
+            if end - start < length:
+                break
+            
+            paPacket = PortAgentPacket()
+            paPacket.unpack_header(view[start:start + HEADER_SIZE].tobytes())
+            paPacket.attach_data(view[start + HEADER_SIZE:start + length].tobytes())
+            packets.append(paPacket)
+            start += length
+            
+        if start == end:
+            start = end = 0
+        self._start = start
+        self._end = end
+        return packets
+    
+    def _resync(self, start, end):
+        """
+        Find the next header sync in the buffer.
+        @retval The index of the sync, or where a sync split across the end
+        of the data could start.
+        """
+        log.error('Port agent packet out of sync, dropping data')
+        index = self._buffer.find(SYNC_BYTES, start, end)
+        if index < 0:
+            index = max(start, end - len(SYNC_BYTES) + 1)
+        return index
+        
+    def _compact(self):
+        """
+        Move the unparsed data to the front of the buffer.
+        """
+        size = self._end - self._start
+        self._buffer[0:size] = self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = size
+        
+class PacketWriter(object):
+    """
+    Buffers data going to the port agent so senders never block on the
+    socket. Back to back writes are coalesced into a single send, and paced
+    writes go out one character at a time with a delay after each. Whatever
+    the socket will not take right away is left for the I/O loop that owns
+    the socket, which waits for the socket to become writable or for the
+    next paced character to come due instead of sleeping.
+    """
+    
+    def __init__(self):
+        # each entry is [data, delay, offset of the unsent data], sent in
+        # order. Unpaced entries have a delay of 0.
+        self._queue = deque()
+        self._due = 0
+        self._blocked = False
+        self._condition = threading.Condition()
+        
+        # set once unsent data has been thrown away
+        self._cleared = False
+        
+    def write(self, data):
+        """
+        Queue data to send as soon as the socket allows.
+        @param data The string to send.
+        """
+        with self._condition:
+            if self._queue and self._queue[-1][1] == 0:
+                entry = self._queue[-1]
+                if entry[2]:
+                    del entry[0][:entry[2]]
+                    entry[2] = 0
+                entry[0].extend(data)
+            else:
+                self._queue.append([bytearray(data), 0, 0])
+                
+    def write_paced(self, data, delay):
+        """
+        Queue data to send one character at a time, waiting delay seconds
+        after each character before sending anything else.
+        @param data The string to send.
+        @param delay Seconds to wait after each character.
+        """
+        if delay <= 0:
+            self.write(data)
+            return
+        with self._condition:
+            self._queue.append([bytearray(data), delay, 0])
+            
+    def pending(self):
+        """
+        @retval True if there is data left to send.
+        """
+        return len(self._queue) > 0
+    
+    def is_blocked(self):
+        """
+        @retval True if the last flush stopped because the socket was full.
+        """
+        return self._blocked
+    
+    def time_until_due(self):
+        """
+        @retval Seconds until data can be sent, 0 if it can be sent now, or
+        None if there is nothing to send or the socket is full.
+        """
+        with self._condition:
+            if not self._queue or self._blocked:
+                return None
+            return max(0, self._due - time.time())
+        
+    def flush_to(self, sock):
+        """
+        Send as much of the queued data as the socket takes without
+        blocking and the pacing allows.
+        @param sock A non blocking socket.
+        @retval True if data is still pending.
+        @raises socket.error if the send failed for a reason other than
+        the socket being full.
+        """
+        with self._condition:
+            self._blocked = False
+            queue = self._queue
+            while queue:
+                now = time.time()
+                if now < self._due:
+                    break
+                entry = queue[0]
+                (data, delay, offset) = entry
+                if delay:
+                    chunk = str(data[offset:offset + 1])
+                else:
+                    chunk = buffer(data, offset)
+                try:
+                    sent = sock.send(chunk)
+                except socket.error as e:
+                    if e.args and e.args[0] in RETRY_ERRNOS:
+                        self._blocked = True
+                        break
+                    raise
+                
+                offset += sent
+                if delay:
+                    self._due = now + delay
+                if offset < len(data):
+                    entry[2] = offset
+                    if not delay:
+                        # the socket took less than offered, so it is full
+                        self._blocked = True
+                        break
+                else:
+                    queue.popleft()
+                    
+            if not queue:
+                self._condition.notify_all()
+            return len(queue) > 0
+        
+    def drain(self, timeout):
+        """
+        Wait until all the queued data has been sent.
+        @param timeout Seconds to wait, None for no limit.
+        @retval True if everything was sent, False on timeout or if unsent
+        data was thrown away by clear.
+        """
+        if timeout != None:
+            end = time.time() + timeout
+        with self._condition:
+            while self._queue:
+                if timeout == None:
+                    self._condition.wait()
+                    continue
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return not self._cleared
+            
+    def clear(self):
+        """
+        Throw away any unsent data and release anyone waiting on drain.
+        """
+        with self._condition:
+            if self._queue:
+                self._cleared = True
+            self._queue.clear()
+            self._blocked = False
+            self._condition.notify_all()
+        
 class Listener(threading.Thread):
     """
     A listener thread to monitor the client socket data incoming from
     the port agent process. 
     """
     
-    def __init__(self, sock, delim, callback=None):
+    def __init__(self, sock, delim, callback=None, batch_callback=None,
+                 writer=None):
         """
         Listener thread constructor.
         @param sock The socket to listen on.
         @param delim The line delimiter to split incoming lines on, used in
         debugging when no callback is supplied.
         @param callback The callback on data arrival.
+        @param batch_callback The callback on data arrival with the list of
+        packets from each read. Used instead of callback if given.
+        @param writer A PacketWriter whose data the listener sends as the
+        socket drains and the pacing allows.
         """
         threading.Thread.__init__(self)
         self.sock = sock
         self._done = False
         self.linebuf = ''
         self.delim = delim
+        self.writer = writer
+        
+        # A pipe used to wake the select up when there is data to send
+        (self._wakeup_read, self._wakeup_write) = os.pipe()
         
         if callback:
             def fn_callback(paPacket):
@@ -245,6 +687,7 @@ class Listener(threading.Thread):
             self.callback = fn_callback
         else:
             self.callback = None
+        self.batch_callback = batch_callback
 
     def done(self):
         """
@@ -252,64 +695,89 @@ class Listener(threading.Thread):
         conclude.
         """
         self._done = True
+        self.wakeup()
+        
+    def wakeup(self):
+        """
+        Interrupt the wait so newly queued data gets sent.
+        """
+        try:
+            os.write(self._wakeup_write, 'x')
+        except OSError:
+            pass
         
     def run(self):
         """
-        Listener thread processing loop. Block on receive from port agent.
-        Receive HEADER_SIZE bytes to receive the entire header.  From that,
-        get the length of the whole packet (including header); compute the
-        length of the remaining data and read that.  
+        Listener thread processing loop. Wait until the socket is readable,
+        read everything available into the packet reader's buffer, and
+        hand off every complete packet before waiting again. The wait times
+        out periodically so a done() call is noticed.
         NOTE (DHE): I've noticed in my testing that if my test server
         (simulating the port agent) goes away, the client socket (ours)
         goes into a CLOSE_WAIT condition and stays there for a long time. 
-        When that happens, this method loops furiously and for a long time. 
-        I have not had the patience to wait it out, so I don't know how long
-        it will last.  When it happens though, 0 bytes are received, which
-        should never happen unless something is wrong.  So if that happens,
-        I'm considering it an error.
+        When that happens, 0 bytes are received, which should never happen
+        unless something is wrong.  So if that happens, I'm considering it
+        an error.
         """
         log.info('Logger client listener started.')
+        reader = PacketReader()
+        writer = self.writer
         while not self._done:
             try:
-                received_header = False
-                bytes_left = HEADER_SIZE
-                while not received_header and not self._done: 
-                    header = self.sock.recv(bytes_left)
-                    bytes_left -= len(header)
-                    if bytes_left == 0:
-                        received_header = True
-                        paPacket = PortAgentPacket()         
-                        paPacket.unpack_header(header)         
-                        data_size = paPacket.get_data_size()
-                        bytes_left = data_size
-                    elif len(header) == 0:
-                        log.error('Zero bytes received from port_agent socket')
-                        self._done = True
-                
-                received_data = False
-                while not received_data and not self._done: 
-                    data = self.sock.recv(bytes_left)
-                    bytes_left -= len(data)
-                    if bytes_left == 0:
-                        received_data = True
-                        paPacket.attach_data(data)
-                    elif len(data) == 0:
-                        log.error('Zero bytes received from port_agent socket')
-                        self._done = True
-
-                if not self._done:
-                    """
-                    Should have complete port agent packet.
-                    """
-                    if self.callback:
-                        self.callback(paPacket)
+                timeout = SELECT_TIMEOUT
+                wait_for_write = []
+                if writer and writer.pending():
+                    if writer.is_blocked():
+                        wait_for_write = [self.sock]
                     else:
-                        log.error('No callback registered')
+                        due = writer.time_until_due()
+                        if due != None:
+                            timeout = min(timeout, due)
+                        
+                (readable, writable, errored) = select.select(
+                    [self.sock, self._wakeup_read], wait_for_write, [], timeout)
+                if self._wakeup_read in readable:
+                    os.read(self._wakeup_read, 4096)
+                if writer and writer.pending():
+                    writer.flush_to(self.sock)
+                if self.sock not in readable:
+                    continue
+                count = reader.read_from(self.sock)
+            except (socket.error, select.error) as e:
+                if e.args and e.args[0] in RETRY_ERRNOS:
+                    continue
+                log.error('Error on port_agent socket: %s' % str(e))
+                self._done = True
+                break
+            
+            if count == 0:
+                log.error('Zero bytes received from port_agent socket')
+                self._done = True
+                break
+            
+            if self.batch_callback:
+                packets = reader.get_packets()
+                if packets:
+                    self.batch_callback(packets)
+                continue
 
-            except socket.error:
-                time.sleep(.1)
+            for paPacket in reader.get_packets():
+                if self.callback:
+                    self.callback(paPacket)
+                else:
+                    log.error('No callback registered')
+                    
+        if writer:
+            writer.clear()
         log.info('Logger client done listening.')
 
+    def close(self):
+        """
+        Release the wakeup pipe once the thread has finished.
+        """
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
     def parse_packet(self, packet):
         log.debug('Logger client parse_packet')
         
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.port_agent_hub
+@file mi/core/instrument/port_agent_hub.py
+@brief A single thread that listens to many port agent connections. Instead
+of each PortAgentClient running its own listener thread, HubPortAgentClients
+register their sockets with a shared PortAgentHub that waits on all of them
+with one poll loop and dispatches the packets to each client's callback.
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import errno
+import select
+import socket
+import threading
+
+from mi.core.log import get_logger ; log = get_logger()
+from mi.core.instrument.port_agent_client import PortAgentClient
+from mi.core.instrument.port_agent_client import PacketReader
+from mi.core.instrument.port_agent_client import RETRY_ERRNOS
+from mi.core.instrument.port_agent_client import SELECT_TIMEOUT
+
+if hasattr(select, 'epoll'):
+    READ_EVENTS = select.EPOLLIN | select.EPOLLPRI | select.EPOLLERR | select.EPOLLHUP
+    WRITE_EVENT = select.EPOLLOUT
+else:
+    READ_EVENTS = select.POLLIN | select.POLLPRI | select.POLLERR | select.POLLHUP
+    WRITE_EVENT = select.POLLOUT
+
+class PortAgentHub(object):
+    """
+    Owns one thread and one epoll (or poll) object serving any number of
+    port agent connections. Packets are handed to the registered client's
+    callback from the hub thread, one connection at a time, so a callback
+    that blocks holds up every connection on the hub.
+    """
+
+    _default_hub = None
+    _default_hub_lock = threading.Lock()
+
+    @classmethod
+    def get_default(cls):
+        """
+        Get the hub shared by the process, starting it if needed.
+        @retval The default PortAgentHub.
+        """
+        with cls._default_hub_lock:
+            if cls._default_hub == None or not cls._default_hub.is_running():
+                cls._default_hub = PortAgentHub()
+                cls._default_hub.start()
+            return cls._default_hub
+
+    def __init__(self):
+        """
+        Hub constructor.
+        """
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._timeout_scale = 1
+        else:
+            self._poller = select.poll()
+            self._timeout_scale = 1000
+
+        # Connections keyed by socket file descriptor
+        self._clients = {}
+        # Descriptors also being polled for room to send
+        self._polling_writes = set()
+        self._lock = threading.Lock()
+
+        # A pipe used to wake the poll loop up when it should stop
+        (self._wakeup_read, self._wakeup_write) = os.pipe()
+        self._poller.register(self._wakeup_read, READ_EVENTS)
+
+        self._thread = None
+        self._done = False
+
+    def start(self):
+        """
+        Start the hub thread.
+        """
+        self._done = False
+        self._thread = threading.Thread(target=self.run, name='PortAgentHub')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the hub thread and wait for it to finish. Registered sockets are
+        left open for their clients to close.
+        """
+        self._done = True
+        self.wakeup()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def is_running(self):
+        """
+        @retval True if the hub thread is running.
+        """
+        return self._thread != None and self._thread.is_alive()
+
+    def on_thread(self):
+        """
+        @retval True if called from the hub's own thread.
+        """
+        return self._thread is threading.current_thread()
+
+    def register(self, client):
+        """
+        Start dispatching packets from a client's socket to its callback.
+        @param client A connected HubPortAgentClient.
+        """
+        fd = client.sock.fileno()
+        with self._lock:
+            self._clients[fd] = (client, PacketReader())
+            self._poller.register(fd, READ_EVENTS)
+        log.debug('PortAgentHub: registered %s:%i' % (client.host, client.port))
+
+    def unregister(self, client):
+        """
+        Stop dispatching packets for a client. A callback already underway
+        on the hub thread may still complete after this returns.
+        @param client A registered HubPortAgentClient.
+        """
+        with self._lock:
+            for (fd, (registered, reader)) in self._clients.items():
+                if registered is client:
+                    self._drop(fd)
+        log.debug('PortAgentHub: unregistered %s:%i' % (client.host, client.port))
+
+    def _drop(self, fd):
+        """
+        Remove a socket from the poll set. Call with the lock held.
+        """
+        del self._clients[fd]
+        self._polling_writes.discard(fd)
+        try:
+            self._poller.unregister(fd)
+        except (KeyError, IOError, OSError, ValueError):
+            pass
+
+    def wakeup(self):
+        """
+        Interrupt the poll loop, so a stop or newly queued data is noticed.
+        """
+        try:
+            os.write(self._wakeup_write, 'x')
+        except OSError:
+            pass
+
+    def run(self):
+        """
+        Hub processing loop. Wait for any registered socket to be readable,
+        read and dispatch its packets, and repeat until stopped. Data the
+        clients have queued to send goes out as their sockets drain and their
+        pacing allows.
+        """
+        log.info('PortAgentHub started.')
+        while not self._done:
+            timeout = self._service_writers()
+            try:
+                events = self._poller.poll(timeout * self._timeout_scale)
+            except (IOError, select.error) as e:
+                if e.args and e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for (fd, event) in events:
+                if fd == self._wakeup_read:
+                    os.read(self._wakeup_read, 4096)
+                    continue
+                entry = self._clients.get(fd, None)
+                if entry and event & WRITE_EVENT:
+                    self._write_client(fd, entry[0])
+                    event &= ~WRITE_EVENT
+                if entry and event:
+                    self._read_client(fd, entry[0], entry[1])
+
+        log.info('PortAgentHub done.')
+
+    def _service_writers(self):
+        """
+        Send whatever client data is due and update which sockets are polled
+        for room to send.
+        @retval How long to poll for, in seconds.
+        """
+        timeout = SELECT_TIMEOUT
+        with self._lock:
+            clients = [(fd, entry[0]) for (fd, entry) in self._clients.items()
+                       if entry[0].writer and entry[0].writer.pending()]
+        for (fd, client) in clients:
+            if client.writer.time_until_due() == 0:
+                self._write_client(fd, client)
+            
+        with self._lock:
+            for (fd, client) in clients:
+                if fd not in self._clients:
+                    continue
+                writer = client.writer
+                blocked = writer.pending() and writer.is_blocked()
+                if blocked != (fd in self._polling_writes):
+                    if blocked:
+                        self._polling_writes.add(fd)
+                        self._poller.modify(fd, READ_EVENTS | WRITE_EVENT)
+                    else:
+                        self._polling_writes.discard(fd)
+                        self._poller.modify(fd, READ_EVENTS)
+                due = writer.time_until_due()
+                if due != None:
+                    timeout = min(timeout, due)
+        return timeout
+
+    def _write_client(self, fd, client):
+        """
+        Send what one connection has queued and the socket will take.
+        """
+        try:
+            client.writer.flush_to(client.sock)
+        except socket.error as e:
+            log.error('PortAgentHub: error sending to port agent at %s:%i: %s'
+                      % (client.host, client.port, str(e)))
+            client.writer.clear()
+            with self._lock:
+                if fd in self._clients:
+                    self._drop(fd)
+
+    def _read_client(self, fd, client, reader):
+        """
+        Read and dispatch whatever one connection has ready.
+        """
+        try:
+            count = reader.read_from(client.sock)
+        except socket.error as e:
+            if e.args and e.args[0] in RETRY_ERRNOS:
+                return
+            log.error('PortAgentHub: error reading from port agent at %s:%i: %s'
+                      % (client.host, client.port, str(e)))
+            count = 0
+        else:
+            if count == 0:
+                log.error('PortAgentHub: zero bytes received from port agent at %s:%i'
+                          % (client.host, client.port))
+
+        if count == 0:
+            client.writer.clear()
+            with self._lock:
+                if fd in self._clients:
+                    self._drop(fd)
+            return
+
+        packets = reader.get_packets()
+        if client.batch:
+            if packets:
+                self._dispatch(client, client.batch_callback, packets)
+        else:
+            for paPacket in packets:
+                self._dispatch(client, client.callback, paPacket)
+
+    def _dispatch(self, client, callback, arg):
+        """
+        Call a client callback, logging rather than raising its errors.
+        """
+        try:
+            callback(arg)
+        except Exception:
+            # don't let one driver take down every connection
+            log.error('PortAgentHub: callback for %s:%i failed'
+                      % (client.host, client.port), exc_info=True)
+
+class HubPortAgentClient(PortAgentClient):
+    """
+    A port agent client that shares a PortAgentHub thread instead of running
+    a listener thread of its own. It is used just like a PortAgentClient.
+    """
+
+    def __init__(self, host, port, delim=None, hub=None, batch=False,
+                 capture=None):
+        """
+        @param hub The hub to listen with, the process wide default hub if
+        None.
+        @param batch If True the callback is called with a list of packets.
+        @param capture A CaptureWriter to record the received packets to.
+        """
+        PortAgentClient.__init__(self, host, port, delim, batch, capture)
+        self.hub = hub
+
+    def _start_listener(self):
+        """
+        Register with the hub.
+        """
+        if self.hub == None:
+            self.hub = PortAgentHub.get_default()
+        self.hub.register(self)
+
+    def _stop_listener(self):
+        """
+        Unregister from the hub.
+        """
+        self.hub.unregister(self)
+
+    def _wakeup_listener(self):
+        """
+        Tell the hub there is data for it to send.
+        """
+        if self.hub:
+            self.hub.wakeup()
+
+    def _on_listener_thread(self):
+        """
+        @retval True if called from the hub's thread.
+        """
+        return self.hub != None and self.hub.on_thread()
+
+    def _listener_running(self):
+        """
+        @retval True if the hub is running to send for us.
+        """
+        return self.hub != None and self.hub.is_running()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.port_agent_simulator
+@file mi/core/instrument/port_agent_simulator.py
+@brief An in process stand in for a port agent and its instrument. A
+PortAgentSimulator streams synthetic or template driven samples to a
+PortAgentClient, wrapped in port agent packets, at the rate, burst size and
+fragmentation given by a LoadProfile. It needs no hardware, so drivers can
+be load tested at many times the real instrument rate.
+
+Sample generators are provided for the SBE37, SBE16, SBE26plus, PAR and
+PD0 (Workhorse ADCP) sample formats. A TemplateGenerator repeats records
+taken from a log or test fixture.
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import math
+import time
+import random
+import struct
+
+
+from mi.core.log import get_logger ; log = get_logger()
+from mi.core import ntp_clock
+from mi.core.exceptions import NotImplementedException
+from mi.core.instrument.port_agent_client import PortAgentPacket
+from mi.core.instrument.port_agent_client import HEADER_SIZE
+from mi.core.instrument.port_agent_client import DATA_FROM_INSTRUMENT
+from mi.core.instrument.port_agent_capture import PortAgentServer
+
+"""
+The port agent packet length field is 16 bits
+"""
+MAX_PACKET_DATA = 65535 - HEADER_SIZE
+
+def make_packet(data, timestamp=None, packet_type=DATA_FROM_INSTRUMENT):
+    """
+    Wrap data in a port agent packet, as the port agent does.
+    @param data The data string.
+    @param timestamp The NTP time the data arrived, now if None.
+    @param packet_type The packet type.
+    @retval The packet string, header and data.
+    """
+    if timestamp == None:
+        timestamp = ntp_clock.ntp_time()
+    paPacket = PortAgentPacket()
+    paPacket.attach_data(data)
+    paPacket.pack_header(packet_type, timestamp)
+    return str(bytearray(paPacket.get_header())) + data
+
+class SampleGenerator(object):
+    """
+    Makes the samples an instrument sends. Subclasses build each record in
+    sample; values drift slowly with the sample number and a seeded random
+    jitter, so runs repeat exactly.
+    """
+
+    """
+    Samples a second the real instrument sends
+    """
+    RATE = 1.0
+
+    """
+    The prompt sent in reply to each line the driver sends, or None
+    """
+    PROMPT = None
+
+    NEWLINE = '\r\n'
+
+    def __init__(self, seed=0):
+        self._random = random.Random(seed)
+
+    def sample(self, number, timestamp):
+        """
+        Build one sample record. Overridden by subclasses.
+        @param number The sample number, counting from 0.
+        @param timestamp The sample time, in seconds since the epoch.
+        @retval The record string, newline included.
+        """
+        raise NotImplementedException('sample() not implemented.')
+
+    def respond(self, line):
+        """
+        The reply to a line sent by the driver.
+        @param line The line, without its newline.
+        @retval The reply string, or None to send nothing.
+        """
+        return self.PROMPT
+
+    def _value(self, number, base, swing, jitter):
+        """
+        A value wandering around base.
+        """
+        return base + swing * math.sin(number / 50.0) + \
+               self._random.uniform(-jitter, jitter)
+
+class TemplateGenerator(SampleGenerator):
+    """
+    Repeats a list of records, such as lines from an instrument log.
+    Records may use %(number)d and %(time)s, the sample number and time.
+    """
+
+    def __init__(self, records, rate=1.0, prompt=None, seed=0):
+        """
+        @param records The record strings, newlines included.
+        @param rate Samples a second the real instrument sends.
+        @param prompt The reply to each line the driver sends.
+        """
+        SampleGenerator.__init__(self, seed)
+        self._records = records
+        self.RATE = rate
+        self.PROMPT = prompt
+
+    def sample(self, number, timestamp):
+        record = self._records[number % len(self._records)]
+        if '%(' not in record:
+            return record
+        return record % {'number': number,
+                         'time': time.strftime('%d %b %Y %H:%M:%S',
+                                               time.gmtime(timestamp))}
+
+class SBE37Generator(SampleGenerator):
+    """
+    SBE37 autosample lines:
+    #87.9140,5.42747, 556.864,   37.1829, 1506.961, 02 Jan 2001, 15:34:51
+    """
+    RATE = 0.1
+    PROMPT = 'S>'
+
+    def sample(self, number, timestamp):
+        return '#%7.4f,%8.5f, %7.3f, %9.4f, %8.3f, %s%s' % (
+            self._value(number, 12.5, 2.0, 0.01),
+            self._value(number, 4.2, 0.5, 0.0001),
+            self._value(number, 556.0, 5.0, 0.01),
+            self._value(number, 35.0, 0.5, 0.001),
+            self._value(number, 1500.0, 5.0, 0.01),
+            time.strftime('%d %b %Y, %H:%M:%S', time.gmtime(timestamp)),
+            self.NEWLINE)
+
+class SBE16Generator(SampleGenerator):
+    """
+    SBE16plus autosample lines, in the same layout as the SBE37
+    """
+    RATE = 0.1
+    PROMPT = 'S>'
+
+    def sample(self, number, timestamp):
+        return '# %8.4f, %8.5f, %8.3f, %9.4f, %8.3f, %s%s' % (
+            self._value(number, 18.9, 2.0, 0.01),
+            self._value(number, 3.9, 0.5, 0.0001),
+            self._value(number, 15.0, 1.0, 0.01),
+            self._value(number, 32.1, 0.5, 0.001),
+            self._value(number, 1500.0, 5.0, 0.01),
+            time.strftime('%d %b %Y, %H:%M:%S', time.gmtime(timestamp)),
+            self.NEWLINE)
+
+class SBE26PlusGenerator(SampleGenerator):
+    """
+    SBE26plus tide samples. Every WAVE_EVERY tide samples a wave burst of
+    WAVE_SAMPLES pressure readings follows.
+    """
+    RATE = 1.0 / 180
+    PROMPT = 'S>'
+    WAVE_EVERY = 6
+    WAVE_SAMPLES = 512
+
+    def sample(self, number, timestamp):
+        now = time.strftime('%d %b %Y %H:%M:%S', time.gmtime(timestamp))
+        record = 'tide: start time = %s, p = %8.4f, pt = %7.3f, t = %8.4f%s' % (
+            now,
+            self._value(number, 14.53, 0.01, 0.001),
+            self._value(number, 24.24, 0.02, 0.001),
+            self._value(number, 23.9, 0.1, 0.001),
+            self.NEWLINE)
+        if (number + 1) % self.WAVE_EVERY:
+            return record
+
+        lines = [record,
+                 'wave: start time = %s%s' % (now, self.NEWLINE),
+                 'wave: ptfreq = %.3f%s' % (self._value(number, 171791.0, 1.0, 0.5),
+                                            self.NEWLINE)]
+        for i in xrange(self.WAVE_SAMPLES):
+            lines.append('%9.4f%s' % (self._value(i, 14.51, 0.01, 0.002),
+                                      self.NEWLINE))
+        return ''.join(lines)
+
+class PARGenerator(SampleGenerator):
+    """
+    Satlantic PAR samples with a valid checksum:
+    SATPAR0229,10.01,2206748544,234
+    """
+    RATE = 6.0
+    PROMPT = '$'
+
+    def __init__(self, serial_number=229, seed=0):
+        SampleGenerator.__init__(self, seed)
+        self._serial_number = serial_number
+
+    def sample(self, number, timestamp):
+        line = 'SATPAR%04d,%.2f,%010d' % (
+            self._serial_number, number / self.RATE,
+            int(self._value(number, 2206748544, 1000000, 1000)))
+        return '%s,%d%s' % (line, sum(bytearray(line)) & 0xFF, self.NEWLINE)
+
+class PD0Generator(SampleGenerator):
+    """
+    Workhorse ADCP PD0 binary ensembles: a header, fixed and variable
+    leaders and velocity data, followed by the ensemble checksum.
+    """
+    RATE = 1.0
+    BEAMS = 4
+
+    def __init__(self, cells=30, seed=0):
+        SampleGenerator.__init__(self, seed)
+        self._cells = cells
+
+    def sample(self, number, timestamp):
+        fixed = bytearray(59)
+        struct.pack_into('<HBB', fixed, 0, 0x0000, 16, 30)
+        fixed[8] = self.BEAMS
+        fixed[9] = self._cells
+        struct.pack_into('<hh', fixed, 10, 1, 100)
+
+        variable = bytearray(65)
+        struct.pack_into('<HH', variable, 0, 0x0080, number & 0xFFFF)
+        variable[11] = (number >> 16) & 0xFF
+        struct.pack_into('<hhhhh', variable, 14, 1500, 50,
+                         int(self._value(number, 18000, 1000, 10)),
+                         int(self._value(number, 0, 200, 10)),
+                         int(self._value(number, 0, 200, 10)))
+        t = time.gmtime(timestamp)
+        struct.pack_into('<BBBBBBBB', variable, 57, t.tm_year // 100,
+                         t.tm_year % 100, t.tm_mon, t.tm_mday, t.tm_hour,
+                         t.tm_min, t.tm_sec, int((timestamp % 1) * 100))
+
+        velocity = bytearray(2 + 2 * self.BEAMS * self._cells)
+        struct.pack_into('<H', velocity, 0, 0x0100)
+        for i in xrange(self.BEAMS * self._cells):
+            struct.pack_into('<h', velocity, 2 + 2 * i,
+                             int(self._value(number + i, 0, 300, 20)))
+
+        header_size = 6 + 2 * 3
+        offsets = (header_size, header_size + len(fixed),
+                   header_size + len(fixed) + len(variable))
+        size = offsets[2] + len(velocity)
+        header = struct.pack('<BBHBBHHH', 0x7F, 0x7F, size, 0, 3, *offsets)
+
+        ensemble = header + str(fixed) + str(variable) + str(velocity)
+        return ensemble + struct.pack('<H', sum(bytearray(ensemble)) & 0xFFFF)
+
+class LoadProfile(object):
+    """
+    How a simulator sends samples.
+    """
+
+    def __init__(self, rate=None, speedup=1.0, burst=1, fragments=None,
+                 fragment_delay=0, count=None):
+        """
+        @param rate Samples a second, the generator's real instrument rate
+        if None.
+        @param speedup How many times faster than rate to send.
+        @param burst Samples sent together, back to back, each time.
+        @param fragments A list of data sizes, used in turn to cut the data
+        of each burst into port agent packets. One packet per burst if None.
+        @param fragment_delay Seconds between the packets of a burst.
+        @param count Samples to send before stopping, forever if None.
+        """
+        self.rate = rate
+        self.speedup = speedup
+        self.burst = burst
+        self.fragments = fragments
+        self.fragment_delay = fragment_delay
+        self.count = count
+
+    def interval(self, generator):
+        """
+        @retval Seconds between bursts for a generator.
+        """
+        rate = self.rate or generator.RATE
+        return self.burst / (rate * self.speedup)
+
+    def split(self, data):
+        """
+        Cut burst data into packet sized pieces.
+        @retval A list of strings.
+        """
+        sizes = self.fragments or [MAX_PACKET_DATA]
+        pieces = []
+        offset = 0
+        index = 0
+        while offset < len(data):
+            size = min(max(sizes[index % len(sizes)], 1), MAX_PACKET_DATA)
+            pieces.append(data[offset:offset + size])
+            offset += size
+            index += 1
+        return pieces
+
+class PortAgentSimulator(PortAgentServer):
+    """
+    Stands in for a port agent with an instrument in autosample behind it.
+    Samples from a generator are sent to the first client that connects as
+    the load profile says. Each line the client sends is answered with the
+    generator's response, if any.
+    """
+
+    def __init__(self, generator, profile=None, port=0, host='127.0.0.1'):
+        """
+        @param generator The SampleGenerator to send samples from.
+        @param profile The LoadProfile, one sample at a time at the
+        instrument's real rate if None.
+        @param port The port to listen on, any free port if 0.
+        @param host The address to listen on.
+        """
+        PortAgentServer.__init__(self, port, host)
+        self.generator = generator
+        self.profile = profile or LoadProfile()
+        self.samples_sent = 0
+        self._linebuf = ''
+
+    def get_data_port(self):
+        """
+        The port drivers connect to, as a port agent process reports it.
+        """
+        return self.port
+
+    def get_pid(self):
+        """
+        The simulator runs in the test process.
+        """
+        return os.getpid()
+
+    def _serve(self, started):
+        """
+        Send bursts of samples until the count is reached, the client goes
+        away or serving is stopped. Each client gets samples from the first.
+        """
+        self._linebuf = ''
+        profile = self.profile
+        interval = profile.interval(self.generator)
+        due = started
+        number = 0
+        while profile.count == None or number < profile.count:
+            burst = profile.burst
+            if profile.count != None:
+                burst = min(burst, profile.count - number)
+            data = ''.join([self.generator.sample(number + i, due)
+                            for i in xrange(burst)])
+
+            packet_due = due
+            for piece in profile.split(data):
+                if not self._send_at(packet_due, make_packet(piece), 1):
+                    return
+                packet_due += profile.fragment_delay
+            number += burst
+            self.samples_sent = number
+            due += interval
+
+    def _received(self, data):
+        """
+        Answer each complete line from the client.
+        """
+        self._linebuf += data
+        lines = self._linebuf.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        self._linebuf = lines.pop()
+        for line in lines:
+            reply = self.generator.respond(line)
+            if reply:
+                self._send_now(make_packet(reply), 1)
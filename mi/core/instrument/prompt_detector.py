@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.prompt_detector Streaming prompt matching
+@file mi/core/instrument/prompt_detector.py
+@brief An Aho-Corasick matcher fed the prompt buffer as it grows, so the
+    prompts it ends with or has seen are known without rescanning it.
+"""
+
+__license__ = 'Apache 2.0'
+
+import re
+
+from mi.core.log import get_logger ; log = get_logger()
+
+class PromptDetector(object):
+    """
+    Matches a set of prompts against a stream of data. The data is fed in
+    as it arrives, each byte looked at once, and the detector can then
+    say which prompts the data fed so far ends with, and which it has
+    contained anywhere. Between matches it skips ahead to the next byte
+    that can start a prompt.
+    """
+    def __init__(self, prompts):
+        """
+        @param prompts The prompt strings to match.
+        """
+        self.prompts = frozenset(prompts)
+
+        # The trie of prompts. State 0 is the root.
+        goto = [{}]
+        outputs = [[]]
+        for prompt in sorted(self.prompts):
+            state = 0
+            for char in prompt:
+                following = goto[state].get(char)
+                if following == None:
+                    following = len(goto)
+                    goto[state][char] = following
+                    goto.append({})
+                    outputs.append([])
+                state = following
+            outputs[state].append(prompt)
+
+        # Failure links, in breadth first order, and the full transition
+        # table built from them. A char with no transition goes to the root.
+        fail = [0] * len(goto)
+        self._delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        order = list(goto[0].values())
+        for state in order:
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            delta = dict(self._delta[fail[state]])
+            for (char, following) in goto[state].iteritems():
+                fail[following] = self._delta[fail[state]].get(char, 0)
+                delta[char] = following
+                order.append(following)
+            self._delta[state] = delta
+        self._outputs = [frozenset(output) for output in outputs]
+
+        # The bytes that can start a prompt
+        if goto[0]:
+            self._start = re.compile('[%s]' % ''.join(
+                [re.escape(char) for char in goto[0]]))
+        else:
+            self._start = None
+
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the data fed so far.
+        """
+        self._state = 0
+        self._seen = set(self._outputs[0])
+
+    def feed(self, data):
+        """
+        Match more data, continuing from the data fed before.
+        @param data The string that arrived.
+        """
+        delta = self._delta
+        outputs = self._outputs
+        state = self._state
+        index = 0
+        length = len(data)
+        while index < length:
+            if state == 0:
+                if self._start == None:
+                    break
+                match = self._start.search(data, index)
+                if not match:
+                    break
+                index = match.start()
+            state = delta[state].get(data[index], 0)
+            if outputs[state]:
+                self._seen.update(outputs[state])
+            index += 1
+        self._state = state
+
+    def suffixes(self):
+        """
+        @retval The set of prompts the data fed so far ends with.
+        """
+        return self._outputs[self._state]
+
+    def seen(self):
+        """
+        @retval The set of prompts found anywhere in the data fed so far.
+        """
+        return self._seen
+
+    def endswith(self, prompts):
+        """
+        @param prompts A list of prompts, in order of preference.
+        @retval The first prompt the data fed so far ends with, or None.
+        """
+        suffixes = self._outputs[self._state]
+        if suffixes:
+            for prompt in prompts:
+                if prompt in suffixes:
+                    return prompt
+        return None
+
+    def contains(self, prompts):
+        """
+        @param prompts A list of prompts, in order of preference.
+        @retval The first prompt found anywhere in the data fed so far, or
+            None.
+        """
+        if self._seen:
+            for prompt in prompts:
+                if prompt in self._seen:
+                    return prompt
+        return None
@@ -76,15 +76,202 @@ class ParameterDictVal(object):
         match = self.regex.match(input)
         if match:
             self.value = self.f_getval(match)
-            mi_logger.debug('self.value = ' + str(self.value))
-
-            mi_logger.debug('Updated parameter %s=%s', self.name, str(self.value))
+            mi_logger.debug('Updated parameter %s=%s', self.name, self.value)
 
             return True
         else:
             return False
 
 
+"""Characters with a meaning in a regex outside a character class"""
+_SPECIAL = set('.^$*+?{}[]()|\\')
+_QUANTIFIERS = set('*+?{')
+_WHITESPACE_ESCAPES = set('strn')
+
+def _has_top_level_alternation(pattern):
+    """
+    @param pattern A regex pattern.
+    @retval True if the pattern has a | outside any group, so it can match
+        without its first branch.
+    """
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if in_class:
+            if c == ']':
+                in_class = False
+        elif c == '[':
+            in_class = True
+            # a ] first in the class is literal
+            if pattern[i+1:i+2] == '^':
+                i += 1
+            if pattern[i+1:i+2] == ']':
+                i += 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
+def _literal_prefix(regex):
+    """
+    Find the literal text every match of a regex starts with, after any
+    leading whitespace.
+    @param regex A compiled regex.
+    @retval The literal prefix, '' if there is none.
+    """
+    pattern = regex.pattern
+    if regex.flags & (re.IGNORECASE | re.VERBOSE) or \
+       _has_top_level_alternation(pattern):
+        return ''
+
+    i = 1 if pattern.startswith('^') else 0
+    prefix = []
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            escaped = pattern[i+1:i+2]
+            if not escaped.isalnum():
+                literal = escaped
+            elif escaped in _WHITESPACE_ESCAPES and not prefix:
+                literal = ' '
+            else:
+                break
+            step = 2
+        elif c in _SPECIAL:
+            break
+        else:
+            literal = c
+            step = 1
+
+        following = pattern[i+step:i+step+1]
+        if not prefix and literal.isspace():
+            # leading whitespace is skipped, however much of it there is
+            if following == '{':
+                break
+            i += step
+            if following in _QUANTIFIERS:
+                i += 1
+                if pattern[i:i+1] == '?':
+                    i += 1
+            continue
+        if following in _QUANTIFIERS:
+            break
+        prefix.append(literal)
+        i += step
+    return ''.join(prefix)
+
+"""A regex picking a fixed width field at a fixed offset: ^.{offset}(.{width}).*"""
+_FIXED_SPAN = re.compile(r'\^?\.\{(\d+)\}\(\.\{(\d+)\}\)\.\*$')
+
+def _fixed_span(regex):
+    """
+    @param regex A compiled parameter regex.
+    @retval (offset, field regex) if the regex picks a fixed width field
+        at a fixed offset in a block, so the field regex can be matched at
+        the offset alone. None otherwise.
+    """
+    match = _FIXED_SPAN.match(regex.pattern)
+    if match and regex.flags & re.DOTALL:
+        return (int(match.group(1)),
+                re.compile('(.{%s})' % match.group(2), re.DOTALL))
+    return None
+
+class _ParameterMatchIndex(object):
+    """
+    Finds the parameters whose regex could match a line. Each regex is
+    filed under the literal text its matches start with, after leading
+    whitespace, so a line is only tried against the regexes filed under
+    a prefix of the line (with its leading whitespace stripped) and those
+    with no literal prefix. Candidates come back in the order of the
+    parameters given.
+    """
+    def __init__(self, items):
+        """
+        @param items The (name, ParameterDictVal) pairs in the order they
+            are tried.
+        """
+        self._unprefixed = []
+        self._prefixed = {}
+
+        # Parameters whose regex is DOTALL describe a place in a whole
+        # response rather than a line, and are matched by update_block
+        # against the block: (name, val, offset, field regex) for fixed
+        # spans, (name, val, None, None) for the rest.
+        self.block_params = []
+
+        for (position, (name, val)) in enumerate(items):
+            if val.regex.flags & re.DOTALL:
+                span = _fixed_span(val.regex) or (None, None)
+                self.block_params.append((name, val) + span)
+            prefix = _literal_prefix(val.regex)
+            if prefix:
+                self._prefixed.setdefault(prefix, []).append((position, name, val))
+            else:
+                self._unprefixed.append((position, name, val))
+        self._lengths = sorted(set([len(prefix) for prefix in self._prefixed]))
+
+    def candidates(self, line):
+        """
+        @param line An input line.
+        @retval The (name, ParameterDictVal) pairs that might match the
+            line, in order.
+        """
+        stripped = line.lstrip()
+        found = None
+        for length in self._lengths:
+            if length > len(stripped):
+                break
+            vals = self._prefixed.get(stripped[:length])
+            if vals:
+                if found == None:
+                    found = list(vals)
+                else:
+                    found.extend(vals)
+        if found == None:
+            return [(name, val) for (position, name, val) in self._unprefixed]
+        found.extend(self._unprefixed)
+        found.sort()
+        return [(name, val) for (position, name, val) in found]
+
+class _ParameterVals(dict):
+    """
+    The parameter dict's name to ParameterDictVal mapping. Drops the match
+    index whenever it changes, including from subclasses that add to it
+    directly.
+    """
+    def __init__(self):
+        dict.__init__(self)
+        self.index = None
+
+    def __setitem__(self, key, value):
+        self.index = None
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.index = None
+        dict.__delitem__(self, key)
+
+    def clear(self):
+        self.index = None
+        dict.clear(self)
+
+    def pop(self, *args):
+        self.index = None
+        return dict.pop(self, *args)
+
+    def update(self, *args, **kwargs):
+        self.index = None
+        dict.update(self, *args, **kwargs)
+
 class ProtocolParameterDict(object):
     """
     Protocol parameter dictionary. Manages, matches and formats device
@@ -94,7 +281,7 @@ class ProtocolParameterDict(object):
         """
         Constructor.        
         """
-        self._param_dict= {}
+        self._param_dict = _ParameterVals()
         
     """
     def add(self, name, pattern, f_getval, f_format, value=None,
@@ -194,7 +381,7 @@ class ProtocolParameterDict(object):
         """
         hit_count = 0
         multi_mode = False
-        for (name, val) in self._param_dict.iteritems():
+        for (name, val) in self._candidates(input):
             if multi_mode == True and val.multi_match == False:
                 continue
             if val.update(input):
@@ -205,7 +392,7 @@ class ProtocolParameterDict(object):
                     multi_mode = True
 
         if False == multi_mode and input <> "":
-            log.debug("protocol_param_dict.py UNMATCHCHED ***************************** " + input)
+            log.debug("protocol_param_dict.py UNMATCHCHED ***************************** %s", input)
         return hit_count
 
     def update(self, input):
@@ -215,12 +402,103 @@ class ProtocolParameterDict(object):
         @param input A string to match to a dictionary object.
         @retval The name that was successfully updated, None if not updated
         """
-        for (name, val) in self._param_dict.iteritems():
-            log.debug("NAME/VAL = " + str(name) + "/" + str(val))
+        for (name, val) in self._candidates(input):
             if val.update(input):
-                log.debug("RETURNING NAME = " + str(name))
                 return name
         return False
+
+    def update_block(self, text, newline=None, require_all=False):
+        """
+        Update the dictionary from a whole multi-line response in one pass.
+        Parameters whose regex is DOTALL are matched against the block,
+        those picking a fixed span of it at that span alone. The rest are
+        matched line by line as multi_match_update does: a line sets the
+        first parameter it matches, as update does, unless that parameter
+        is multi_match, when it also sets every other multi_match parameter
+        the line matches.
+        @param text The response text.
+        @param newline The line separator, or None to split on any line
+            ending.
+        @param require_all If True, change nothing unless every parameter
+            matches, as BinaryProtocolParameterDict.update expects of a
+            fixed layout response.
+        @retval The set of names whose value changed, empty if require_all
+            and a parameter did not match.
+        """
+        index = self._index()
+        matches = []
+
+        for (name, val, offset, field) in index.block_params:
+            if field:
+                match = field.match(text, offset)
+            else:
+                match = val.regex.match(text)
+            if match:
+                matches.append((name, val, match))
+
+        if len(index.block_params) < len(self._param_dict):
+            if newline == None:
+                lines = text.splitlines()
+            else:
+                lines = text.split(newline)
+            for line in lines:
+                multi_mode = False
+                for (name, val) in index.candidates(line):
+                    if val.regex.flags & re.DOTALL:
+                        continue
+                    if multi_mode and not val.multi_match:
+                        continue
+                    match = val.regex.match(line)
+                    if match:
+                        matches.append((name, val, match))
+                        if not val.multi_match:
+                            break
+                        multi_mode = True
+
+        if require_all:
+            missing = set(self._param_dict.keys()) - \
+                      set([name for (name, val, match) in matches])
+            if missing:
+                log.debug('update_block: no match for %s, nothing updated',
+                          ', '.join(sorted(missing)))
+                return set()
+
+        changed = set()
+        for (name, val, match) in matches:
+            self._set_from_match(name, val, match, changed)
+        return changed
+
+    def _set_from_match(self, name, val, match, changed):
+        """
+        Set a parameter from its regex match, noting the name in changed
+        if the value is different.
+        """
+        old_value = val.value
+        val.value = val.f_getval(match)
+        if val.value != old_value:
+            changed.add(name)
+
+    def _index(self):
+        """
+        The match index, built on first use and again after the dictionary
+        changes.
+        @retval A _ParameterMatchIndex.
+        """
+        index = getattr(self._param_dict, 'index', None)
+        if index == None:
+            index = _ParameterMatchIndex(self._param_dict.items())
+            if isinstance(self._param_dict, _ParameterVals):
+                self._param_dict.index = index
+        return index
+
+    def _candidates(self, input):
+        """
+        The parameters whose regex might match a line, in the order the
+        dictionary iterates them.
+        @param input A line of instrument output.
+        @retval A list of (name, ParameterDictVal) pairs.
+        """
+        return self._index().candidates(input)
     
     def get_config(self):
         """
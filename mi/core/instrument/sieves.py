@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.sieves Reusable sieves for the chunker
+@file mi/core/instrument/sieves.py
+@brief Prebuilt sieves that find data blocks in an instrument's data
+    stream. Each one is a ResumableSieve that can be handed straight to a
+    StringChunker or BinaryChunker in place of a hand written sieve function.
+    The patterns are compiled once and the scanning is done with regex and
+    find() calls so no per byte work is done in Python.
+"""
+
+__license__ = 'Apache 2.0'
+
+import re
+import struct
+
+from mi.core.instrument.chunker import ResumableSieve, SieveAdapter
+from mi.core.exceptions import InstrumentParameterException
+
+"""
+PD0 ensembles start with a header ID and data source ID of 0x7F, followed
+by a little endian count of the bytes in the ensemble, not counting the
+two byte checksum at the end.
+"""
+PD0_SYNC = '\x7f\x7f'
+PD0_LENGTH_OFFSET = 2
+PD0_MAX_RECORD_LENGTH = 0xFFFF + 2
+
+"""
+Nortek records start with a 0xA5 sync byte and an ID byte, followed by a
+little endian size in 16 bit words. The last word is the checksum.
+"""
+NORTEK_SYNC = '\xa5'
+NORTEK_LENGTH_OFFSET = 2
+NORTEK_CHECKSUM_SEED = 0xb58c
+NORTEK_MAX_RECORD_LENGTH = 0xFFFF * 2
+
+"""
+The (shortest, longest) length in bytes of each Nortek record by ID. Only a
+sync byte followed by one of these IDs starts a record. Profile records
+vary with the number of cells and beams.
+"""
+NORTEK_RECORD_LENGTHS = {
+    '\x00': (512, 512),      # user configuration
+    '\x01': (42, 42),        # Aquadopp velocity data
+    '\x04': (224, 224),      # head configuration
+    '\x05': (48, 48),        # hardware configuration
+    '\x06': (36, 36),        # Aquadopp diagnostics data header
+    '\x10': (24, 24),        # Vector velocity data
+    '\x11': (28, 28),        # Vector system data
+    '\x12': (42, 42),        # Vector velocity data header
+    '\x20': (40, 8192),      # AWAC velocity profile data
+    '\x21': (40, 8192),      # Aquadopp profiler velocity data
+    '\x2a': (40, 8192),      # HR Aquadopp profiler data
+    '\x80': (42, 42),        # Aquadopp diagnostics data
+    }
+
+class RegexSieve(SieveAdapter):
+    """
+    Finds data blocks that match a single regular expression.
+    """
+    def __init__(self, pattern, flags=0, max_record_length=None,
+                 validate_fn=None):
+        """
+        @param pattern The regex that matches a whole data block, either a
+            string or a compiled regex
+        @param flags Regex flags, used if the pattern is a string
+        @param max_record_length The longest block the regex can match,
+            None if unbounded
+        @param validate_fn An optional function that takes a matched block
+            and returns False if it should be treated as non-data (a bad
+            checksum for example)
+        """
+        if isinstance(pattern, basestring):
+            pattern = re.compile(pattern, flags)
+        self.regex = pattern
+        self.validate_fn = validate_fn
+        SieveAdapter.__init__(self, self._find, max_record_length)
+
+    def _find(self, raw_data):
+        """
+        The plain sieve function, adapted to the resumable protocol by
+        SieveAdapter
+        """
+        validate_fn = self.validate_fn
+        result = []
+        for match in self.regex.finditer(raw_data):
+            (start, end) = match.span()
+            if start == end:
+                continue
+            if validate_fn and not validate_fn(raw_data[start:end]):
+                continue
+            result.append((start, end))
+        return result
+
+class MultiRegexSieve(RegexSieve):
+    """
+    Finds data blocks that match any of several regular expressions. The
+    patterns are merged into one alternation of named groups so the data is
+    scanned once no matter how many block types there are. Where two patterns
+    match at the same place the one listed first wins.
+    """
+    def __init__(self, patterns, flags=0, max_record_length=None,
+                 validate_fn=None):
+        """
+        @param patterns A list of (name, pattern) tuples. The names must be
+            valid regex group names and, together with any named groups in
+            the patterns themselves, unique.
+        @param flags Regex flags applied to the combined pattern
+        @param max_record_length The longest block any pattern can match,
+            None if unbounded
+        @param validate_fn See RegexSieve
+        @raises InstrumentParameterException if the patterns do not combine
+        """
+        self.names = [name for (name, pattern) in patterns]
+        combined = "|".join(["(?P<%s>%s)" % (name, pattern)
+                             for (name, pattern) in patterns])
+        try:
+            regex = re.compile(combined, flags)
+        except re.error as e:
+            raise InstrumentParameterException(
+                msg="Could not combine sieve patterns: %s" % e)
+        RegexSieve.__init__(self, regex, max_record_length=max_record_length,
+                            validate_fn=validate_fn)
+
+    def identify(self, block):
+        """
+        Find which pattern a data block matched
+
+        @param block A data block as returned by the chunker
+        @retval The name of the matching pattern, None if there is no match
+        """
+        match = self.regex.match(block)
+        if match:
+            return match.lastgroup
+        return None
+
+class DelimiterSieve(ResumableSieve):
+    """
+    Finds data blocks framed by delimiters. With only an end delimiter each
+    delimited line is a block. With a start delimiter as well, blocks run from
+    the start delimiter through the end delimiter and anything in between
+    blocks is non-data. Delimiters are included in the blocks.
+    """
+    def __init__(self, end_delimiter, start_delimiter=None,
+                 max_record_length=None, validate_fn=None):
+        """
+        @param end_delimiter The string that ends a block
+        @param start_delimiter The string that starts a block, None if
+            blocks start right after the previous end delimiter
+        @param max_record_length The longest block, delimiters included.
+            Longer blocks are treated as non-data. None if unbounded
+        @param validate_fn See RegexSieve
+        """
+        if not end_delimiter:
+            raise InstrumentParameterException(msg="No end delimiter given")
+        self.end_delimiter = end_delimiter
+        self.start_delimiter = start_delimiter
+        self.max_record_length = max_record_length
+        self.validate_fn = validate_fn
+
+    def scan(self, raw_data):
+        if self.start_delimiter:
+            return self._scan_framed(raw_data)
+        return self._scan_lines(raw_data)
+
+    def _scan_lines(self, raw_data):
+        """
+        Each run of data ending in the end delimiter is a block, empty lines
+        are not.
+        """
+        end_delimiter = self.end_delimiter
+        delim_len = len(end_delimiter)
+        max_length = self.max_record_length
+        validate_fn = self.validate_fn
+        result = []
+
+        pos = 0
+        while True:
+            end = raw_data.find(end_delimiter, pos)
+            if end < 0:
+                break
+            end += delim_len
+            length = end - pos
+            if length > delim_len and \
+               (max_length == None or length <= max_length) and \
+               (validate_fn == None or validate_fn(raw_data[pos:end])):
+                result.append((pos, end))
+            pos = end
+
+        return (result, pos)
+
+    def _scan_framed(self, raw_data):
+        """
+        Blocks run from a start delimiter through the next end delimiter.
+        """
+        start_delimiter = self.start_delimiter
+        end_delimiter = self.end_delimiter
+        max_length = self.max_record_length
+        validate_fn = self.validate_fn
+        result = []
+
+        pos = 0
+        watermark = None
+        while True:
+            start = raw_data.find(start_delimiter, pos)
+            if start < 0:
+                break
+            end = raw_data.find(end_delimiter, start + len(start_delimiter))
+            if end < 0:
+                if max_length == None or len(raw_data) - start < max_length:
+                    # could still be completed by more data
+                    watermark = start
+                    break
+                pos = start + 1
+                continue
+            end += len(end_delimiter)
+            if (max_length != None and end - start > max_length) or \
+               (validate_fn and not validate_fn(raw_data[start:end])):
+                pos = start + 1
+                continue
+            result.append((start, end))
+            pos = end
+
+        if watermark == None:
+            # a start delimiter may be split across the end of the data
+            watermark = max(pos, len(raw_data) - len(start_delimiter) + 1)
+        return (result, watermark)
+
+class SyncLengthSieve(ResumableSieve):
+    """
+    Finds binary records that start with a sync pattern and carry their own
+    length in a header field. Candidate records with an unreasonable length
+    or that fail validation are skipped and the search resumes one byte past
+    the sync, so a sync pattern inside non-data does not lose real records.
+    Works on strings and bytearrays.
+    """
+    def __init__(self, sync, length_offset, length_format='<H',
+                 length_multiplier=1, length_adjust=0,
+                 min_record_length=None, max_record_length=None,
+                 validate_fn=None, id_lengths=None):
+        """
+        The record length is field value * length_multiplier + length_adjust
+
+        @param sync The string of bytes every record starts with
+        @param length_offset Offset of the length field from the record start
+        @param length_format The struct format of the length field
+        @param length_multiplier Bytes per unit of the length field
+        @param length_adjust Bytes the length field does not account for
+        @param min_record_length The shortest valid record, defaults to the
+            header up through the length field
+        @param max_record_length The longest valid record, None if unbounded
+        @param validate_fn See RegexSieve, typically a checksum check
+        @param id_lengths An optional dict from the record ID byte that
+            follows the sync to the (shortest, longest) length of records
+            with that ID. If given, only the sync followed by one of these
+            IDs starts a record.
+        """
+        if not sync:
+            raise InstrumentParameterException(msg="No sync pattern given")
+        self.sync = sync
+        self.id_lengths = id_lengths
+        if id_lengths:
+            self._sync_regex = re.compile(re.escape(sync) + '[%s]' %
+                ''.join([re.escape(record_id) for record_id in id_lengths]))
+        else:
+            self._sync_regex = None
+        self.length_offset = length_offset
+        self.length_format = length_format
+        self.header_length = length_offset + struct.calcsize(length_format)
+        self.length_multiplier = length_multiplier
+        self.length_adjust = length_adjust
+        if min_record_length == None:
+            min_record_length = self.header_length
+        self.min_record_length = min_record_length
+        self.max_record_length = max_record_length
+        self.validate_fn = validate_fn
+
+    def scan(self, raw_data):
+        sync = self.sync
+        length_offset = self.length_offset
+        length_format = self.length_format
+        header_length = self.header_length
+        multiplier = self.length_multiplier
+        adjust = self.length_adjust
+        min_length = self.min_record_length
+        max_length = self.max_record_length
+        validate_fn = self.validate_fn
+        id_lengths = self.id_lengths
+        sync_regex = self._sync_regex
+        id_offset = len(sync)
+        data_length = len(raw_data)
+        result = []
+
+        pos = 0
+        watermark = None
+        while True:
+            if sync_regex:
+                match = sync_regex.search(raw_data, pos)
+                if not match:
+                    break
+                start = match.start()
+            else:
+                start = raw_data.find(sync, pos)
+                if start < 0:
+                    break
+            if start + header_length > data_length:
+                watermark = start
+                break
+
+            length = struct.unpack_from(length_format, raw_data,
+                                        start + length_offset)[0]
+            length = length * multiplier + adjust
+            if id_lengths:
+                (shortest, longest) = id_lengths[
+                    str(raw_data[start + id_offset:start + id_offset + 1])]
+            else:
+                (shortest, longest) = (min_length, max_length)
+            if length < max(shortest, min_length) or \
+               (longest != None and length > longest) or \
+               (max_length != None and length > max_length):
+                pos = start + 1
+                continue
+
+            end = start + length
+            if end > data_length:
+                watermark = start
+                break
+            if validate_fn and not validate_fn(raw_data[start:end]):
+                pos = start + 1
+                continue
+
+            result.append((start, end))
+            pos = end
+
+        if watermark == None:
+            # a sync pattern, and the ID after it, may be split across the
+            # end of the data
+            if sync_regex:
+                watermark = max(pos, data_length - id_offset)
+            else:
+                watermark = max(pos, data_length - len(sync) + 1)
+        return (result, watermark)
+
+def pd0_checksum_valid(block):
+    """
+    Check the trailing checksum of a PD0 ensemble, the sum of all the bytes
+    before it modulo 65536
+
+    @param block A complete ensemble, checksum included
+    @retval True if the checksum matches
+    """
+    if len(block) < 2:
+        return False
+    data = bytearray(block)
+    expected = struct.unpack_from('<H', data, len(data) - 2)[0]
+    return (sum(data[:-2]) & 0xFFFF) == expected
+
+def nortek_checksum_valid(block):
+    """
+    Check the trailing checksum of a Nortek record, 0xB58C plus the sum of
+    all the 16 bit little endian words before it modulo 65536
+
+    @param block A complete record, checksum included
+    @retval True if the checksum matches
+    """
+    if len(block) < 2 or len(block) % 2:
+        return False
+    words = struct.unpack_from('<%dH' % (len(block) / 2), block)
+    return ((NORTEK_CHECKSUM_SEED + sum(words[:-1])) & 0xFFFF) == words[-1]
+
+def pd0_sieve(max_record_length=PD0_MAX_RECORD_LENGTH):
+    """
+    Build a sieve for Teledyne PD0 ensembles
+
+    @param max_record_length The longest ensemble to accept
+    @retval A SyncLengthSieve
+    """
+    return SyncLengthSieve(PD0_SYNC, PD0_LENGTH_OFFSET, '<H',
+                           length_adjust=2,
+                           min_record_length=PD0_LENGTH_OFFSET + 4,
+                           max_record_length=max_record_length,
+                           validate_fn=pd0_checksum_valid)
+
+def nortek_sieve(max_record_length=NORTEK_MAX_RECORD_LENGTH,
+                 record_lengths=NORTEK_RECORD_LENGTHS):
+    """
+    Build a sieve for Nortek binary records. A record starts at the sync
+    byte and a known record ID, and must have the length expected for that
+    ID, so a stray 0xA5 in the data does not hold up the records after it.
+
+    @param max_record_length The longest record to accept
+    @param record_lengths A dict from record ID to the (shortest, longest)
+        length of that record, see NORTEK_RECORD_LENGTHS
+    @retval A SyncLengthSieve
+    """
+    return SyncLengthSieve(NORTEK_SYNC, NORTEK_LENGTH_OFFSET, '<H',
+                           length_multiplier=2,
+                           min_record_length=NORTEK_LENGTH_OFFSET + 4,
+                           max_record_length=max_record_length,
+                           validate_fn=nortek_checksum_valid,
+                           id_lengths=record_lengths)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.benchmark_port_agent_packet
+@file mi/core/instrument/test/benchmark_port_agent_packet.py
+@brief Measure how many port agent packets a second can be checksummed,
+    comparing the current PortAgentPacket against the original per byte
+    loop.
+
+Usage:
+    python -m mi.core.instrument.test.benchmark_port_agent_packet [size] [count]
+"""
+
+__license__ = 'Apache 2.0'
+
+import sys
+import time
+import struct
+
+from mi.core.instrument.port_agent_client import PortAgentPacket
+from mi.core.instrument.port_agent_client import HEADER_SIZE
+from mi.core.instrument.port_agent_client import OFFSET_P_CHECKSUM_LOW
+from mi.core.instrument.port_agent_client import OFFSET_P_CHECKSUM_HIGH
+
+def make_packet(data):
+    """
+    Build the header of a data packet for the data, as the port agent would
+    """
+    length = len(data) + HEADER_SIZE
+    header = struct.pack('>BBBBHHLL', 0xa3, 0x9d, 0x7a, 1, length, 0,
+                         3555423720, 0)
+    checksum = sum(bytearray(header)) + sum(bytearray(data))
+    return struct.pack('>BBBBHHLL', 0xa3, 0x9d, 0x7a, 1, length,
+                       checksum & 0xFFFF, 3555423720, 0)
+
+def per_byte_checksum(header, data):
+    """
+    The checksum as it was originally computed, one struct call per byte
+    """
+    checksum = 0
+    for i in range(HEADER_SIZE):
+        if i < OFFSET_P_CHECKSUM_LOW or i > OFFSET_P_CHECKSUM_HIGH:
+            checksum += struct.unpack_from('B', header[i])[0]
+    for i in range(len(data)):
+        checksum += struct.unpack_from('B', data[i])[0]
+    return checksum
+
+def run(size=512, count=2000):
+    """
+    Time both checksum implementations and print packets a second
+
+    @param size The number of data bytes in each packet
+    @param count The number of packets to checksum
+    """
+    data = ''.join([chr(i % 256) for i in range(size)])
+    header = make_packet(data)
+
+    start = time.time()
+    for i in xrange(count):
+        per_byte_checksum(header, data)
+    before = count / (time.time() - start)
+
+    start = time.time()
+    for i in xrange(count):
+        packet = PortAgentPacket()
+        packet.unpack_header(header)
+        packet.attach_data(data)
+        packet.verify_checksum()
+    after = count / (time.time() - start)
+
+    print "%d byte packets, %d packets" % (size, count)
+    print "  per byte loop: %12.0f packets/sec" % before
+    print "  PortAgentPacket: %10.0f packets/sec (%.0fx)" % (after, after / before)
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    run(*args)
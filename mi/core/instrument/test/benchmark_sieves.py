@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.benchmark_sieves
+@file mi/core/instrument/test/benchmark_sieves.py
+@brief Measure how many records a second a StringChunker can sieve out of
+    a fragmented stream, comparing the prebuilt sieves against hand written
+    sieve functions of the kind drivers carry.
+
+Usage:
+    python -m mi.core.instrument.test.benchmark_sieves [count] [fragment]
+"""
+
+__license__ = 'Apache 2.0'
+
+import re
+import sys
+import time
+import struct
+
+from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.sieves import RegexSieve
+from mi.core.instrument.sieves import pd0_sieve, nortek_sieve
+from mi.core.instrument.sieves import pd0_checksum_valid, nortek_checksum_valid
+
+PAR_PATTERN = r'SATPAR(?P<sernum>\d{4}),(?P<timer>\d{1,7}.\d\d),(?P<counts>\d{10}),(?P<checksum>\d{1,3})'
+PAR_REGEX = re.compile(PAR_PATTERN)
+
+def par_record(i):
+    return "SATPAR0229,%d.%02d,2206748%03d,%d\r\n" % (i / 100, i % 100,
+                                                      i % 1000, i % 256)
+
+def pd0_record(i):
+    payload = ''.join([chr((i + j) % 256) for j in range(200)])
+    body = '\x7f\x7f' + struct.pack('<H', len(payload) + 4) + payload
+    return body + struct.pack('<H', sum(bytearray(body)) & 0xFFFF)
+
+def nortek_record(i):
+    payload = ''.join([chr((i + j) % 256) for j in range(36)])
+    body = '\xa5\x01' + struct.pack('<H', 21) + payload
+    words = struct.unpack('<20H', body)
+    return body + struct.pack('<H', (0xb58c + sum(words)) & 0xFFFF)
+
+def par_sieve_fn(raw_data):
+    """
+    A driver style sieve: the whole buffer is matched on every call
+    """
+    return [(match.start(), match.end())
+            for match in PAR_REGEX.finditer(raw_data)]
+
+def sync_length_sieve_fn(sync, length_fn, validate_fn):
+    """
+    A driver style binary sieve: step through the buffer a byte at a time
+    looking for the sync, on every call
+    """
+    def sieve_fn(raw_data):
+        result = []
+        i = 0
+        while i < len(raw_data) - 3:
+            if raw_data[i:i + len(sync)] == sync:
+                length = length_fn(raw_data, i)
+                if length >= 4 and i + length <= len(raw_data) and \
+                   validate_fn(raw_data[i:i + length]):
+                    result.append((i, i + length))
+                    i += length
+                    continue
+            i += 1
+        return result
+    return sieve_fn
+
+def time_chunker(sieve, stream, fragment):
+    """
+    Feed the stream to a chunker in fragments, taking records out as they
+    complete
+
+    @retval (records, seconds)
+    """
+    chunker = StringChunker(sieve)
+    records = 0
+    start = time.time()
+    for pos in xrange(0, len(stream), fragment):
+        chunker.add_chunk(stream[pos:pos + fragment])
+        while chunker.get_next_data() != None:
+            records += 1
+    return (records, time.time() - start)
+
+def time_scan(sieve, stream):
+    """
+    Sieve the whole stream in one call, leaving the chunker out
+
+    @retval (records, seconds)
+    """
+    start = time.time()
+    records = len(sieve(stream))
+    return (records, time.time() - start)
+
+def run(count=2000, fragment=64):
+    """
+    Time each sieve pair and print records a second
+
+    @param count The number of records in each stream
+    @param fragment The bytes handed to the chunker at a time
+    """
+    cases = [
+        ('PAR lines', par_record, par_sieve_fn,
+         RegexSieve(PAR_PATTERN, max_record_length=40)),
+        ('PD0 ensembles', pd0_record,
+         sync_length_sieve_fn('\x7f\x7f',
+                              lambda data, i: struct.unpack_from('<H', data, i + 2)[0] + 2,
+                              pd0_checksum_valid),
+         pd0_sieve()),
+        ('Nortek velocity', nortek_record,
+         sync_length_sieve_fn('\xa5',
+                              lambda data, i: struct.unpack_from('<H', data, i + 2)[0] * 2,
+                              nortek_checksum_valid),
+         nortek_sieve()),
+        ]
+
+    print "%d records, %d byte fragments" % (count, fragment)
+    for (name, record_fn, before_fn, after_fn) in cases:
+        stream = ''.join([record_fn(i) for i in xrange(count)])
+        print "%s:" % name
+        for (label, timer) in [('chunker', time_chunker),
+                               ('one scan', time_scan)]:
+            args = (timer == time_chunker) and (fragment,) or ()
+            (before_records, before_time) = timer(before_fn, stream, *args)
+            (after_records, after_time) = timer(after_fn, stream, *args)
+            before = before_records / before_time
+            after = after_records / after_time
+            print "  %-8s sieve function: %10.0f records/sec (%d records)" % \
+                  (label, before, before_records)
+            print "  %-8s prebuilt sieve: %10.0f records/sec (%d records, %.1fx)" % \
+                  (label, after, after_records, after / before)
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    run(*args)
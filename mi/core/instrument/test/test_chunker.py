@@ -10,13 +10,16 @@
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
-import unittest
 import re
+import struct
 from nose.plugins.attrib import attr
 from pyon.util.unit_test import IonUnitTestCase
 from ooi.logging import log
 
 from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.chunker import SieveAdapter
+from mi.core.instrument.chunker import BinaryChunker
+from mi.core.instrument.sieves import SyncLengthSieve
 
 @attr('UNIT', group='mi')
 class UnitTestStringChunker(IonUnitTestCase):
@@ -233,52 +236,280 @@ class UnitTestStringChunker(IonUnitTestCase):
         result = self._chunker.get_next_data()
         self.assertEquals(result, None)
                 
-@unittest.skip("Write this when a binary chunker is needed")
+@attr('UNIT', group='mi')
+class UnitTestRingStringChunker(UnitTestStringChunker):
+    """
+    Run the string chunker tests against the bytearray backed ring buffer
+    mode, plus some tests for the lazy compaction.
+    """
+    def setUp(self):
+        """ Setup a ring buffer chunker that compacts early """
+        self._chunker = StringChunker(UnitTestStringChunker.sieve_function,
+                                      ring_buffer=True,
+                                      compact_threshold=40)
+
+    def test_returns_strings(self):
+        """
+        Blocks come back as strings even though they are stored in a
+        bytearray
+        """
+        self._chunker.add_chunk("Foo%s" % self.SAMPLE_1)
+        result = self._chunker.get_next_non_data()
+        self.assertTrue(isinstance(result, str))
+        self.assertEquals(result, "Foo")
+        result = self._chunker.get_next_data()
+        self.assertTrue(isinstance(result, str))
+        self.assertEquals(result, self.SAMPLE_1)
+
+    def test_lazy_compaction(self):
+        """
+        Consumed data stays in the buffer until the threshold is passed,
+        indices are only rebased when the buffer is compacted
+        """
+        self._chunker.add_chunk(self.SAMPLE_1)
+        self._chunker.add_chunk(self.SAMPLE_2)
+        self._chunker.add_chunk(self.FRAGMENT_1)
+
+        # 31 bytes consumed, under the threshold so nothing moves
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_1)
+        self.assertEquals(len(self._chunker.buffer), 79)
+        self.assertEquals(self._chunker.data_chunk_list, [(31, 62)])
+        self.assertEquals(self._chunker.nondata_chunk_list, [(62, 79)])
+
+        # 62 bytes consumed, over the threshold and bigger than the 17 live
+        # bytes, so compact
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_2)
+        self.assertEquals(len(self._chunker.buffer), 17)
+        self.assertEquals(self._chunker.data_chunk_list, [])
+        self.assertEquals(self._chunker.nondata_chunk_list, [(0, 17)])
+        self.assertEquals(self._chunker.raw_chunk_list, [(0, 17)])
+
+        # and the fragment still completes after the rebase
+        self._chunker.add_chunk(self.FRAGMENT_2)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.FRAGMENT_SAMPLE)
+        result = self._chunker.get_next_non_data()
+        self.assertEquals(result, None)
+
+    def test_default_compaction(self):
+        """
+        With the default threshold the consumed data is cut out on every
+        fetch, so the buffer and indices look as they always have
+        """
+        chunker = StringChunker(UnitTestStringChunker.sieve_function)
+        chunker.add_chunk("%s\r\n%s\r\n%s\r\n" % (self.SAMPLE_1,
+                                                  self.SAMPLE_2,
+                                                  self.SAMPLE_3))
+        result = chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_1)
+        self.assertEquals(chunker.buffer,
+                          "\r\n%s\r\n%s\r\n" % (self.SAMPLE_2, self.SAMPLE_3))
+        self.assertEquals(chunker.data_chunk_list, [(2, 33), (35, 66)])
+
+@attr('UNIT', group='mi')
+class UnitTestSieveAdapterChunker(UnitTestStringChunker):
+    """
+    Run the string chunker tests with the sieve wrapped in a bounded
+    resumable sieve, plus tests that already sieved data is skipped.
+    """
+    def setUp(self):
+        """ Setup a chunker with a recording, bounded sieve """
+        self._sieved = []
+        def recording_sieve(raw_data):
+            self._sieved.append(raw_data)
+            return UnitTestStringChunker.sieve_function(raw_data)
+
+        self._chunker = StringChunker(SieveAdapter(recording_sieve,
+                                                   max_record_length=31))
+
+    def test_adapter_watermark(self):
+        """
+        The adapter watermark is the end of the last block found, or the
+        record length back from the end of the data
+        """
+        adapter = SieveAdapter(UnitTestStringChunker.sieve_function)
+        self.assertEquals(adapter.scan("Foo"), ([], 0))
+        self.assertEquals(adapter.scan("Foo%sBar" % self.SAMPLE_1),
+                          ([(3, 34)], 34))
+        self.assertEquals(adapter("Foo%sBar" % self.SAMPLE_1), [(3, 34)])
+
+        adapter = SieveAdapter(UnitTestStringChunker.sieve_function,
+                               max_record_length=31)
+        self.assertEquals(adapter.scan("Foo"), ([], 0))
+        self.assertEquals(adapter.scan("X" * 100), ([], 70))
+        self.assertEquals(adapter.scan("Foo%sBar" % self.SAMPLE_1),
+                          ([(3, 34)], 34))
+
+    def test_bounded_rescan(self):
+        """
+        Trickle in a long stretch of non-data and make sure the sieve only
+        ever sees the new data plus the record length overlap
+        """
+        for i in range(50):
+            self._chunker.add_chunk("0123456789")
+        self._chunker.add_chunk(self.SAMPLE_1)
+
+        for sieved in self._sieved:
+            self.assertTrue(len(sieved) <= 31 + 30)
+
+        result = self._chunker.get_next_non_data()
+        self.assertEquals(result, "0123456789" * 50)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_1)
+
+@attr('UNIT', group='mi')
+class UnitTestTimestampChunker(IonUnitTestCase):
+    """
+    Test carrying arrival timestamps through the chunker
+    """
+    SAMPLE_1 = UnitTestStringChunker.SAMPLE_1
+    SAMPLE_2 = UnitTestStringChunker.SAMPLE_2
+    FRAGMENT_1 = UnitTestStringChunker.FRAGMENT_1
+    FRAGMENT_2 = UnitTestStringChunker.FRAGMENT_2
+
+    def setUp(self):
+        """ Setup a chunker for use in tests """
+        self._chunker = StringChunker(UnitTestStringChunker.sieve_function)
+
+    def test_timestamp_per_record(self):
+        """
+        Records get the timestamp of the chunk holding their first byte
+        """
+        self._chunker.add_chunk("Foo" + self.FRAGMENT_1, timestamp=10.0)
+        self._chunker.add_chunk(self.FRAGMENT_2 + self.SAMPLE_1, timestamp=11.0)
+        self._chunker.add_chunk("Bar", timestamp=12.0)
+        self._chunker.add_chunk(self.SAMPLE_2, timestamp=13.0)
+
+        (timestamp, result) = self._chunker.get_next_non_data_with_timestamp(clean=False)
+        self.assertEquals((timestamp, result), (10.0, "Foo"))
+        (timestamp, result) = self._chunker.get_next_data_with_timestamp()
+        self.assertEquals(result, self.FRAGMENT_1 + self.FRAGMENT_2)
+        self.assertEquals(timestamp, 10.0)
+        (timestamp, result) = self._chunker.get_next_data_with_timestamp()
+        self.assertEquals((timestamp, result), (11.0, self.SAMPLE_1))
+        (timestamp, result) = self._chunker.get_next_data_with_timestamp()
+        self.assertEquals((timestamp, result), (13.0, self.SAMPLE_2))
+        self.assertEquals(self._chunker.get_next_data_with_timestamp(),
+                          (None, None))
+
+    def test_timestamp_compaction(self):
+        """
+        Timestamps stay lined up when the buffer is compacted
+        """
+        self._chunker = StringChunker(UnitTestStringChunker.sieve_function,
+                                      ring_buffer=True, compact_threshold=0)
+        self._chunker.add_chunk(self.SAMPLE_1 + self.FRAGMENT_1, timestamp=1.0)
+        self._chunker.add_chunk(self.FRAGMENT_2, timestamp=2.0)
+        self._chunker.add_chunk(self.SAMPLE_2, timestamp=3.0)
+        self.assertEquals(self._chunker.get_next_data_with_timestamp(),
+                          (1.0, self.SAMPLE_1))
+        self.assertEquals(self._chunker.get_next_data_with_timestamp(),
+                          (1.0, self.FRAGMENT_1 + self.FRAGMENT_2))
+        self.assertEquals(len(self._chunker.buffer), len(self.SAMPLE_2))
+        self.assertEquals(self._chunker.get_next_data_with_timestamp(),
+                          (3.0, self.SAMPLE_2))
+
+    def test_no_timestamp(self):
+        """
+        Chunks added without a timestamp give None
+        """
+        self._chunker.add_chunk(self.SAMPLE_1)
+        self.assertEquals(self._chunker.get_next_data_with_timestamp(),
+                          (None, self.SAMPLE_1))
+    
 @attr('UNIT', group='mi')
 class UnitTestBinaryChunker(IonUnitTestCase):
     """
     Test the basic functionality of the chunker system via unit tests
     """
-    SAMPLE_1 = []
-    SAMPLE_2 = []
-    SAMPLE_3 = []
+    # Records are a 0xA5 sync byte, a length byte and a payload
+    SAMPLE_1 = "\xa5\x05\x01\x02\x03"
+    SAMPLE_2 = "\xa5\x06\x04\x05\x06\x07"
+    SAMPLE_3 = "\xa5\x04\xa5\x09"
+    
+    FRAGMENT_1 = "\xa5\x06\x04"
+    FRAGMENT_2 = "\x05\x06\x07"
     
-    FRAGMENT_1 = []
-    FRAGMENT_2 = []
+    MULTI_SAMPLE_1 = SAMPLE_1 + "\x00\x00" + SAMPLE_2
     
-    MULTI_SAMPLE_1 = []
+    def setUp(self):
+        """ Setup a chunker for use in tests """
+        self._chunker = BinaryChunker(SyncLengthSieve('\xa5', 1, '<B',
+                                                      min_record_length=3))
     
     def test_add_get_simple(self):
         """
         Add a simple string of data to the buffer, get the next chunk out
         """
-        pass
+        self._chunker.add_chunk(self.SAMPLE_1)
+        self.assertEquals(self._chunker.raw_chunk_list, [(0, 5)])
+        self.assertEquals(self._chunker.data_chunk_list, [(0, 5)])
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_1)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, None)
     
     def test_add_get_many_simple(self):
         """
         Add a few simple strings of data to the buffer, get the chunks out
         """
-        # Add a sample,
-        # Add a sample
-        # Add another sample
-        # get some samples out,
-        # assert they were correct and in the right order
-        pass
+        self._chunker.add_chunk(self.SAMPLE_1)
+        self._chunker.add_chunk(self.SAMPLE_2)
+        self._chunker.add_chunk(self.SAMPLE_3)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_1)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_2)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_3)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, None)
     
     def test_add_get_fragment(self):
         """
         Add some fragments of a string, then verify that value is stitched together
         """
-        # Add a part of a sample
-        # confirm you cant get anything out
-        # add the rest of the sample
-        # confirm that the rest comes out
-        pass
+        self._chunker.add_chunk(self.FRAGMENT_1)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, None)
+        
+        self._chunker.add_chunk(self.FRAGMENT_2)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.FRAGMENT_1 + self.FRAGMENT_2)
     
     def test_add_multiple_in_one(self):
         """
         Test multiple data bits input in a single sample. They will ultimately
         need to be split apart.
         """
-        pass
-    
+        self._chunker.add_chunk(self.MULTI_SAMPLE_1)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_1)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_2)
+        result = self._chunker.get_next_data()
+        self.assertEquals(result, None)
+
+    def test_zero_copy(self):
+        """
+        Get memoryview blocks out and make sure they survive the buffer
+        moving on
+        """
+        self._chunker = BinaryChunker(SyncLengthSieve('\xa5', 1, '<B',
+                                                      min_record_length=3),
+                                      zero_copy=True,
+                                      compact_threshold=0)
+        self._chunker.add_chunk(self.MULTI_SAMPLE_1)
+        first = self._chunker.get_next_data()
+        self.assertTrue(isinstance(first, memoryview))
+        self.assertEquals(struct.unpack_from('<B', first, 1)[0], 5)
+
+        self._chunker.add_chunk(self.SAMPLE_3)
+        second = self._chunker.get_next_data()
+        third = self._chunker.get_next_data()
+        self.assertEquals(first.tobytes(), self.SAMPLE_1)
+        self.assertEquals(second.tobytes(), self.SAMPLE_2)
+        self.assertEquals(third.tobytes(), self.SAMPLE_3)
+        self.assertEquals(self._chunker.get_next_data(), None)
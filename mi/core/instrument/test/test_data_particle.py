@@ -13,12 +13,24 @@ __license__ = 'Apache 2.0'
 
 import json
 import base64
+import random
+import time
+import threading
 from nose.plugins.attrib import attr
 from pyon.util.unit_test import IonUnitTestCase
 
 from mi.core.log import get_logger ; log = get_logger()
+from mi.core import ntp_clock
+from mi.core.ntp_clock import NtpClock
 from mi.core.exceptions import SampleException, ReadOnlyException, NotImplementedException
 from mi.core.instrument.data_particle import DataParticle, DataParticleKey, DataParticleValue
+from mi.core.instrument.data_particle import ParticleEncoder
+from mi.core.instrument.data_particle import BinaryParticleEncoder, BinaryParticleDecoder
+from mi.core.instrument.data_particle import decode_particle, BINARY_MAGIC
+from mi.core.instrument.data_particle import DataParticleBatch
+from mi.instrument.seabird.sbe37smb.ooicore.driver import SBE37DataParticle
+from mi.instrument.seabird.sbe16plus_v2.ooicore.driver import SBE16DataParticle
+from mi.instrument.satlantic.par_ser_600m.driver import SatlanticPARDataParticle
 
 TEST_PARTICLE_VERSION = 1
 
@@ -56,6 +68,11 @@ class TestUnitDataParticle(IonUnitTestCase):
         self.sample_internal_timestamp = 3555423719.711772
         self.sample_raw_data = "SATPAR0229,10.01,2206748544,234"
 
+        # run at the time of the samples
+        self.clock = ntp_clock.set_clock(NtpClock(
+            source=lambda: self.sample_driver_timestamp - ntp_clock.NTP_DELTA,
+            monotonic=lambda: 0.0))
+
         self.parsed_test_particle = self.TestDataParticle(self.sample_raw_data,
                                     port_timestamp=self.sample_port_timestamp,
                                     quality_flag=DataParticleValue.INVALID,
@@ -99,6 +116,9 @@ class TestUnitDataParticle(IonUnitTestCase):
                                   ]
                                 }
 
+    def tearDown(self):
+        ntp_clock.set_clock(self.clock)
+
     def test_generate_raw(self):
         """
         Test generation of a raw format data particle
@@ -168,3 +188,362 @@ class TestUnitDataParticle(IonUnitTestCase):
         self.assertRaises(NotImplementedException, test_particle.get_value,
                           "bad_key")
         
+    def test_contents(self):
+        """
+        Test the header fields are available as a dict
+        """
+        contents = self.raw_test_particle.contents
+        self.assertEquals(contents[DataParticleKey.PORT_TIMESTAMP],
+                          self.sample_port_timestamp)
+        self.assertEquals(contents[DataParticleKey.PKT_FORMAT_ID],
+                          DataParticleValue.JSON_DATA)
+
+        # changing the copy leaves the particle alone
+        contents[DataParticleKey.QUALITY_FLAG] = DataParticleValue.INVALID
+        self.assertEquals(self.raw_test_particle.get_value(DataParticleKey.QUALITY_FLAG),
+                          DataParticleValue.OK)
+
+        # assigning a dict sets the fields it has
+        contents[DataParticleKey.PORT_TIMESTAMP] = self.sample_port_timestamp + 1
+        self.raw_test_particle.contents = contents
+        self.assertEquals(self.raw_test_particle.get_value(DataParticleKey.QUALITY_FLAG),
+                          DataParticleValue.INVALID)
+        self.assertEquals(self.raw_test_particle.get_value(DataParticleKey.PORT_TIMESTAMP),
+                          self.sample_port_timestamp + 1)
+        self.raw_test_particle.contents = {DataParticleKey.QUALITY_FLAG:
+                                           DataParticleValue.OK}
+        self.assertEquals(self.raw_test_particle.get_value(DataParticleKey.PORT_TIMESTAMP),
+                          self.sample_port_timestamp + 1)
+
+        self.assertRaises(ReadOnlyException, setattr, self.raw_test_particle,
+                          'contents', {"bad_key": 1})
+        self.assertRaises(ReadOnlyException, setattr, self.raw_test_particle,
+                          'contents', {DataParticleKey.PKT_FORMAT_ID:
+                                       DataParticleValue.BINARY_DATA})
+
+    def test_driver_particles_slotted(self):
+        """
+        The driver particles keep no per particle dict
+        """
+        for particle_class in [SBE37DataParticle, SBE16DataParticle,
+                               SatlanticPARDataParticle]:
+            particle = particle_class("data", port_timestamp=self.sample_port_timestamp)
+            self.assertFalse(hasattr(particle, '__dict__'))
+
+        particle = SBE37DataParticle("#55.9044,53.221,  -1.0",
+                                     port_timestamp=self.sample_port_timestamp)
+        parsed = json.loads(particle.generate_parsed())
+        self.assertEquals(len(parsed[DataParticleKey.VALUES]), 3)
+
+    def test_generate_all(self):
+        """
+        Test generating raw and parsed particles in one pass
+        """
+        (raw_result, parsed_result, sample) = self.parsed_test_particle.generate_all()
+        self.assertEqual(raw_result, self.parsed_test_particle.generate_raw())
+        self.assertEqual(parsed_result, self.parsed_test_particle.generate_parsed())
+        self.assertEqual(sample[DataParticleValue.RAW], json.loads(raw_result))
+        self.assertEqual(sample[DataParticleValue.PARSED], json.loads(parsed_result))
+
+        test_particle = self.TestDataParticle(self.sample_raw_data,
+            preferred_timestamp=DataParticleKey.PORT_TIMESTAMP)
+        self.assertRaises(SampleException, test_particle.generate_all)
+
+@attr('UNIT', group='mi')
+class TestUnitParticleEncoder(IonUnitTestCase):
+    """
+    The compiled particle encoder must give exactly what json.dumps does
+    """
+    SCHEMA = [("temp", float), ("cond", float), ("serial", str),
+              ("count", int), ("flag", bool)]
+
+    def header(self, stream):
+        structure = {DataParticleKey.PKT_FORMAT_ID: DataParticleValue.JSON_DATA,
+                     DataParticleKey.PKT_VERSION: 1,
+                     DataParticleKey.STREAM_NAME: stream,
+                     DataParticleKey.DRIVER_TIMESTAMP: 3555423721.711772,
+                     DataParticleKey.PREFERRED_TIMESTAMP: DataParticleKey.PORT_TIMESTAMP,
+                     DataParticleKey.QUALITY_FLAG: DataParticleValue.OK}
+        if random.random() < .5:
+            structure[DataParticleKey.PORT_TIMESTAMP] = random.uniform(0, 4e9)
+        if random.random() < .5:
+            structure[DataParticleKey.INTERNAL_TIMESTAMP] = random.uniform(0, 4e9)
+        return structure
+
+    def random_value(self):
+        return random.choice([random.uniform(-1e6, 1e6), random.randint(-5, 2**40),
+                              2**70, True, False, None, "text \"quoted\"\t",
+                              u"unicode \u00e9", float('nan'), float('inf'),
+                              1e-300, [1, 2.5, "x"], {"b": 1, "a": 2}])
+
+    def assertEncodes(self, encoder, structure):
+        self.assertEqual(encoder.encode(structure),
+                         json.dumps(structure, sort_keys=True))
+
+    def test_parsed(self):
+        encoder = ParticleEncoder(self.SCHEMA)
+        random.seed(5)
+        for i in range(500):
+            structure = self.header(DataParticleValue.PARSED)
+            values = []
+            for (value_id, value_type) in self.SCHEMA:
+                if random.random() < .8:
+                    value = {float: random.uniform(-100, 100),
+                             int: random.randint(0, 2**31),
+                             str: "%08d" % random.randint(0, 10**8),
+                             bool: random.random() < .5}[value_type]
+                else:
+                    value = self.random_value()
+                values.append({DataParticleKey.VALUE_ID: value_id,
+                               DataParticleKey.VALUE: value})
+            # values out of schema order, unknown ids and odd items
+            if random.random() < .3:
+                random.shuffle(values)
+            if random.random() < .3:
+                values.append({DataParticleKey.VALUE_ID: "extra",
+                               DataParticleKey.VALUE: self.random_value(),
+                               "units": "m"})
+            structure[DataParticleKey.VALUES] = values
+            self.assertEncodes(encoder, structure)
+            self.assertEncodes(ParticleEncoder(), structure)
+
+    def test_raw(self):
+        encoder = ParticleEncoder()
+        random.seed(6)
+        for i in range(100):
+            structure = self.header(DataParticleValue.RAW)
+            data = "".join([chr(random.randint(0, 255)) for j in range(20)])
+            structure[DataParticleKey.VALUES] = [{
+                DataParticleKey.VALUE_ID: DataParticleValue.RAW,
+                DataParticleKey.VALUE: base64.b64encode(data),
+                DataParticleKey.BINARY: True}]
+            self.assertEncodes(encoder, structure)
+
+    def test_unexpected_layout(self):
+        encoder = ParticleEncoder(self.SCHEMA)
+        structure = self.header(DataParticleValue.PARSED)
+        structure[DataParticleKey.VALUES] = ("not", "a list")
+        self.assertEncodes(encoder, structure)
+        structure[DataParticleKey.VALUES] = []
+        structure["extra_key"] = 1
+        self.assertEncodes(encoder, structure)
+
+@attr('UNIT', group='mi')
+class TestUnitBinaryParticle(IonUnitTestCase):
+    """
+    Particles published in the binary format decode back to the structure
+    they were built from
+    """
+    class BinaryTestParticle(TestUnitDataParticle.TestDataParticle):
+        _pkt_format_id = DataParticleValue.BINARY_DATA
+
+    def setUp(self):
+        self.raw_data = "".join([chr(i) for i in range(256)])
+        self.particle = self.BinaryTestParticle(self.raw_data,
+                                    port_timestamp=3555423720.711772,
+                                    internal_timestamp=3555423719.711772)
+
+    def test_raw(self):
+        packet = self.particle.generate_raw()
+        self.assertTrue(packet.startswith(BINARY_MAGIC))
+        structure = decode_particle(packet)
+        self.assertEqual(structure[DataParticleKey.PKT_FORMAT_ID],
+                         DataParticleValue.BINARY_DATA)
+        self.assertEqual(structure[DataParticleKey.STREAM_NAME],
+                         DataParticleValue.RAW)
+        self.assertEqual(structure[DataParticleKey.PORT_TIMESTAMP],
+                         3555423720.711772)
+        self.assertEqual(structure[DataParticleKey.INTERNAL_TIMESTAMP],
+                         3555423719.711772)
+        self.assertEqual(structure[DataParticleKey.VALUES],
+                         [{DataParticleKey.VALUE_ID: DataParticleValue.RAW,
+                           DataParticleKey.VALUE: self.raw_data,
+                           DataParticleKey.BINARY: True}])
+
+        # the raw bytes are carried as they are, not as base64 in JSON
+        json_packet = TestUnitDataParticle.TestDataParticle(self.raw_data,
+            port_timestamp=3555423720.711772).generate_raw()
+        self.assertTrue(len(packet) < len(json_packet) * 3 / 4)
+
+    def test_generate_all(self):
+        (raw, parsed, structures) = self.particle.generate_all()
+        self.assertEqual(decode_particle(raw),
+                         structures[DataParticleValue.RAW])
+        self.assertEqual(decode_particle(parsed),
+                         structures[DataParticleValue.PARSED])
+
+    def test_json_still_decodes(self):
+        particle = TestUnitDataParticle.TestDataParticle(self.raw_data,
+            port_timestamp=3555423720.711772)
+        packet = particle.generate_parsed()
+        self.assertEqual(decode_particle(packet), json.loads(packet))
+
+    def test_value_types(self):
+        encoder = BinaryParticleEncoder()
+        decoder = BinaryParticleDecoder()
+        values = [1.5, -7, 2**62, 2**70, True, False, None, "text\x00\xff",
+                  u"unicode \u00e9", [1, 2.5, "x"], {"a": 1}, float('inf')]
+        structure = {DataParticleKey.PKT_FORMAT_ID: DataParticleValue.BINARY_DATA,
+                     DataParticleKey.PKT_VERSION: 3,
+                     DataParticleKey.STREAM_NAME: DataParticleValue.PARSED,
+                     DataParticleKey.DRIVER_TIMESTAMP: 3555423721.711772,
+                     DataParticleKey.PREFERRED_TIMESTAMP: DataParticleKey.DRIVER_TIMESTAMP,
+                     DataParticleKey.QUALITY_FLAG: DataParticleValue.OK,
+                     DataParticleKey.VALUES:
+                         [{DataParticleKey.VALUE_ID: "v%d" % i,
+                           DataParticleKey.VALUE: value}
+                          for (i, value) in enumerate(values)] +
+                         [{DataParticleKey.VALUE_ID: "extra",
+                           DataParticleKey.VALUE: 1, "units": "m"}]}
+        decoded = decoder.decode(encoder.encode(structure))
+        self.assertEqual(decoded, structure)
+        for (item, value) in zip(decoded[DataParticleKey.VALUES], values):
+            self.assertEqual(type(item[DataParticleKey.VALUE]) is bool,
+                             type(value) is bool)
+
+    def test_invalid(self):
+        packet = self.particle.generate_parsed()
+        self.assertRaises(SampleException, decode_particle, packet[:-1])
+        self.assertRaises(SampleException, decode_particle, packet + "x")
+        self.assertRaises(SampleException, decode_particle, BINARY_MAGIC + "\x09")
+
+@attr('UNIT', group='mi')
+class TestUnitDataParticleBatch(IonUnitTestCase):
+    """
+    Samples are published in columns, flushed on size or age
+    """
+    class CountParticle(DataParticle):
+        def _build_parsed_values(self):
+            result = [{DataParticleKey.VALUE_ID: "count",
+                       DataParticleKey.VALUE: int(self.raw_data)}]
+            if int(self.raw_data) % 2:
+                result.append({DataParticleKey.VALUE_ID: "odd",
+                               DataParticleKey.VALUE: True})
+            return result
+
+    def setUp(self):
+        self.packets = []
+
+    def particle(self, i):
+        return self.CountParticle(str(i), port_timestamp=3555423720.0 + i)
+
+    def test_size(self):
+        batch = DataParticleBatch(self.CountParticle, self.packets.append,
+                                  size=3, max_age=None)
+        sample = batch.add(self.particle(0))
+        self.assertEqual(sample[DataParticleValue.PARSED][DataParticleKey.VALUES],
+                         [{DataParticleKey.VALUE_ID: "count",
+                           DataParticleKey.VALUE: 0}])
+        for i in range(1, 7):
+            batch.add(self.particle(i))
+        self.assertEqual(len(self.packets), 2)
+        self.assertEqual(len(batch), 1)
+
+        structure = json.loads(self.packets[0])
+        self.assertEqual(structure[DataParticleKey.PKT_FORMAT_ID],
+                         DataParticleValue.JSON_BATCH)
+        self.assertEqual(structure[DataParticleKey.COUNT], 3)
+        self.assertEqual(structure[DataParticleKey.PORT_TIMESTAMP],
+                         [3555423720.0, 3555423721.0, 3555423722.0])
+        self.assertEqual(structure[DataParticleKey.INTERNAL_TIMESTAMP],
+                         [None, None, None])
+        self.assertEqual(structure[DataParticleKey.VALUES],
+                         [{DataParticleKey.VALUE_ID: "count",
+                           DataParticleKey.VALUE: [0, 1, 2]},
+                          {DataParticleKey.VALUE_ID: "odd",
+                           DataParticleKey.VALUE: [None, True, None]},
+                          {DataParticleKey.VALUE_ID: DataParticleValue.RAW,
+                           DataParticleKey.VALUE: [base64.b64encode("0"),
+                                                   base64.b64encode("1"),
+                                                   base64.b64encode("2")],
+                           DataParticleKey.BINARY: True}])
+
+        batch.flush()
+        self.assertEqual(len(self.packets), 3)
+        self.assertEqual(json.loads(self.packets[2])[DataParticleKey.COUNT], 1)
+        batch.flush()
+        self.assertEqual(len(self.packets), 3)
+
+    def test_age(self):
+        batch = DataParticleBatch(self.CountParticle, self.packets.append,
+                                  size=100, max_age=.05)
+        batch.add(self.particle(0))
+        batch.add(self.particle(1))
+        self.assertEqual(self.packets, [])
+        end = time.time() + 2
+        while not self.packets and time.time() < end:
+            time.sleep(.01)
+        self.assertEqual(len(self.packets), 1)
+        self.assertEqual(json.loads(self.packets[0])[DataParticleKey.COUNT], 2)
+        self.assertEqual(len(batch), 0)
+
+    def test_one_timer(self):
+        """
+        Every age flush of a batch comes from the same timer thread, which
+        close() stops.
+        """
+        threads = []
+        def callback(packet):
+            threads.append(threading.current_thread())
+            self.packets.append(packet)
+        batch = DataParticleBatch(self.CountParticle, callback,
+                                  size=100, max_age=.02)
+        for i in range(3):
+            batch.add(self.particle(i))
+            end = time.time() + 2
+            while len(self.packets) <= i and time.time() < end:
+                time.sleep(.01)
+        self.assertEqual(len(self.packets), 3)
+        self.assertEqual(len(set(threads)), 1)
+        self.assertTrue(threads[0] is batch._timer)
+
+        batch.add(self.particle(3))
+        batch.close()
+        self.assertEqual(len(self.packets), 4)
+        batch._timer.join(2)
+        self.assertFalse(batch._timer.is_alive())
+
+    def test_publish_order(self):
+        """
+        A packet taken while the callback is still publishing the one
+        before waits for it, rather than overtaking it.
+        """
+        release = threading.Event()
+        active = []
+        overlapped = []
+        def callback(packet):
+            active.append(packet)
+            overlapped.append(len(active) > 1)
+            if not self.packets:
+                release.wait(2)
+            self.packets.append(packet)
+            active.remove(packet)
+        batch = DataParticleBatch(self.CountParticle, callback,
+                                  size=100, max_age=None)
+        batch.add(self.particle(0))
+        first = threading.Thread(target=batch.flush)
+        first.start()
+        end = time.time() + 2
+        while not active and time.time() < end:
+            time.sleep(.01)
+
+        batch.add(self.particle(1))
+        second = threading.Thread(target=batch.flush)
+        second.start()
+        second.join(.1)
+        self.assertTrue(second.is_alive())
+        self.assertEqual(len(batch), 0)
+
+        release.set()
+        first.join(2)
+        second.join(2)
+        self.assertEqual([json.loads(p)[DataParticleKey.PORT_TIMESTAMP]
+                          for p in self.packets],
+                         [[3555423720.0], [3555423721.0]])
+        self.assertEqual(overlapped, [False, False])
+
+    def test_invalid(self):
+        batch = DataParticleBatch(self.CountParticle, self.packets.append)
+        particle = self.CountParticle("1")
+        self.assertRaises(SampleException, batch.add, particle)
+        self.assertEqual(len(batch), 0)
@@ -74,3 +74,21 @@ class TestUnitInstrumentDriver(IonUnitTestCase):
 
         self.assertFalse(exception)
 
+    def test_drop_protocol(self):
+        """
+        Disconnecting, losing the connection and shutting down publish the
+        samples the protocol holds in batches.
+        """
+        for handler in (self.driver._handler_connected_disconnect,
+                        self.driver._handler_connected_connection_lost):
+            protocol = Mock(name='protocol')
+            self.driver._protocol = protocol
+            self.driver._connection = self.mock.port_agent
+            handler()
+            protocol._flush_sample_batches.assert_called_once_with(close=True)
+            self.assertEqual(self.driver._protocol, None)
+
+        protocol = Mock(name='protocol')
+        self.driver._protocol = protocol
+        self.driver._shutdown()
+        protocol._flush_sample_batches.assert_called_once_with(close=True)
@@ -10,13 +10,23 @@
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import json
 import logging
+import Queue
+import threading
+import time
+from mock import Mock
 from nose.plugins.attrib import attr
 from mi.core.log import get_logger ; log = get_logger()
+from mi.core.common import BaseEnum
+from mi.core.exceptions import InstrumentTimeoutException
+from mi.core.exceptions import InstrumentProtocolException
 from mi.core.instrument.instrument_protocol import InstrumentProtocol
+from mi.core.instrument.instrument_protocol import CommandResponseInstrumentProtocol
+from mi.core.instrument.port_agent_client import PortAgentClient
 #from mi.core.instrument.data_particle import DataParticle
-from mi.instrument.satlantic.par_ser_600m.ooicore.driver import SAMPLE_REGEX
-from mi.instrument.satlantic.par_ser_600m.ooicore.driver import SatlanticPARDataParticle
+from mi.instrument.satlantic.par_ser_600m.driver import SAMPLE_REGEX
+from mi.instrument.satlantic.par_ser_600m.driver import SatlanticPARDataParticle
 from pyon.util.unit_test import IonUnitTestCase
 
 @attr('UNIT', group='mi')
@@ -48,7 +58,39 @@ class TestUnitInstrumentProtocol(IonUnitTestCase):
 
         # Test the format of the result in the individual driver tests. Here,
         # just tests that the result is there.
+
+    def test_got_data_batch(self):
+        """
+        The default batch hook hands each packet to got_data in order.
+        """
+        received = []
+        self.protocol.got_data = received.append
+        self.protocol.got_data_batch(["one", "two", "three"])
+        self.assertEquals(received, ["one", "two", "three"])
         
+    def test_flush_sample_batches(self):
+        """
+        Batched samples are held until the batches are flushed.
+        """
+        events = []
+        protocol = InstrumentProtocol(lambda type, val=None: events.append(val))
+        protocol._batch_samples(SatlanticPARDataParticle, size=10, max_age=None)
+        protocol._extract_sample(SatlanticPARDataParticle, SAMPLE_REGEX,
+                                 "SATPAR0229,10.01,2206748544,234")
+        protocol._extract_sample(SatlanticPARDataParticle, SAMPLE_REGEX,
+                                 "SATPAR0229,10.02,2206748545,235")
+        self.assertEquals(events, [])
+
+        protocol._flush_sample_batches()
+        self.assertEquals(len(events), 1)
+        self.assertEquals(json.loads(events[0])['count'], 2)
+
+        protocol._extract_sample(SatlanticPARDataParticle, SAMPLE_REGEX,
+                                 "SATPAR0229,10.03,2206748546,236")
+        protocol._flush_sample_batches(close=True)
+        self.assertEquals(len(events), 2)
+        self.assertEquals(json.loads(events[1])['count'], 1)
+
     def test_publish_raw(self):
         """
         Tests to see if raw data is appropriately published back out to
@@ -79,4 +121,310 @@ class TestUnitInstrumentProtocol(IonUnitTestCase):
         # similar to above
         self.assertTrue(False)    
         
-    
\ No newline at end of file
+    
+@attr('UNIT', group='mi')
+class TestUnitCommandResponseInstrumentProtocol(IonUnitTestCase):
+    """
+    Waiting for responses wakes as soon as the data arrives
+    """
+    class Prompt(BaseEnum):
+        COMMAND = 'S>'
+        OTHER = '?>'
+
+    def setUp(self):
+        self.protocol = CommandResponseInstrumentProtocol(self.Prompt, '\r\n',
+                                                          lambda *args: None)
+
+    def later(self, delay, data):
+        """
+        Hand data to got_data from another thread after a delay.
+        """
+        timer = threading.Timer(delay, self.protocol.got_data, [data])
+        timer.start()
+        return timer
+
+    def test_get_response(self):
+        self.later(.05, "response\r\nS>")
+        start = time.time()
+        (prompt, result) = self.protocol._get_response(timeout=5)
+        self.assertTrue(time.time() - start < .5)
+        self.assertEquals(prompt, self.Prompt.COMMAND)
+        self.assertEquals(result, "response\r\nS>")
+
+    def test_get_response_timeout(self):
+        self.protocol.got_data("no prompt")
+        start = time.time()
+        self.assertRaises(InstrumentTimeoutException,
+                          self.protocol._get_response, timeout=.2)
+        self.assertTrue(time.time() - start >= .2)
+
+    def test_get_line_of_response(self):
+        self.protocol.got_data("one\r\ntw")
+        self.assertEquals(self.protocol._get_line_of_response(timeout=1,
+                              expected_prompt='S>'), (None, "one\r\n"))
+        self.later(.05, "o\r\n")
+        self.assertEquals(self.protocol._get_line_of_response(timeout=5,
+                              expected_prompt='S>'), (None, "two\r\n"))
+        self.later(.05, "S>")
+        self.assertEquals(self.protocol._get_line_of_response(timeout=5,
+                              expected_prompt='S>'), ('S>', None))
+
+    def test_wakeup(self):
+        self.protocol._send_wakeup = lambda: self.later(.05, "\r\n?>")
+        start = time.time()
+        self.assertEquals(self.protocol._wakeup(timeout=5, delay=1),
+                          self.Prompt.OTHER)
+        self.assertTrue(time.time() - start < .5)
+
+    def test_wakeup_backoff(self):
+        """
+        Unanswered wakeups are repeated after longer and longer waits,
+        starting from the time the device takes to answer
+        """
+        sent = []
+        def send_wakeup():
+            sent.append(time.time())
+            if len(sent) == 4:
+                self.later(.01, "S>")
+        self.protocol._send_wakeup = send_wakeup
+        self.protocol._wakeup_wait = .1
+        self.assertEquals(self.protocol._wakeup(timeout=5, delay=.8),
+                          self.Prompt.COMMAND)
+        self.assertEquals(len(sent), 4)
+        gaps = [sent[i + 1] - sent[i] for i in range(3)]
+        for (gap, wait) in zip(gaps, [.1, .2, .4]):
+            self.assertTrue(wait <= gap < wait + .09)
+
+        # without a wakeup wait, the whole delay each time
+        del sent[:]
+        self.protocol._wakeup_wait = None
+        self.assertEquals(self.protocol._wakeup(timeout=5, delay=.2),
+                          self.Prompt.COMMAND)
+        gaps = [sent[i + 1] - sent[i] for i in range(3)]
+        for gap in gaps:
+            self.assertTrue(.2 <= gap < .29)
+
+        self.protocol._send_wakeup = lambda: None
+        self.assertRaises(InstrumentTimeoutException,
+                          self.protocol._wakeup, timeout=.2, delay=.8)
+
+    def test_awake_window(self):
+        """
+        A device that just ended its output with a prompt is not woken
+        """
+        sent = []
+        self.protocol._send_wakeup = lambda: sent.append(1) or self.later(.01, "S>")
+        self.protocol._connection = self
+        self.send = lambda data: None
+
+        self.protocol.got_data("response\r\n?>")
+        self.assertEquals(self.protocol._wakeup(timeout=5), self.Prompt.COMMAND)
+        self.assertEquals(len(sent), 1)
+
+        self.protocol._awake_window = 10
+        self.protocol.got_data("response\r\n?>")
+        self.assertEquals(self.protocol._wakeup(timeout=5), self.Prompt.OTHER)
+        self.assertEquals(len(sent), 1)
+
+        # data after the prompt
+        self.protocol.got_data("sample\r\n")
+        self.assertEquals(self.protocol._wakeup(timeout=5), self.Prompt.COMMAND)
+        self.assertEquals(len(sent), 2)
+        self.assertEquals(self.protocol._wakeup(timeout=5), self.Prompt.COMMAND)
+        self.assertEquals(len(sent), 2)
+
+        # a command sent since
+        self.protocol._send_data("ds\r\n")
+        self.protocol._wakeup(timeout=5)
+        self.assertEquals(len(sent), 3)
+
+        # the window passed
+        (prompt, when) = self.protocol._last_prompt
+        self.protocol._last_prompt = (prompt, when - 11)
+        self.protocol._wakeup(timeout=5)
+        self.assertEquals(len(sent), 4)
+
+    def test_paced_send_timeout(self):
+        """
+        A paced send that does not go out in time fails
+        """
+        connection = Mock(spec=PortAgentClient)
+        connection.drain.return_value = False
+        self.protocol._connection = connection
+        self.assertRaises(InstrumentTimeoutException,
+                          self.protocol._send_data, "ds\r\n",
+                          write_delay=.01, timeout=.1)
+        connection.send_paced.assert_called_once_with("ds\r\n", .01)
+
+        connection.drain.return_value = True
+        self.protocol._send_data("ds\r\n", write_delay=.01, timeout=.1)
+
+    def test_expected_prompt(self):
+        """
+        Prompts outside the prompt enum are matched too, including in data
+        that arrived before they were asked for
+        """
+        self.protocol.got_data("Enter value: ")
+        (prompt, result) = self.protocol._get_response(timeout=1,
+                                expected_prompt="value: ")
+        self.assertEquals(prompt, "value: ")
+
+        # a replaced buffer is matched afresh
+        self.protocol._promptbuf = "S"
+        self.assertRaises(InstrumentTimeoutException,
+                          self.protocol._get_response, timeout=.1)
+        self.protocol.got_data(">")
+        (prompt, result) = self.protocol._get_response(timeout=1)
+        self.assertEquals(prompt, self.Prompt.COMMAND)
+
+    def test_buffer_limit(self):
+        """
+        Buffers past the high-water mark keep their newest half, and
+        prompts are still found across the cut
+        """
+        protocol = CommandResponseInstrumentProtocol(self.Prompt, '\r\n',
+                                                     lambda *args: None,
+                                                     buffer_limit=100)
+        for i in range(30):
+            protocol.got_data("sample %02d\r\n" % i)
+        self.assertTrue(len(protocol._linebuf) <= 100)
+        self.assertTrue(len(protocol._promptbuf) <= 100)
+        self.assertTrue(protocol._linebuf.endswith("sample 29\r\n"))
+        overflow = protocol.get_buffer_overflow()
+        self.assertEquals(overflow['linebuf'], 330 - len(protocol._linebuf))
+        self.assertEquals(overflow['promptbuf'], 330 - len(protocol._promptbuf))
+
+        # a prompt split by a cut is still found, but the response before
+        # it lost its front, so it is not returned
+        protocol = CommandResponseInstrumentProtocol(self.Prompt, '\r\n',
+                                                     lambda *args: None,
+                                                     buffer_limit=2)
+        protocol.got_data("xS")
+        protocol.got_data(">")
+        self.assertEquals(protocol._promptbuf, ">")
+        self.assertEquals(protocol._prompt_detector.endswith(self.Prompt.list()),
+                          self.Prompt.COMMAND)
+        self.assertRaises(InstrumentProtocolException,
+                          protocol._get_response, timeout=1)
+
+        # until the line buffer is cleared for the next response
+        protocol._linebuf = ''
+        protocol._promptbuf = ''
+        protocol.got_data("S>")
+        (prompt, result) = protocol._get_response(timeout=1)
+        self.assertEquals((prompt, result), (self.Prompt.COMMAND, "S>"))
+
+    class Device(object):
+        """
+        Answers what is sent to it from its own thread, in order, each
+        reply handed to got_data in two pieces.
+        """
+        def __init__(self, protocol, replies):
+            self.protocol = protocol
+            self.replies = replies
+            self.sent = []
+            self.queue = Queue.Queue()
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+        def send(self, data):
+            self.sent.append(data)
+            self.queue.put(data)
+
+        def run(self):
+            while True:
+                data = self.queue.get()
+                if data == None:
+                    return
+                time.sleep(.01)
+                reply = self.replies.get(data, '')
+                half = len(reply) // 2
+                self.protocol.got_data(reply[:half])
+                self.protocol.got_data(reply[half:])
+
+        def stop(self):
+            self.queue.put(None)
+            self.thread.join()
+
+    def start_device(self):
+        """
+        A device with a display status and calibration command, woken by
+        a newline.
+        """
+        protocol = self.protocol
+        protocol.get_current_state = lambda: 'COMMAND'
+        protocol._send_wakeup = lambda: protocol._connection.send('\r\n')
+        for cmd in ['ds', 'dc']:
+            protocol._build_handlers[cmd] = lambda cmd, *args: cmd + '\r\n'
+            protocol._response_handlers[cmd] = lambda result, prompt: result
+        protocol._connection = self.Device(protocol, {
+            '\r\n': 'S>',
+            'ds\r\n': 'ds\r\nSBE status S\r\nS>',
+            'dc\r\n': 'dc\r\ncalibration\r\nS>'})
+        self.addCleanup(protocol._connection.stop)
+        return protocol._connection
+
+    def test_cmd_resp_sequence(self):
+        """
+        Pipelined, commands are sent back to back after one wakeup, and the
+        data is split into responses at the prompts
+        """
+        device = self.start_device()
+        start = time.time()
+        results = self.protocol._do_cmd_resp_sequence(['ds', 'dc'], timeout=5,
+                                                       pipeline=True)
+        self.assertTrue(time.time() - start < .5)
+        self.assertEquals(results, ['ds\r\nSBE status S\r\nS>',
+                                    'dc\r\ncalibration\r\nS>'])
+        self.assertEquals(device.sent, ['\r\n', 'ds\r\n', 'dc\r\n'])
+
+    def test_cmd_resp_sequence_lockstep(self):
+        """
+        By default each command waits for the response to the one before
+        """
+        device = self.start_device()
+        results = self.protocol._do_cmd_resp_sequence([('ds',), 'dc', 'ds'],
+                                                       timeout=5)
+        self.assertEquals(results, ['ds\r\nSBE status S\r\nS>',
+                                    'dc\r\ncalibration\r\nS>',
+                                    'ds\r\nSBE status S\r\nS>'])
+        self.assertEquals(device.sent, ['\r\n', 'ds\r\n', 'dc\r\n', 'ds\r\n'])
+
+    def test_response_overflow(self):
+        """
+        A response longer than the buffer limit fails rather than coming
+        back without its front
+        """
+        device = self.start_device()
+        self.protocol._buffer_limit = 19
+        self.assertRaises(InstrumentProtocolException,
+                          self.protocol._do_cmd_resp, 'ds', timeout=5)
+        self.assertEquals(self.protocol._do_cmd_resp('dc', timeout=5),
+                          'dc\r\ncalibration\r\nS>')
+
+        self.assertEquals(self.protocol._do_cmd_resp_sequence(['dc', 'dc'],
+                                                               timeout=5),
+                          ['dc\r\ncalibration\r\nS>'] * 2)
+
+        # pipelined responses each fit, but arrive before the first is
+        # taken, and the cut takes the front of the first
+        self.protocol._linebuf = ''
+        self.protocol.got_data('dc\r\ncalibration\r\nS>' * 2)
+        self.assertRaises(InstrumentProtocolException,
+                          self.protocol._get_next_response, timeout=1)
+
+    def test_cmd_resp_sequence_errors(self):
+        device = self.start_device()
+        self.assertEquals(self.protocol._do_cmd_resp_sequence([]), [])
+
+        # nothing is sent if a command cannot be built
+        self.assertRaises(InstrumentProtocolException,
+                          self.protocol._do_cmd_resp_sequence, ['ds', 'xx'])
+        self.assertEquals(device.sent, [])
+
+        # a command the device does not answer
+        self.protocol._build_handlers['xx'] = lambda cmd, *args: cmd + '\r\n'
+        self.assertRaises(InstrumentTimeoutException,
+                          self.protocol._do_cmd_resp_sequence, ['ds', 'xx'],
+                          timeout=.2)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_port_agent_capture
+@file mi/core/instrument/test/test_port_agent_capture.py
+@brief Unit tests for port agent capture files and replay
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from nose.plugins.attrib import attr
+
+from mi.core.exceptions import InstrumentDataException
+from mi.core.instrument.port_agent_client import PortAgentClient
+from mi.core.instrument.port_agent_capture import CaptureWriter
+from mi.core.instrument.port_agent_capture import CaptureReader
+from mi.core.instrument.port_agent_capture import ReplayServer
+from mi.core.instrument.port_agent_capture import benchmark
+from mi.core.instrument.test.test_port_agent_client import TestPortAgentPacket
+
+from mi.core.log import get_logger ; log = get_logger()
+
+START_TIME = 3555423720
+
+@attr('UNIT', group='mi')
+class TestPortAgentCapture(unittest.TestCase):
+    """
+    Write, read and replay capture files
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.pacap')
+        self.make_header = TestPortAgentPacket('make_header').make_header
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def packet(self, data, seconds):
+        """
+        A packet received the given number of seconds after START_TIME
+        """
+        high = START_TIME + int(seconds)
+        low = int((seconds - int(seconds)) * 2**32)
+        return self.make_header(data, high, low) + data
+
+    def write_capture(self, count, interval=0.0, index_interval=4, close=True):
+        """
+        Capture count packets, interval seconds apart.
+        @retval The data of each packet.
+        """
+        writer = CaptureWriter(self.path, index_interval=index_interval)
+        data = ["sample %d\r\n" % i for i in range(count)]
+        for (i, d) in enumerate(data):
+            writer.write_raw(self.packet(d, i * interval))
+        if close:
+            writer.close()
+        return data
+
+    def test_round_trip(self):
+        data = self.write_capture(10)
+        reader = CaptureReader(self.path)
+        self.assertEquals(len(reader), 10)
+        packets = list(reader)
+        self.assertEquals([p.get_data() for p in packets], data)
+        for paPacket in packets:
+            paPacket.verify_checksum()
+            self.assertTrue(paPacket.is_valid())
+        self.assertEquals([p.get_data() for p in reader.packets(5, 7)], data[5:7])
+        reader.close()
+
+    def test_find_time(self):
+        self.write_capture(10, interval=1.0)
+        reader = CaptureReader(self.path)
+        self.assertEquals(reader.find_time(START_TIME), 0)
+        self.assertEquals(reader.find_time(START_TIME + 5.5), 6)
+        self.assertEquals(reader.find_time(START_TIME + 9), 9)
+        self.assertEquals(reader.find_time(START_TIME + 100), 10)
+        reader.close()
+
+    def test_not_closed(self):
+        """
+        A capture cut off mid packet is read up to the last whole packet
+        """
+        data = self.write_capture(10, close=False)
+        with open(self.path, 'ab') as f:
+            f.write(self.packet("partial", 0)[:20])
+        reader = CaptureReader(self.path)
+        self.assertEquals(len(reader), 10)
+        self.assertEquals([p.get_data() for p in reader.packets(7)], data[7:])
+        reader.close()
+
+    def test_not_a_capture(self):
+        with open(self.path, 'wb') as f:
+            f.write("not a capture file")
+        self.assertRaises(InstrumentDataException, CaptureReader, self.path)
+
+    def test_capture_from_client(self):
+        """
+        A client given a capture writer records what it receives
+        """
+        self.write_capture(20)
+        server = ReplayServer(self.path)
+        server.start()
+        received = []
+        capture_path = os.path.join(self.dir, 'recorded.pacap')
+        client = PortAgentClient('127.0.0.1', server.port,
+                                 capture=CaptureWriter(capture_path))
+        client.init_comms(received.append)
+        self.assertTrue(server.wait(5))
+
+        end = time.time() + 5
+        while len(received) < 20 and time.time() < end:
+            time.sleep(.01)
+        client.stop_comms()
+        client.close_capture()
+        server.stop()
+
+        reader = CaptureReader(capture_path)
+        self.assertEquals([p.get_data() for p in reader],
+                          [p.get_data() for p in received])
+        self.assertEquals(len(reader), 20)
+        reader.close()
+
+    def test_capture_across_reconnect(self):
+        """
+        The capture keeps recording when the client reconnects
+        """
+        self.write_capture(20)
+        server = ReplayServer(self.path)
+        server.start()
+        received = []
+        capture_path = os.path.join(self.dir, 'recorded.pacap')
+        client = PortAgentClient('127.0.0.1', server.port,
+                                 capture=CaptureWriter(capture_path))
+        for count in (20, 40):
+            client.init_comms(received.append)
+            end = time.time() + 5
+            while len(received) < count and time.time() < end:
+                time.sleep(.01)
+            client.stop_comms()
+        client.close_capture()
+        server.stop()
+
+        self.assertEquals(len(received), 40)
+        reader = CaptureReader(capture_path)
+        self.assertEquals([p.get_data() for p in reader],
+                          [p.get_data() for p in received])
+        reader.close()
+
+    def test_replay_timed(self):
+        data = self.write_capture(5, interval=1.0)
+        server = ReplayServer(self.path, speed=20)
+        server.start()
+        received = []
+        client = PortAgentClient('127.0.0.1', server.port)
+        client.init_comms(lambda p: received.append((time.time(), p)))
+        client.send("ts\r\n")
+        self.assertTrue(server.wait(5))
+
+        end = time.time() + 5
+        while len(received) < 5 and time.time() < end:
+            time.sleep(.01)
+        client.stop_comms()
+        server.stop()
+
+        self.assertEquals([p.get_data() for (t, p) in received], data)
+        # four one second gaps at twenty times speed
+        self.assertTrue(received[-1][0] - received[0][0] >= .15)
+
+    def test_benchmark(self):
+        data = self.write_capture(50)
+        received = []
+        result = benchmark(self.path, received.append)
+        self.assertEquals(result['packets'], 50)
+        self.assertEquals(result['bytes'], sum([len(d) for d in data]))
+        self.assertEquals([p.get_data() for p in received], data)
+
+        batches = []
+        benchmark(self.path, batches.append, batch=True)
+        self.assertEquals(len(batches), 1)
+        self.assertEquals(len(batches[0]), 50)
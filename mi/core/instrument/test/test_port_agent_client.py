@@ -13,13 +13,396 @@ __license__ = 'Apache 2.0'
 import logging
 import unittest
 import re
+import struct
+import socket
+import errno
+import threading
+import time
 from nose.plugins.attrib import attr
 from mock import Mock
 from mi.core.instrument.port_agent_client import PortAgentClient, PortAgentPacket
+from mi.core.instrument.port_agent_client import HEADER_SIZE
+from mi.core.instrument.port_agent_client import PacketReader
+from mi.core.instrument.port_agent_client import Listener
+from mi.core.instrument.port_agent_client import PacketWriter
+from mi.core.exceptions import InstrumentConnectionException
 
 # MI logger
 from mi.core.log import get_logger ; log = get_logger()
 
+@attr('UNIT', group='mi')
+class TestPortAgentPacket(unittest.TestCase):
+    """
+    Unit tests for packing and unpacking port agent packets
+    """
+    DATA = "SATPAR0229,10.01,2206748544,234\r\n"
+
+    def make_header(self, data, timestamp_high=3555423720, timestamp_low=0x80000000):
+        """ Build a data packet header like the port agent does """
+        checksum = sum(bytearray(data)) + 0xa3 + 0x9d + 0x7a + 1
+        length = len(data) + HEADER_SIZE
+        checksum += (length >> 8) + (length & 0xff)
+        for word in (timestamp_high, timestamp_low):
+            checksum += sum(bytearray(struct.pack('>L', word)))
+        return struct.pack('>BBBBHHLL', 0xa3, 0x9d, 0x7a, 1, length,
+                           checksum & 0xFFFF, timestamp_high, timestamp_low)
+
+    def test_unpack_header(self):
+        paPacket = PortAgentPacket()
+        paPacket.unpack_header(self.make_header(self.DATA))
+        paPacket.attach_data(self.DATA)
+        self.assertEquals(paPacket.get_data_size(), len(self.DATA))
+        self.assertEquals(paPacket.get_timestamp(), 3555423720.5)
+        paPacket.verify_checksum()
+        self.assertTrue(paPacket.is_valid())
+
+    def test_checksum(self):
+        paPacket = PortAgentPacket()
+        paPacket.unpack_header(self.make_header(self.DATA))
+        paPacket.attach_data(self.DATA[:-1] + "X")
+        paPacket.verify_checksum()
+        self.assertFalse(paPacket.is_valid())
+
+        paPacket = PortAgentPacket()
+        paPacket.attach_data(self.DATA)
+        paPacket.pack_header(2)
+        header = bytearray(paPacket.get_header())
+        expected = sum(header[0:6]) + sum(header[8:16]) + sum(bytearray(self.DATA))
+        self.assertEquals(paPacket.calculate_checksum(), expected)
+
+        # the header holds only the low 16 bits of a large sum
+        data = "\xff" * 1000
+        paPacket = PortAgentPacket()
+        paPacket.unpack_header(self.make_header(data))
+        paPacket.attach_data(data)
+        paPacket.verify_checksum()
+        self.assertTrue(paPacket.is_valid())
+
+    def test_pack_header(self):
+        """
+        A packed header carries the checksum and timestamp, and reads back
+        """
+        paPacket = PortAgentPacket()
+        paPacket.attach_data(self.DATA)
+        paPacket.pack_header(2, 3555423720.5)
+        self.assertEquals(paPacket.get_timestamp(), 3555423720.5)
+
+        received = PortAgentPacket()
+        received.unpack_header(str(bytearray(paPacket.get_header())))
+        received.attach_data(self.DATA)
+        received.verify_checksum()
+        self.assertTrue(received.is_valid())
+        self.assertEquals(received.get_timestamp(), 3555423720.5)
+        self.assertEquals(received.get_data_size(), len(self.DATA))
+
+    def test_no_timestamp(self):
+        paPacket = PortAgentPacket()
+        self.assertEquals(paPacket.get_timestamp(), None)
+
+@attr('UNIT', group='mi')
+class TestPacketReader(unittest.TestCase):
+    """
+    Unit tests for splitting packets out of the receive buffer
+    """
+    def setUp(self):
+        (self.client, self.server) = socket.socketpair()
+        self.reader = PacketReader(buffer_size=256)
+        self.make_header = TestPortAgentPacket('make_header').make_header
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def packet(self, data):
+        return self.make_header(data) + data
+
+    def test_many_packets_per_read(self):
+        self.server.sendall(self.packet("one") + self.packet("two") +
+                            self.packet("three")[:20])
+        self.assertEquals(self.reader.read_from(self.client), 3 * HEADER_SIZE + 10)
+        packets = self.reader.get_packets()
+        self.assertEquals([p.get_data() for p in packets], ["one", "two"])
+        for paPacket in packets:
+            paPacket.verify_checksum()
+            self.assertTrue(paPacket.is_valid())
+
+        # the rest of the partial packet
+        self.server.sendall(self.packet("three")[20:])
+        self.reader.read_from(self.client)
+        packets = self.reader.get_packets()
+        self.assertEquals([p.get_data() for p in packets], ["three"])
+        self.assertEquals(self.reader.get_packets(), [])
+
+    def test_buffer_wraps(self):
+        data = "x" * 100
+        for i in range(10):
+            self.server.sendall(self.packet(data))
+            received = []
+            while not received:
+                self.reader.read_from(self.client)
+                received = self.reader.get_packets()
+            self.assertEquals([p.get_data() for p in received], [data])
+        # leave a partial packet in the buffer so it has to be compacted
+        for i in range(5):
+            self.server.sendall(self.packet(data)[:60])
+            self.server.sendall(self.packet(data)[60:])
+        received = []
+        while len(received) < 5:
+            self.reader.read_from(self.client)
+            received.extend(self.reader.get_packets())
+        self.assertEquals([p.get_data() for p in received], [data] * 5)
+
+    def test_resync(self):
+        self.server.sendall("garbage\xa3" + self.packet("one"))
+        self.reader.read_from(self.client)
+        packets = self.reader.get_packets()
+        self.assertEquals([p.get_data() for p in packets], ["one"])
+
+    def test_closed(self):
+        self.server.close()
+        self.assertEquals(self.reader.read_from(self.client), 0)
+
+class FakeSocket(object):
+    """
+    A socket whose sends take at most the next of a list of sizes each, or
+    say they would block when the size is 0. Raises error if given.
+    """
+    def __init__(self, sizes=None, error=None):
+        self.sizes = sizes or []
+        self.error = error
+        self.sent = []
+
+    def send(self, data):
+        if self.error:
+            raise self.error
+        size = self.sizes.pop(0) if self.sizes else len(data)
+        if size == 0:
+            raise socket.error(errno.EAGAIN, 'would block')
+        self.sent.append(str(data[:size]))
+        return min(size, len(data))
+
+@attr('UNIT', group='mi')
+class TestPacketWriter(unittest.TestCase):
+    """
+    Buffer, coalesce and pace data going to the port agent
+    """
+    def test_coalesce(self):
+        writer = PacketWriter()
+        writer.write("one")
+        writer.write("two")
+        sock = FakeSocket()
+        self.assertFalse(writer.flush_to(sock))
+        self.assertEquals(sock.sent, ["onetwo"])
+        self.assertFalse(writer.pending())
+
+    def test_would_block(self):
+        writer = PacketWriter()
+        writer.write("onetwo")
+        sock = FakeSocket([4, 0])
+        self.assertTrue(writer.flush_to(sock))
+        self.assertTrue(writer.is_blocked())
+        self.assertEquals(writer.time_until_due(), None)
+
+        # writes made while blocked are sent after the remainder
+        writer.write("three")
+        sock = FakeSocket()
+        self.assertFalse(writer.flush_to(sock))
+        self.assertEquals(sock.sent, ["wothree"])
+
+    def test_paced(self):
+        writer = PacketWriter()
+        writer.write_paced("ab", .05)
+        writer.write("c")
+        sock = FakeSocket()
+        self.assertTrue(writer.flush_to(sock))
+        self.assertEquals(sock.sent, ["a"])
+        self.assertTrue(writer.time_until_due() > 0)
+
+        while writer.flush_to(sock):
+            time.sleep(writer.time_until_due())
+        self.assertEquals(sock.sent, ["a", "b", "c"])
+
+    def test_drain(self):
+        writer = PacketWriter()
+        self.assertTrue(writer.drain(0))
+        writer.write("one")
+        self.assertFalse(writer.drain(.01))
+        writer.flush_to(FakeSocket())
+        self.assertTrue(writer.drain(0))
+
+        # thrown away, not sent
+        writer.write("two")
+        writer.clear()
+        self.assertFalse(writer.drain(0))
+
+    def test_error(self):
+        writer = PacketWriter()
+        writer.write("one")
+        sock = FakeSocket(error=socket.error(errno.EPIPE, 'broken pipe'))
+        self.assertRaises(socket.error, writer.flush_to, sock)
+
+@attr('UNIT', group='mi')
+class TestListener(unittest.TestCase):
+    """
+    Run the listener thread against a local socket
+    """
+    def test_listener(self):
+        (client, server) = socket.socketpair()
+        client.setblocking(0)
+        received = []
+        listener = Listener(client, None, received.append)
+        listener.start()
+
+        make_header = TestPortAgentPacket('make_header').make_header
+        for data in ["one", "two", "three"]:
+            server.sendall(make_header(data) + data)
+
+        timeout = time.time() + 5
+        while len(received) < 3 and time.time() < timeout:
+            time.sleep(.01)
+        listener.done()
+        listener.join()
+        listener.close()
+        client.close()
+        server.close()
+
+        self.assertEquals([p.get_data() for p in received],
+                          ["one", "two", "three"])
+
+    def test_listener_batch(self):
+        (client, server) = socket.socketpair()
+        client.setblocking(0)
+        batches = []
+        listener = Listener(client, None, batch_callback=batches.append)
+
+        # all three arrive before the listener's first read
+        make_header = TestPortAgentPacket('make_header').make_header
+        server.sendall("".join([make_header(data) + data
+                                for data in ["one", "two", "three"]]))
+        listener.start()
+
+        timeout = time.time() + 5
+        while not batches and time.time() < timeout:
+            time.sleep(.01)
+        listener.done()
+        listener.join()
+        listener.close()
+        client.close()
+        server.close()
+
+        self.assertEquals([[p.get_data() for p in batch] for batch in batches],
+                          [["one", "two", "three"]])
+
+    def test_listener_send(self):
+        """
+        The listener sends what the writer could not, pacing included
+        """
+        (client, server) = socket.socketpair()
+        client.setblocking(0)
+        writer = PacketWriter()
+        listener = Listener(client, None, writer=writer)
+        listener.start()
+
+        writer.write_paced("ab", .05)
+        writer.write("cd")
+        start = time.time()
+        listener.wakeup()
+        self.assertTrue(writer.drain(5))
+        elapsed = time.time() - start
+        listener.done()
+        listener.join()
+        listener.close()
+
+        self.assertEquals(server.recv(10), "abcd")
+        self.assertTrue(elapsed >= .1)
+        client.close()
+        server.close()
+
+@attr('UNIT', group='mi')
+class TestPortAgentClientSend(unittest.TestCase):
+    """
+    Sends wait for the write unless asked not to
+    """
+    def setUp(self):
+        (self.client_sock, self.server) = socket.socketpair()
+        self.client_sock.setblocking(0)
+        self.client = PortAgentClient('localhost', 0)
+        self.client.sock = self.client_sock
+        self.client.writer = PacketWriter()
+        self.client.listener_thread = Listener(self.client_sock, None,
+                                               writer=self.client.writer)
+        self.client.listener_thread.start()
+
+    def tearDown(self):
+        listener = self.client.listener_thread
+        listener.done()
+        listener.join()
+        listener.close()
+        self.client_sock.close()
+        self.server.close()
+
+    def read_all(self, size, received):
+        while len(received[0]) < size:
+            data = self.server.recv(65536)
+            if not data:
+                break
+            received[0] += data
+
+    def test_blocking_send(self):
+        data = "x" * 4000000
+        received = [""]
+        reader = threading.Thread(target=self.read_all, args=(len(data), received))
+        reader.start()
+        self.client.send(data)
+        self.assertFalse(self.client.writer.pending())
+        reader.join()
+        self.assertEquals(len(received[0]), len(data))
+
+    def test_nonblocking_send(self):
+        data = "x" * 4000000
+        self.client.send(data, block=False)
+        self.assertTrue(self.client.writer.pending())
+        received = [""]
+        self.read_all(len(data), received)
+        self.assertTrue(self.client.drain(5))
+
+    def test_send_timeout(self):
+        self.assertRaises(InstrumentConnectionException, self.client.send,
+                          "x" * 4000000, timeout=.1)
+
+    def test_send_from_listener(self):
+        """
+        A send from the listener's callback does not wait for the listener
+        """
+        data = "x" * 4000000
+        pending = []
+        def callback(paPacket):
+            self.client.send(data)
+            pending.append(self.client.writer.pending())
+
+        listener = self.client.listener_thread
+        listener.done()
+        listener.join()
+        listener.close()
+        self.client.listener_thread = Listener(self.client_sock, None, callback,
+                                               writer=self.client.writer)
+        self.client.listener_thread.start()
+
+        packet = TestPortAgentPacket('make_header').make_header("hello") + "hello"
+        self.server.sendall(packet)
+        end = time.time() + 5
+        while not pending and time.time() < end:
+            time.sleep(.01)
+        self.assertEquals(pending, [True])
+        received = [""]
+        self.read_all(len(data), received)
+        self.assertTrue(self.client.drain(5))
+
+    def test_send_error(self):
+        self.server.close()
+        self.assertRaises(InstrumentConnectionException, self.client.send,
+                          "data")
+
 #@unittest.skip('NOTE!!!! TestPortAgent SKIPPED!')
 @attr('UNIT', group='mi')
 #class TestPortAgent(unittest.TestCase):
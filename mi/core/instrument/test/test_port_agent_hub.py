@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_port_agent_hub
+@file mi/core/instrument/test/test_port_agent_hub.py
+@brief Unit tests for the multiplexed port agent hub
+"""
+
+__license__ = 'Apache 2.0'
+
+import socket
+import time
+import unittest
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.port_agent_hub import PortAgentHub, HubPortAgentClient
+from mi.core.instrument.test.test_port_agent_client import TestPortAgentPacket
+
+from mi.core.log import get_logger ; log = get_logger()
+
+@attr('UNIT', group='mi')
+class TestPortAgentHub(unittest.TestCase):
+    """
+    Serve several local port agent stand ins from one hub
+    """
+    def setUp(self):
+        self.hub = PortAgentHub()
+        self.hub.start()
+        self.make_header = TestPortAgentPacket('make_header').make_header
+        self.servers = []
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            if client.sock:
+                client.stop_comms()
+        for (listen_sock, conn) in self.servers:
+            conn.close()
+            listen_sock.close()
+        self.hub.stop()
+
+    def connect(self, received, batch=False):
+        """
+        Open a listening socket, connect a hub client to it and accept.
+        @retval (client, server side socket)
+        """
+        listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_sock.bind(('127.0.0.1', 0))
+        listen_sock.listen(1)
+        port = listen_sock.getsockname()[1]
+
+        client = HubPortAgentClient('127.0.0.1', port, hub=self.hub,
+                                    batch=batch)
+        client.init_comms(received.append)
+        (conn, addr) = listen_sock.accept()
+        self.servers.append((listen_sock, conn))
+        self.clients.append(client)
+        return (client, conn)
+
+    def wait_for(self, condition, timeout=5):
+        end = time.time() + timeout
+        while not condition() and time.time() < end:
+            time.sleep(.01)
+
+    def test_many_connections(self):
+        received = [[] for i in range(5)]
+        connections = [self.connect(r) for r in received]
+
+        for (index, (client, conn)) in enumerate(connections):
+            for data in ["one%d" % index, "two%d" % index]:
+                conn.sendall(self.make_header(data) + data)
+
+        self.wait_for(lambda: all([len(r) == 2 for r in received]))
+        for (index, packets) in enumerate(received):
+            self.assertEquals([p.get_data() for p in packets],
+                              ["one%d" % index, "two%d" % index])
+            for paPacket in packets:
+                self.assertTrue(paPacket.is_valid())
+
+    def test_batch(self):
+        batches = []
+        (client, conn) = self.connect(batches, batch=True)
+        conn.sendall("".join([self.make_header(data) + data
+                              for data in ["one", "two", "three"]]))
+
+        self.wait_for(lambda: sum([len(b) for b in batches]) == 3)
+        self.assertEquals([p.get_data() for batch in batches for p in batch],
+                          ["one", "two", "three"])
+        for batch in batches:
+            self.assertTrue(batch)
+            for paPacket in batch:
+                self.assertTrue(paPacket.is_valid())
+
+    def test_send(self):
+        (client, conn) = self.connect([])
+        client.send("hello")
+        self.assertEquals(conn.recv(5), "hello")
+
+    def test_send_large(self):
+        """
+        More than the socket takes at once is sent as it drains
+        """
+        (client, conn) = self.connect([])
+        data = "x" * (4 * 1024 * 1024)
+        client.send(data, block=False)
+        self.assertTrue(client.writer.pending())
+
+        received = 0
+        while received < len(data):
+            received += len(conn.recv(65536))
+        self.assertEquals(received, len(data))
+        self.assertTrue(client.drain(5))
+
+    def test_send_from_hub(self):
+        """
+        A send from a callback on the hub thread does not wait for the hub
+        """
+        (client, conn) = self.connect([])
+        data = "x" * (4 * 1024 * 1024)
+        pending = []
+        def callback(paPacket):
+            client.send(data)
+            pending.append(client.writer.pending())
+        client.user_callback = callback
+        conn.sendall(self.make_header("hello") + "hello")
+        self.wait_for(lambda: pending)
+        self.assertEquals(pending, [True])
+
+        received = 0
+        while received < len(data):
+            received += len(conn.recv(65536))
+        self.assertTrue(client.drain(5))
+
+    def test_send_paced(self):
+        (client, conn) = self.connect([])
+        start = time.time()
+        client.send_paced("ab", .05)
+        client.send("cd")
+        self.assertTrue(client.drain(5))
+        self.assertTrue(time.time() - start >= .1)
+
+        received = ""
+        while len(received) < 4:
+            received += conn.recv(4)
+        self.assertEquals(received, "abcd")
+
+    def test_stop_comms(self):
+        received = []
+        (client, conn) = self.connect(received)
+        client.stop_comms()
+        conn.sendall(self.make_header("one") + "one")
+        time.sleep(.1)
+        self.assertEquals(received, [])
+
+    def test_bad_callback(self):
+        """
+        A failing callback does not stop the other connections
+        """
+        def explode(paPacket):
+            raise Exception("boom")
+        (bad_client, bad_conn) = self.connect([])
+        bad_client.user_callback = explode
+        received = []
+        (client, conn) = self.connect(received)
+
+        bad_conn.sendall(self.make_header("one") + "one")
+        conn.sendall(self.make_header("two") + "two")
+        self.wait_for(lambda: len(received) == 1)
+        self.assertEquals([p.get_data() for p in received], ["two"])
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_port_agent_simulator
+@file mi/core/instrument/test/test_port_agent_simulator.py
+@brief Unit tests for the port agent simulator and its sample generators
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+import unittest
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.port_agent_client import PortAgentClient
+from mi.core.instrument.port_agent_client import PortAgentPacket
+from mi.core.instrument.port_agent_client import HEADER_SIZE
+from mi.core.instrument.port_agent_simulator import make_packet
+from mi.core.instrument.port_agent_simulator import LoadProfile
+from mi.core.instrument.port_agent_simulator import PortAgentSimulator
+from mi.core.instrument.port_agent_simulator import TemplateGenerator
+from mi.core.instrument.port_agent_simulator import SBE37Generator
+from mi.core.instrument.port_agent_simulator import SBE16Generator
+from mi.core.instrument.port_agent_simulator import SBE26PlusGenerator
+from mi.core.instrument.port_agent_simulator import PARGenerator
+from mi.core.instrument.port_agent_simulator import PD0Generator
+
+from mi.instrument.seabird.sbe37smb.ooicore.driver import SAMPLE_REGEX as SBE37_SAMPLE_REGEX
+from mi.instrument.seabird.sbe16plus_v2.ooicore.driver import SAMPLE_REGEX as SBE16_SAMPLE_REGEX
+from mi.instrument.satlantic.par_ser_600m.driver import SatlanticChecksumDecorator
+from mi.instrument.teledyne.workhorse_adcp_5_beam_600khz.ooicore.pd0 import PD0DataStructure
+
+from mi.core.log import get_logger ; log = get_logger()
+
+NOW = 1349398554.0
+
+@attr('UNIT', group='mi')
+class TestSampleGenerators(unittest.TestCase):
+    """
+    Generated samples parse as the drivers expect
+    """
+    def test_make_packet(self):
+        packet = make_packet("data", 3555423720.5)
+        paPacket = PortAgentPacket()
+        paPacket.unpack_header(packet[:HEADER_SIZE])
+        paPacket.attach_data(packet[HEADER_SIZE:])
+        paPacket.verify_checksum()
+        self.assertTrue(paPacket.is_valid())
+        self.assertEquals(paPacket.get_data(), "data")
+        self.assertEquals(paPacket.get_timestamp(), 3555423720.5)
+
+    def test_sbe37(self):
+        generator = SBE37Generator()
+        for i in range(10):
+            self.assertTrue(SBE37_SAMPLE_REGEX.match(generator.sample(i, NOW)))
+
+    def test_sbe16(self):
+        generator = SBE16Generator()
+        for i in range(10):
+            self.assertTrue(SBE16_SAMPLE_REGEX.match(generator.sample(i, NOW)))
+
+    def test_sbe26plus(self):
+        generator = SBE26PlusGenerator()
+        lines = generator.sample(0, NOW).splitlines()
+        self.assertEquals(len(lines), 1)
+        self.assertTrue(lines[0].startswith('tide: start time = 05 Oct 2012'))
+        lines = generator.sample(SBE26PlusGenerator.WAVE_EVERY - 1, NOW).splitlines()
+        self.assertEquals(len(lines), 3 + SBE26PlusGenerator.WAVE_SAMPLES)
+        self.assertTrue(lines[2].startswith('wave: ptfreq = '))
+
+    def test_par(self):
+        generator = PARGenerator()
+        decorator = SatlanticChecksumDecorator()
+        for i in range(10):
+            self.assertTrue(decorator._checksum_ok(generator.sample(i, NOW)))
+
+    def test_pd0(self):
+        generator = PD0Generator(cells=20)
+        pd0 = PD0DataStructure(generator.sample(70000, NOW))
+        self.assertEquals(pd0.getNumberOfBeams(), 4)
+        self.assertEquals(pd0.getNumberOfCells(), 20)
+        self.assertEquals(pd0.getEnsembleNumber(), 70000)
+        self.assertEquals(pd0.getTime().year, 2012)
+
+    def test_template(self):
+        generator = TemplateGenerator(["one %(number)d\r\n", "two\r\n"])
+        self.assertEquals([generator.sample(i, NOW) for i in range(3)],
+                          ["one 0\r\n", "two\r\n", "one 2\r\n"])
+
+    def test_repeatable(self):
+        self.assertEquals(SBE37Generator(seed=5).sample(3, NOW),
+                          SBE37Generator(seed=5).sample(3, NOW))
+
+@attr('UNIT', group='mi')
+class TestPortAgentSimulator(unittest.TestCase):
+    """
+    Serve generated samples to a PortAgentClient
+    """
+    def setUp(self):
+        self.received = []
+        self.simulator = None
+        self.client = None
+
+    def tearDown(self):
+        if self.client:
+            self.client.stop_comms()
+        if self.simulator:
+            self.simulator.stop()
+
+    def start(self, generator, profile):
+        self.simulator = PortAgentSimulator(generator, profile)
+        self.simulator.start()
+        self.client = PortAgentClient('127.0.0.1', self.simulator.port)
+        self.client.init_comms(self.received.append)
+
+    def wait_for(self, condition, timeout=5):
+        end = time.time() + timeout
+        while not condition() and time.time() < end:
+            time.sleep(.01)
+
+    def test_fragments(self):
+        generator = TemplateGenerator(["0123456789\r\n"])
+        self.start(generator, LoadProfile(rate=1000, burst=2, count=4,
+                                          fragments=[5, 1]))
+        self.assertTrue(self.simulator.wait(5))
+        self.wait_for(lambda: "".join([p.get_data() for p in self.received])
+                      == "0123456789\r\n" * 4)
+
+        self.assertEquals([p.get_data() for p in self.received[0:3]],
+                          ["01234", "5", "6789\r"])
+        self.assertEquals(self.simulator.samples_sent, 4)
+        for paPacket in self.received:
+            self.assertTrue(paPacket.is_valid())
+
+    def test_rate(self):
+        generator = PARGenerator()
+        self.start(generator, LoadProfile(speedup=10, count=7))
+        start = time.time()
+        self.assertTrue(self.simulator.wait(5))
+        # 6 samples a second sped up ten times
+        self.assertTrue(time.time() - start >= .09)
+        self.wait_for(lambda: len(self.received) == 7)
+        self.assertEquals(len(self.received), 7)
+
+    def test_respond(self):
+        generator = SBE37Generator()
+        self.start(generator, LoadProfile(rate=.001, count=2))
+        self.wait_for(lambda: len(self.received) == 1)
+        self.client.send("ds\r\n")
+        self.wait_for(lambda: len(self.received) == 2)
+        self.assertEquals(self.received[1].get_data(), 'S>')
+
+    def test_reconnect(self):
+        """
+        A client that connects after another has gone, or after the
+        simulator is restarted, is served too
+        """
+        generator = TemplateGenerator(["0123456789\r\n"])
+        self.start(generator, LoadProfile(rate=100))
+        self.wait_for(lambda: len(self.received) > 0)
+        self.client.stop_comms()
+
+        for restart in (False, True):
+            if restart:
+                self.client.stop_comms()
+                self.simulator.stop()
+                self.simulator.start()
+            del self.received[:]
+            self.client = PortAgentClient('127.0.0.1', self.simulator.port)
+            self.client.init_comms(self.received.append)
+            self.wait_for(lambda: len(self.received) > 0)
+            self.assertTrue(self.received)
+            self.assertEquals(self.received[0].get_data(), "0123456789\r\n")
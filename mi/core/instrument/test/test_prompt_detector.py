@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_prompt_detector
+@file mi/core/instrument/test/test_prompt_detector.py
+@brief Unit tests for the streaming prompt detector
+"""
+
+__license__ = 'Apache 2.0'
+
+import random
+import unittest
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.prompt_detector import PromptDetector
+
+from mi.core.log import get_logger ; log = get_logger()
+
+@attr('UNIT', group='mi')
+class TestPromptDetector(unittest.TestCase):
+    """
+    The detector agrees with endswith and in on the whole buffer
+    """
+    def check(self, detector, prompts, buffer):
+        self.assertEqual(detector.suffixes(),
+                         frozenset([p for p in prompts if buffer.endswith(p)]))
+        self.assertEqual(detector.seen(),
+                         set([p for p in prompts if p in buffer]))
+        self.assertEqual(detector.endswith(prompts),
+                         ([p for p in prompts if buffer.endswith(p)] or [None])[0])
+        self.assertEqual(detector.contains(prompts),
+                         ([p for p in prompts if p in buffer] or [None])[0])
+
+    def test_prompts(self):
+        prompts = ['S>', '?>', '\r\n>', 'Command?', 'and?', 'd?']
+        detector = PromptDetector(prompts)
+        buffer = ''
+        for data in ['sample 1\r\n', 'S', '>', '\r\n', '>', 'Comm', 'and?']:
+            buffer += data
+            detector.feed(data)
+            self.check(detector, prompts, buffer)
+        self.assertEqual(detector.suffixes(), frozenset(['Command?', 'and?', 'd?']))
+        detector.reset()
+        self.check(detector, prompts, '')
+
+    def test_random(self):
+        random.seed(3)
+        for i in range(50):
+            prompts = list(set(["".join([random.choice("ab>\r")
+                                        for j in range(random.randint(1, 4))])
+                               for k in range(random.randint(1, 5))]))
+            detector = PromptDetector(prompts)
+            buffer = ''
+            for j in range(30):
+                data = "".join([random.choice("ab>\rx")
+                                for k in range(random.randint(0, 5))])
+                buffer += data
+                detector.feed(data)
+                self.check(detector, prompts, buffer)
+
+    def test_empty(self):
+        detector = PromptDetector([])
+        detector.feed("anything")
+        self.assertEqual(detector.endswith(['S>']), None)
+        detector = PromptDetector(['', 'S>'])
+        self.check(detector, ['', 'S>'], '')
+        detector.feed("xS>")
+        self.check(detector, ['', 'S>'], 'xS>')
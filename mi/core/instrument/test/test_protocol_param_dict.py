@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_protocol_param_dict
+@file mi/core/instrument/test/test_protocol_param_dict.py
+@brief Unit tests for matching lines to protocol parameters
+"""
+
+__license__ = 'Apache 2.0'
+
+import re
+import unittest
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.protocol_param_dict import ProtocolParameterDict
+from mi.core.instrument.protocol_param_dict import _literal_prefix
+from mi.core.instrument.protocol_param_dict import _has_top_level_alternation
+from mi.core.instrument.protocol_param_dict import _fixed_span
+from mi.instrument.seabird.sbe37smb.ooicore.driver import SBE37Protocol
+from mi.instrument.seabird.sbe37smb.ooicore.driver import SBE37Prompt
+from mi.instrument.seabird.sbe37smb.ooicore.driver import SBE37_NEWLINE
+from mi.instrument.seabird.sbe37smb.ooicore.driver import SBE37Parameter
+from mi.instrument.nortek.aquadopp.ooicore.driver import BinaryProtocolParameterDict
+
+from mi.core.log import get_logger ; log = get_logger()
+
+SBE37_DS_DC = """SBE37-SMP V 2.6 SERIAL NO. 2165   05 Oct 2012  15:22:14
+not logging: received stop command
+sample interval = 20 seconds
+samplenumber = 3400, free = 233659
+do not transmit real-time data
+do not output salinity with each sample
+output sound velocity with each sample
+store time with each sample
+number of samples to average = 4
+reference pressure = 0.0 db
+serial sync mode disabled
+wait time after serial sync sampling = 0 seconds
+internal pump is installed
+temperature = 7.54 deg C
+WARNING: LOW BATTERY VOLTAGE!!
+SBE37-SM V 2.6b  3464
+temperature:  08-nov-05
+    TA0 = -2.572242e-04
+    TA1 = 3.138936e-04
+    TA2 = -9.717158e-06
+    TA3 = 2.138735e-07
+conductivity:  08-nov-05
+    G = -9.870930e-01
+    H = 1.417895e-01
+    I = 1.334915e-04
+    J = 3.339261e-05
+    CPCOR = 9.570000e-08
+    CTCOR = 3.250000e-06
+    WBOTC = 1.202400e-05
+pressure S/N 4955, range = 10847.1964958 psia:  12-aug-08
+    PA0 = 5.916199e+00
+    PA1 = 4.851819e-01
+    PA2 = 4.596432e-07
+    PTCA0 = 2.762492e+02
+    PTCA1 = 6.603433e-01
+    PTCA2 = 5.756490e-03
+    PTCSB0 = 2.461450e+01
+    PTCSB1 = -9.000000e-04
+    PTCSB2 = 0.000000e+00
+    POFFSET = 0.000000e+00
+rtc:  08-nov-05
+    RTCA0 = 9.999862e-01
+    RTCA1 = 1.686132e-06
+    RTCA2 = -3.022745e-08
+
+S>"""
+
+@attr('UNIT', group='mi')
+class TestProtocolParameterDict(unittest.TestCase):
+    """
+    Lines match the same parameters through the match index as they do
+    trying every regex in turn
+    """
+    def first_match(self, param_dict, line):
+        """
+        The first parameter in dict order whose regex matches the line
+        """
+        for (name, val) in param_dict._param_dict.iteritems():
+            if val.regex.match(line):
+                return name
+        return False
+
+    def test_literal_prefix(self):
+        for (pattern, prefix) in [
+                (r'sample interval = (\d+) seconds', 'sample interval = '),
+                (r' +TA0 = (-?\d.\d+)', 'TA0 = '),
+                (r'\s*rtc: +(\d+)', 'rtc:'),
+                (r'(do not )?output salinity', ''),
+                (r'serial sync mode (enabled|disabled)', 'serial sync mode '),
+                (r'abc|xyz', ''),
+                (r'[|]abc', ''),
+                (r'ab*c', 'a'),
+                (r'ab{2}', 'a'),
+                (r'a\.b\d', 'a.b'),
+                (r'^S>', 'S>'),
+                (r'(?i)abc', ''),
+                (r' {2}abc', '')]:
+            self.assertEqual(_literal_prefix(re.compile(pattern)), prefix)
+
+    def test_top_level_alternation(self):
+        self.assertTrue(_has_top_level_alternation(r'a|b'))
+        self.assertTrue(_has_top_level_alternation(r'(a)|b'))
+        self.assertFalse(_has_top_level_alternation(r'(a|b)'))
+        self.assertFalse(_has_top_level_alternation(r'[|]'))
+        self.assertFalse(_has_top_level_alternation(r'[]|]'))
+        self.assertFalse(_has_top_level_alternation(r'a\|b'))
+
+    def test_sbe37(self):
+        protocol = SBE37Protocol(SBE37Prompt, SBE37_NEWLINE,
+                                 lambda *args, **kwargs: None)
+        param_dict = protocol._param_dict
+        expected = [self.first_match(param_dict, line)
+                    for line in SBE37_DS_DC.splitlines()]
+        self.assertTrue(len([name for name in expected if name]) > 30)
+        self.assertEqual([param_dict.update(line)
+                          for line in SBE37_DS_DC.splitlines()], expected)
+
+    def test_changes(self):
+        param_dict = ProtocolParameterDict()
+        param_dict.add('first', r'value = (\d+)', lambda m: int(m.group(1)), str)
+        self.assertEqual(param_dict.update('value = 5'), 'first')
+        self.assertEqual(param_dict.get('first'), 5)
+
+        # added after the index was built
+        param_dict.add('any', r'.*= (\d+)', lambda m: int(m.group(1)), str)
+        self.assertEqual(param_dict.update('other = 6'), 'any')
+        param_dict._param_dict['direct'] = param_dict._param_dict.pop('first')
+        self.assertEqual(param_dict.update('value = 7'),
+                         self.first_match(param_dict, 'value = 7'))
+
+    def test_multi_match(self):
+        param_dict = ProtocolParameterDict()
+        param_dict.add('a', r'  a=(\d+)', lambda m: m.group(1), str, multi_match=True)
+        param_dict.add('b', r'.*b=(\d+)', lambda m: m.group(1), str, multi_match=True)
+        param_dict.add('c', r'c=(\d+)', lambda m: m.group(1), str)
+        self.assertEqual(param_dict.multi_match_update('  a=1 b=2'), 2)
+        self.assertEqual(param_dict.get('a'), '1')
+        self.assertEqual(param_dict.get('b'), '2')
+        self.assertEqual(param_dict.multi_match_update('c=3'), 1)
+        self.assertEqual(param_dict.multi_match_update('d=4'), 0)
+
+    def test_update_block(self):
+        """
+        A whole response sets the same values as its lines one at a time
+        """
+        protocol = SBE37Protocol(SBE37Prompt, SBE37_NEWLINE,
+                                 lambda *args, **kwargs: None)
+        by_line = protocol._param_dict
+        for line in SBE37_DS_DC.splitlines():
+            by_line.update(line)
+
+        param_dict = SBE37Protocol(SBE37Prompt, SBE37_NEWLINE,
+                                   lambda *args, **kwargs: None)._param_dict
+        changed = param_dict.update_block(SBE37_DS_DC.replace('\n', SBE37_NEWLINE),
+                                          SBE37_NEWLINE)
+        self.assertEqual(param_dict.get_config(), by_line.get_config())
+        self.assertEqual(changed, set([name for (name, value)
+                                       in by_line.get_config().iteritems()
+                                       if value != None]))
+
+        self.assertEqual(param_dict.update_block(SBE37_DS_DC), set())
+        changed = param_dict.update_block("sample interval = 30 seconds\r\n" +
+                                          "    TA0 = -2.572242e-04")
+        self.assertEqual(changed, set([SBE37Parameter.INTERVAL]))
+
+    def test_update_block_spans(self):
+        """
+        DOTALL parameters are matched against the whole block, fixed
+        spans at their offset
+        """
+        param_dict = BinaryProtocolParameterDict()
+        param_dict.add('first', r'^.{0}(.{2}).*', lambda m: m.group(1), str)
+        param_dict.add('serial', r'^.{4}(.{6}).*', lambda m: m.group(1), str)
+        param_dict.add('tail', r'^.*(.{3})$', lambda m: m.group(1), str)
+        self.assertEqual(_fixed_span(param_dict._param_dict['serial'].regex)[0], 4)
+        self.assertEqual(_fixed_span(param_dict._param_dict['tail'].regex), None)
+
+        block = "\x01\n\x00\x7fAB\nCD\rEFxyz"
+        reference = BinaryProtocolParameterDict()
+        for (name, val) in param_dict._param_dict.iteritems():
+            reference._param_dict[name] = val.__class__(name, val.pattern,
+                                                        val.f_getval, val.f_format)
+        self.assertTrue(reference.update(block))
+
+        self.assertEqual(param_dict.update_block(block),
+                         set(['first', 'serial', 'tail']))
+        self.assertEqual(param_dict.get_config(), reference.get_config())
+        self.assertEqual(param_dict.get('serial'), 'AB\nCD\r')
+        self.assertEqual(param_dict.update_block(block[:6] + "ab" + block[8:]),
+                         set(['serial']))
+
+    def test_update_block_require_all(self):
+        """
+        With require_all a block missing a parameter changes nothing, as
+        BinaryProtocolParameterDict.update leaves the Aquadopp config
+        """
+        param_dict = BinaryProtocolParameterDict()
+        param_dict.add('first', r'^.{0}(.{2}).*', lambda m: m.group(1), str)
+        param_dict.add('tail', r'^.*(xyz)$', lambda m: m.group(1), str)
+        self.assertEqual(param_dict.update_block("abxyz", require_all=True),
+                         set(['first', 'tail']))
+        self.assertEqual(param_dict.update_block("cdxy", require_all=True),
+                         set())
+        self.assertEqual(param_dict.get('first'), 'ab')
+        self.assertEqual(param_dict.update_block("cdxy"), set(['first']))
+
+    def test_update_block_multi_match(self):
+        """
+        A line sets only the first parameter it matches, as update does,
+        unless that parameter is multi_match, as multi_match_update does
+        """
+        param_dict = ProtocolParameterDict()
+        param_dict.add('a', r'  a=(\d+)', lambda m: m.group(1), str, multi_match=True)
+        param_dict.add('b', r'.*b=(\d+)', lambda m: m.group(1), str, multi_match=True)
+        param_dict.add('c', r'c=(\d+)', lambda m: m.group(1), str)
+        param_dict.add('any', r'c.*=(\d+)', lambda m: m.group(1), str)
+        self.assertEqual(param_dict.update_block("  a=1 b=2"), set(['a', 'b']))
+
+        # c and any both match, only the first is set
+        first = self.first_match(param_dict, 'c=3')
+        self.assertEqual(param_dict.update('c=3'), first)
+        self.assertEqual(param_dict.update_block("c=4"), set([first]))
+        self.assertEqual(param_dict.get(first), '4')
+        other = (set(['c', 'any']) - set([first])).pop()
+        self.assertEqual(param_dict.get(other), None)
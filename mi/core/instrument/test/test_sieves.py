@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_sieves
+@file mi/core/instrument/test/test_sieves.py
+@brief Test cases for the prebuilt chunker sieves
+"""
+
+__license__ = 'Apache 2.0'
+
+import struct
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import IonUnitTestCase
+
+from mi.core.exceptions import InstrumentParameterException
+from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.sieves import RegexSieve
+from mi.core.instrument.sieves import MultiRegexSieve
+from mi.core.instrument.sieves import DelimiterSieve
+from mi.core.instrument.sieves import SyncLengthSieve
+from mi.core.instrument.sieves import pd0_sieve, nortek_sieve
+from mi.core.instrument.sieves import pd0_checksum_valid, nortek_checksum_valid
+
+PAR_PATTERN = r'SATPAR(?P<sernum>\d{4}),(?P<timer>\d{1,7}.\d\d),(?P<counts>\d{10}),(?P<checksum>\d{1,3})'
+PAR_SAMPLE = "SATPAR0229,10.01,2206748111,111"
+SBE_SAMPLE = "#55.9044,53.221,  -1.0,   0.0,  25.6"
+SBE_PATTERN = r'#\s*-?\d+\.\d+,\s*-?\d+\.\d+,\s*-?\d+\.\d+,\s*-?\d+\.\d+,\s*-?\d+\.\d+'
+
+def make_pd0(payload):
+    """ Build a PD0 ensemble around a payload """
+    body = '\x7f\x7f' + struct.pack('<H', len(payload) + 4) + payload
+    checksum = sum(bytearray(body)) & 0xFFFF
+    return body + struct.pack('<H', checksum)
+
+def make_nortek(record_id, payload):
+    """ Build a Nortek record around a payload of an even length """
+    body = '\xa5' + record_id + struct.pack('<H', (len(payload) + 6) / 2) + payload
+    words = struct.unpack('<%dH' % (len(body) / 2), body)
+    checksum = (0xb58c + sum(words)) & 0xFFFF
+    return body + struct.pack('<H', checksum)
+
+@attr('UNIT', group='mi')
+class UnitTestRegexSieves(IonUnitTestCase):
+    """
+    Test the regex based sieves
+    """
+    def test_regex_sieve(self):
+        sieve = RegexSieve(PAR_PATTERN)
+        data = "Foo%s\r\n%sBar" % (PAR_SAMPLE, PAR_SAMPLE)
+        self.assertEquals(sieve(data), [(3, 34), (36, 67)])
+        self.assertEquals(sieve.scan(data), ([(3, 34), (36, 67)], 67))
+        self.assertEquals(sieve("Foo"), [])
+
+    def test_regex_sieve_validation(self):
+        sieve = RegexSieve(PAR_PATTERN,
+                           validate_fn=lambda block: block.endswith("111"))
+        data = "%s%s" % (PAR_SAMPLE.replace("111", "222"), PAR_SAMPLE)
+        self.assertEquals(sieve(data), [(31, 62)])
+
+    def test_multi_regex_sieve(self):
+        sieve = MultiRegexSieve([('par', PAR_PATTERN),
+                                 ('sbe', SBE_PATTERN)])
+        data = "%s\r\n%s\r\n" % (PAR_SAMPLE, SBE_SAMPLE)
+        result = sieve(data)
+        self.assertEquals(result, [(0, 31), (33, 33 + len(SBE_SAMPLE))])
+        self.assertEquals(sieve.identify(data[0:31]), 'par')
+        self.assertEquals(sieve.identify(data[result[1][0]:result[1][1]]),
+                          'sbe')
+        self.assertEquals(sieve.identify("Foo"), None)
+
+    def test_multi_regex_bad_names(self):
+        self.assertRaises(InstrumentParameterException, MultiRegexSieve,
+                          [('par', PAR_PATTERN), ('par', SBE_PATTERN)])
+
+    def test_chunker(self):
+        chunker = StringChunker(RegexSieve(PAR_PATTERN, max_record_length=31))
+        chunker.add_chunk("Foo" + PAR_SAMPLE[0:10])
+        chunker.add_chunk(PAR_SAMPLE[10:] + "Bar")
+        self.assertEquals(chunker.get_next_data(), PAR_SAMPLE)
+
+@attr('UNIT', group='mi')
+class UnitTestDelimiterSieve(IonUnitTestCase):
+    """
+    Test the delimiter framing sieve
+    """
+    def test_lines(self):
+        sieve = DelimiterSieve('\r\n')
+        self.assertEquals(sieve.scan("abc\r\n\r\nde\r\nf"),
+                          ([(0, 5), (7, 11)], 11))
+        self.assertEquals(sieve.scan("abc"), ([], 0))
+
+    def test_lines_max_length(self):
+        sieve = DelimiterSieve('\r\n', max_record_length=4)
+        self.assertEquals(sieve.scan("abc\r\nd\r\n"), ([(5, 8)], 8))
+
+    def test_framed(self):
+        sieve = DelimiterSieve('>', start_delimiter='<')
+        self.assertEquals(sieve.scan("xx<abc>yy<de>z<f"),
+                          ([(2, 7), (9, 13)], 14))
+        # start split across the end of the data
+        sieve = DelimiterSieve('>', start_delimiter='<<')
+        self.assertEquals(sieve.scan("<<a>xx<"), ([(0, 4)], 6))
+
+    def test_framed_max_length(self):
+        sieve = DelimiterSieve('>', start_delimiter='<', max_record_length=4)
+        self.assertEquals(sieve.scan("<abcdef>x<ab>"), ([(9, 13)], 13))
+        self.assertEquals(sieve.scan("<abcdef"), ([], 7))
+
+    def test_chunker(self):
+        chunker = StringChunker(DelimiterSieve('\r\n'))
+        chunker.add_chunk("abc\r")
+        self.assertEquals(chunker.get_next_data(), None)
+        chunker.add_chunk("\nde")
+        chunker.add_chunk("f\r\n")
+        self.assertEquals(chunker.get_next_data(), "abc\r\n")
+        self.assertEquals(chunker.get_next_data(), "def\r\n")
+        self.assertEquals(chunker.get_next_data(), None)
+
+@attr('UNIT', group='mi')
+class UnitTestBinarySieves(IonUnitTestCase):
+    """
+    Test the sync and length framing sieves
+    """
+    def test_checksums(self):
+        ensemble = make_pd0("\x01\x02\x03\x04")
+        self.assertTrue(pd0_checksum_valid(ensemble))
+        self.assertFalse(pd0_checksum_valid(ensemble[:-1] + '\x00'))
+
+        record = make_nortek('\x01', "\x01\x02\x03\x04")
+        self.assertTrue(nortek_checksum_valid(record))
+        self.assertFalse(nortek_checksum_valid(record[:-1] + '\x00'))
+
+    def test_sync_length(self):
+        sieve = SyncLengthSieve('\xaa', 1, '<B')
+        data = "x\xaa\x03y\xaa\x04zz\xaa\x05"
+        self.assertEquals(sieve.scan(data), ([(1, 4), (4, 8)], 8))
+        # a bad length skips that sync
+        sieve = SyncLengthSieve('\xaa', 1, '<B', max_record_length=4)
+        self.assertEquals(sieve.scan("\xaa\x09\xaa\x03y"), ([(2, 5)], 5))
+
+    def test_pd0(self):
+        sieve = pd0_sieve()
+        first = make_pd0("\x01\x02\x03\x04")
+        second = make_pd0("\x7f\x7f\x05\x06\x07")
+        # the sync in the junk has a length too short to be an ensemble
+        data = "junk" + first + "\x7f\x7f\x00\x00" + second
+        start = 4 + len(first) + 4
+        self.assertEquals(sieve.scan(data),
+                          ([(4, 4 + len(first)),
+                            (start, start + len(second))],
+                           start + len(second)))
+
+        # partial ensemble, resume from its start
+        self.assertEquals(sieve.scan("junk" + first[:5]), ([], 4))
+
+        # bad checksum, the ensemble is not data
+        self.assertEquals(sieve(first[:-1] + '\x00'), [])
+
+        # bytearrays work too
+        self.assertEquals(sieve(bytearray(data))[0], (4, 4 + len(first)))
+
+    def test_nortek(self):
+        sieve = nortek_sieve()
+        # an Aquadopp velocity record, with a sync inside it
+        record = make_nortek('\x01', "\x00\x01\x02\x03\xa5\x05" + "\x00" * 30)
+        data = "\xa5\x00\x00\x00" + record + record
+        self.assertEquals(sieve(data), [(4, 4 + len(record)),
+                                        (4 + len(record),
+                                         4 + 2 * len(record))])
+
+    def test_nortek_false_sync(self):
+        """
+        A stray sync byte with a plausible length does not hold the
+        watermark back, only a known ID with its expected length does
+        """
+        sieve = nortek_sieve()
+        record = make_nortek('\x01', "\x00" * 36)
+        for junk in ["\xa5\x01\xff\x7f",      # velocity, but far too long
+                     "\xa5\x21\xff\x7f",      # profile longer than any
+                     "\xa5\x99\x20\x00"]:     # unknown ID
+            data = junk + record
+            self.assertEquals(sieve.scan(data),
+                              ([(4, 4 + len(record))], 4 + len(record)))
+
+        # a known ID with its length waits for the rest of the record
+        self.assertEquals(sieve.scan("junk" + record[:10]), ([], 4))
+
+        # the ID may still be on its way
+        self.assertEquals(sieve.scan("junk\xa5"), ([], 4))
+
+        # a wrong length for the ID is not a record
+        self.assertEquals(sieve(make_nortek('\x01', "\x00" * 38)), [])
+
+    def test_chunker(self):
+        ensemble = make_pd0("\x01\x02\x03\x04\x05\x06")
+        chunker = StringChunker(pd0_sieve())
+        for char in "junk" + ensemble:
+            chunker.add_chunk(char)
+        self.assertEquals(chunker.get_next_data(), ensemble)
+        self.assertEquals(chunker.get_next_non_data(), None)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.ntp_clock
+@file mi/core/ntp_clock.py
+@brief A shared clock giving NTP time for particle and packet timestamps.
+The clock in use can be replaced, so tests and benchmarks can run against
+a fixed or scripted time.
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import time
+import threading
+import ntplib
+
+"""Seconds from the NTP epoch (1900) to the system epoch (1970)"""
+NTP_DELTA = ntplib.NTP.NTP_DELTA
+
+"""How far ahead of now a timestamp may be before it is unreasonable"""
+FUTURE_LIMIT = 86400 * 365
+
+"""The most a clock slows down to take up a backwards step of the system time"""
+SLEW_RATE = 0.5
+
+try:
+    from time import monotonic
+except ImportError:
+    def monotonic():
+        """
+        @retval Seconds from an arbitrary point, never stepped. Only as
+            fine as the clock tick.
+        """
+        return os.times()[4]
+
+    if sys.platform.startswith('linux'):
+        try:
+            import ctypes
+            import ctypes.util
+
+            _CLOCK_MONOTONIC = 1
+
+            # Called holding the GIL, so the shared timespec is filled and
+            # read by one thread at a time.
+            _clock_gettime = ctypes.PyDLL(ctypes.util.find_library('rt') or
+                                          'librt.so.1').clock_gettime
+            _timespec = (ctypes.c_long * 2)()
+
+            def monotonic(_clock_gettime=_clock_gettime, _timespec=_timespec):
+                """
+                @retval Seconds from an arbitrary point, never stepped.
+                """
+                if _clock_gettime(_CLOCK_MONOTONIC, _timespec):
+                    return os.times()[4]
+                (sec, nsec) = _timespec[:]
+                return sec + nsec * 1e-9
+        except (OSError, AttributeError):
+            pass
+
+class NtpClock(object):
+    """
+    NTP time that never goes backwards. The system time is read once
+    every refresh seconds and the time in between is that reading plus
+    the elapsed monotonic time. If the system time has stepped forward
+    by the next reading the clock steps with it. If it has stepped back
+    the clock keeps counting from where it was, at SLEW_RATE slower,
+    until it is back in step. The bound for unreasonably future
+    timestamps is cached for refresh seconds rather than computed on each
+    check. A clock may be read from any thread.
+    """
+    def __init__(self, source=time.time, refresh=60.0, monotonic=monotonic):
+        """
+        @param source A function giving the system time in seconds.
+        @param refresh Seconds between reading the system time and
+            recomputing the future bound.
+        @param monotonic A function giving seconds that are never stepped.
+        """
+        self._source = source
+        self._refresh = refresh
+        self._monotonic = monotonic
+        # (base time, monotonic time of the base, slew left to take up),
+        # replaced whole so readers never see half of a resync
+        self._state = None
+        self._resync_lock = threading.Lock()
+        # (bound, system time it expires)
+        self._bound = None
+
+    def ntp_time(self):
+        """
+        @retval The current NTP time
+        """
+        state = self._state
+        now = self._monotonic()
+        if state == None or now - state[1] >= self._refresh:
+            return self._resync()
+        (base_time, base_elapsed, slew) = state
+        elapsed = now - base_elapsed
+        lag = elapsed * SLEW_RATE
+        if lag > slew:
+            lag = slew
+        return base_time + elapsed - lag
+
+    def _resync(self):
+        """
+        Read the system time again, stepping forward to it, or slewing back
+        to it if it is behind, unless another thread just has.
+        @retval The current NTP time
+        """
+        with self._resync_lock:
+            state = self._state
+            now = self._monotonic()
+            if state == None:
+                self._state = state = (self._source() + NTP_DELTA, now, 0.0)
+            elif now - state[1] >= self._refresh:
+                current = self._time_at(state, now)
+                system = self._source() + NTP_DELTA
+                if system >= current:
+                    state = (system, now, 0.0)
+                else:
+                    state = (current, now, current - system)
+                self._state = state
+            return self._time_at(state, now)
+
+    def _time_at(self, state, now):
+        """
+        @param state A (base time, base monotonic time, slew) state.
+        @param now A monotonic time since the base.
+        @retval The NTP time then.
+        """
+        (base_time, base_elapsed, slew) = state
+        elapsed = now - base_elapsed
+        return base_time + elapsed - min(elapsed * SLEW_RATE, slew)
+
+    def future_bound(self):
+        """
+        @retval The NTP time beyond which a timestamp is unreasonable: a
+            year from now, as of the last refresh.
+        """
+        bound = self._bound
+        now = self._source()
+        if bound == None or not (bound[1] - self._refresh <= now < bound[1]):
+            bound = (self.ntp_time() + FUTURE_LIMIT, now + self._refresh)
+            self._bound = bound
+        return bound[0]
+
+"""The clock in use"""
+_clock = NtpClock()
+
+def get_clock():
+    """
+    @retval The clock in use
+    """
+    return _clock
+
+def set_clock(clock):
+    """
+    Replace the clock in use, for example with an NtpClock reading a
+    fixed time.
+    @param clock The new clock, or None for one reading the system time.
+    @retval The clock that was in use, so it can be put back.
+    """
+    global _clock
+    previous = _clock
+    _clock = clock or NtpClock()
+    return previous
+
+def ntp_time():
+    """
+    @retval The current NTP time from the clock in use
+    """
+    return _clock.ntp_time()
+
+def future_bound():
+    """
+    @retval The unreasonable future bound from the clock in use
+    """
+    return _clock.future_bound()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.test.test_ntp_clock
+@file mi/core/test/test_ntp_clock.py
+@brief Unit tests for the shared NTP clock
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+import ntplib
+import threading
+import unittest
+from nose.plugins.attrib import attr
+
+from mi.core import ntp_clock
+from mi.core.ntp_clock import NtpClock, monotonic
+
+@attr('UNIT', group='mi')
+class TestNtpClock(unittest.TestCase):
+    """
+    Test the NTP clock and replacing it
+    """
+    def setUp(self):
+        self.now = 1349398554.25
+        self.elapsed = 0.0
+        self.clock = NtpClock(source=lambda: self.now, refresh=10,
+                              monotonic=lambda: self.elapsed)
+
+    def advance(self, seconds):
+        self.now += seconds
+        self.elapsed += seconds
+
+    def test_ntp_time(self):
+        self.assertEqual(self.clock.ntp_time(),
+                         ntplib.system_to_ntp_time(self.now))
+        ntp = NtpClock().ntp_time()
+        self.assertTrue(abs(ntp - ntplib.system_to_ntp_time(time.time())) < 1)
+
+    def test_elapsed(self):
+        first = self.clock.ntp_time()
+        self.advance(4.5)
+        self.assertEqual(self.clock.ntp_time(), first + 4.5)
+        # the system time is only read on the refresh
+        self.now += 2
+        self.assertEqual(self.clock.ntp_time(), first + 4.5)
+        self.advance(5.5)
+        self.assertEqual(self.clock.ntp_time(), first + 12)
+        self.assertTrue(monotonic() <= monotonic())
+
+    def test_backwards_step(self):
+        first = self.clock.ntp_time()
+        self.advance(1)
+        self.now -= 5
+        self.assertEqual(self.clock.ntp_time(), first + 1)
+        # the step is seen on the refresh, and taken up by running at half
+        # speed rather than by going back or standing still
+        self.advance(9)
+        self.assertEqual(self.clock.ntp_time(), first + 10)
+        last = self.clock.ntp_time()
+        for i in range(20):
+            self.advance(1)
+            now = self.clock.ntp_time()
+            self.assertTrue(now > last)
+            last = now
+        self.assertEqual(last, first + 20 + 5)
+        self.assertEqual(last, ntplib.system_to_ntp_time(self.now))
+        self.advance(1)
+        self.assertEqual(self.clock.ntp_time(), last + 1)
+
+    def test_forward_step(self):
+        first = self.clock.ntp_time()
+        self.now += 100
+        self.advance(10)
+        self.assertEqual(self.clock.ntp_time(), first + 110)
+
+    def test_threads(self):
+        """
+        Readings from threads sharing a clock that resyncs all the time
+        never go backwards in any one thread
+        """
+        clock = NtpClock(refresh=0.0005)
+        failures = []
+        def read():
+            last = clock.ntp_time()
+            for i in xrange(5000):
+                now = clock.ntp_time()
+                if now < last:
+                    failures.append((last, now))
+                last = now
+        threads = [threading.Thread(target=read) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+
+    def test_future_bound_cached(self):
+        """
+        The cached bound is returned without reading the clock
+        """
+        bound = self.clock.future_bound()
+        reads = []
+        self.clock.ntp_time = lambda: reads.append(1)
+        self.advance(5)
+        self.assertEqual(self.clock.future_bound(), bound)
+        self.assertEqual(reads, [])
+
+    def test_future_bound(self):
+        bound = ntplib.system_to_ntp_time(self.now + 86400 * 365)
+        self.assertEqual(self.clock.future_bound(), bound)
+        # cached until the refresh interval passes
+        self.advance(5)
+        self.assertEqual(self.clock.future_bound(), bound)
+        self.advance(5)
+        self.assertEqual(self.clock.future_bound(), bound + 10)
+
+    def test_set_clock(self):
+        previous = ntp_clock.set_clock(self.clock)
+        try:
+            self.assertEqual(ntp_clock.ntp_time(),
+                             ntplib.system_to_ntp_time(self.now))
+            self.assertTrue(ntp_clock.get_clock() is self.clock)
+        finally:
+            ntp_clock.set_clock(previous)
+        self.assertTrue(ntp_clock.get_clock() is previous)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+@package mi.idk.scripts.replay_port_agent
+@file mi/idk/scripts/replay_port_agent.py
+@brief Serve a port agent capture file to a driver in place of the port
+agent, or time a driver callback over one.
+"""
+
+__license__ = 'Apache 2.0'
+
+import sys
+import argparse
+
+from mi.core.instrument.port_agent_capture import CaptureReader
+from mi.core.instrument.port_agent_capture import ReplayServer
+from mi.core.instrument.port_agent_capture import benchmark
+
+def run():
+    opts = parseArgs()
+
+    if opts.callback:
+        run_benchmark(opts)
+    else:
+        run_replay(opts)
+
+def run_replay(opts):
+    """
+    Serve the capture to a driver in place of the port agent.
+    """
+    reader = CaptureReader(opts.capture)
+    start = 0
+    if opts.start_time:
+        start = reader.find_time(opts.start_time)
+    reader.close()
+
+    server = ReplayServer(opts.capture, port=opts.port, speed=opts.speed,
+                          start=start)
+    print "Replaying %s on port %d" % (opts.capture, server.port)
+    server.start()
+    try:
+        while not server.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+
+    print "Sent %d packets, %d bytes in %.3f s" % (server.packets_sent,
+        server.bytes_sent, server.elapsed or 0)
+
+def run_benchmark(opts):
+    """
+    Time a got_data callback over the capture. The callback is named as
+    module:factory, where calling factory() returns the callback, usually a
+    protocol's got_data method.
+    """
+    (module_name, factory_name) = opts.callback.split(':')
+    __import__(module_name)
+    factory = getattr(sys.modules[module_name], factory_name)
+
+    result = benchmark(opts.capture, factory(), batch=opts.batch)
+    print "%d packets, %d bytes in %.3f s" % (result['packets'],
+        result['bytes'], result['seconds'])
+    if result['seconds']:
+        print "  %12.0f packets/sec" % result['packets_per_sec']
+        print "  %12.0f bytes/sec" % result['bytes_per_sec']
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="IDK Port Agent Replay")
+    parser.add_argument("capture",
+                        help="port agent capture file")
+    parser.add_argument("-p", dest='port', type=int, default=0,
+                        help="port to serve the capture on" )
+    parser.add_argument("-s", dest='speed', type=float, default=None,
+                        help="replay at recorded timing sped up this many times, as fast as possible if not given" )
+    parser.add_argument("-t", dest='start_time', type=float, default=None,
+                        help="NTP time to start replaying from" )
+    parser.add_argument("-b", dest='callback',
+                        help="benchmark module:factory's got_data callback instead of serving" )
+    parser.add_argument("--batch", dest='batch', action="store_true",
+                        help="benchmark the callback with one batch of all packets" )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    run()
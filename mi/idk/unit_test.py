@@ -89,6 +89,9 @@ class InstrumentDriverTestConfig(Singleton):
     instrument_agent_stream_definition = None
     
     container_deploy_file = 'res/deploy/r2deploy.yml'
+
+    # A PortAgentSimulator to test against instead of a port agent process
+    port_agent_simulator = None
     
     initialized   = False
     
@@ -114,6 +117,8 @@ class InstrumentDriverTestConfig(Singleton):
         if kwargs.get('container_deploy_file'):
             self.container_deploy_file = kwargs.get('container_deploy_file')
 
+        self.port_agent_simulator = kwargs.get('port_agent_simulator')
+
         if kwargs.get('logger_timeout'):
             self.container_deploy_file = kwargs.get('logger_timeout')
 
@@ -208,6 +213,13 @@ class InstrumentDriverTestCase(IonIntegrationTestCase):
         interface with the instrument.
         @retval return the pid to the logger process
         """
+        if cls.test_config.port_agent_simulator:
+            simulator = cls.test_config.port_agent_simulator
+            simulator.start()
+            log.info('Started port agent simulator listening at port %s' % simulator.port)
+            cls.test_config.port_agent = simulator
+            return simulator.port
+
         log.info("Startup Port Agent")
 
         comm_config = cls.get_comm_config()
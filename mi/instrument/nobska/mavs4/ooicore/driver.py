@@ -611,9 +611,9 @@ class mavs4InstrumentProtocol(MenuInstrumentProtocol):
     
     def _handler_autosample_exit(self, *args, **kwargs):
         """
-        Exit autosample state.
+        Exit autosample state. Publish the samples held in batches.
         """
-        pass
+        self._flush_sample_batches()
 
     def _handler_autosample_stop_autosample(self, *args, **kwargs):
         """
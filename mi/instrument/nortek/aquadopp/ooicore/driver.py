@@ -734,9 +734,9 @@ class Protocol(CommandResponseInstrumentProtocol):
 
     def _handler_autosample_exit(self, *args, **kwargs):
         """
-        Exit autosample state.
+        Exit autosample state. Publish the samples held in batches.
         """
-        pass
+        self._flush_sample_batches()
 
     def _handler_autosample_stop_autosample(self, *args, **kwargs):
         """
@@ -1251,9 +1251,6 @@ class Protocol(CommandResponseInstrumentProtocol):
         if self.get_current_state() != ProtocolState.COMMAND:
             raise InstrumentStateException('Can not perform update of parameters when not in command state',
                                            error_code=InstErrorCode.INCORRECT_STATE)
-        # Get old param dict config.
-        old_config = self._param_dict.get_config()
-        
         # Grab time for timeout.
         starttime = time.time()
         timeout = 6
@@ -1269,11 +1266,11 @@ class Protocol(CommandResponseInstrumentProtocol):
             for i in range(20):
                 if len(self._promptbuf) == self.CONFIGURATION_RESPONSE_LENGTH:
                     if self._check_configuration(self._promptbuf):                    
-                        self._param_dict.update(self._promptbuf)
-                        # Get new param dict config. If it differs from the old config,
-                        # tell driver superclass to publish a config change event.
-                        new_config = self._param_dict.get_config()
-                        if new_config != old_config:
+                        changed = self._param_dict.update_block(self._promptbuf,
+                                                                require_all=True)
+                        # If any parameter changed, tell driver superclass to
+                        # publish a config change event.
+                        if changed:
                             self._driver_event(DriverAsyncEvent.CONFIG_CHANGE)
                         return
                     break
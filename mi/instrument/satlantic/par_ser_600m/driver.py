@@ -175,6 +175,13 @@ class SatlanticPARDataParticle(DataParticle):
     Satlantic PAR sensor. Overrides the building of values, and the rest comes
     along for free.
     """
+    __slots__ = ()
+
+    _value_schema = [(SatlanticPARDataParticleKey.SERIAL_NUM, str),
+                     (SatlanticPARDataParticleKey.TIMER, float),
+                     (SatlanticPARDataParticleKey.COUNTS, int),
+                     (SatlanticPARDataParticleKey.CHECKSUM, int)]
+
     def _build_parsed_values(self):
         """
         Take something in the sample format and split it into
@@ -339,12 +346,7 @@ class SatlanticPARInstrumentProtocol(CommandResponseInstrumentProtocol):
 
         # Send command.
         log.debug('_do_cmd_no_resp: %s, timeout=%s' % (repr(cmd_line), timeout))
-        if (write_delay == 0):
-            self._connection.send(cmd_line)
-        else:
-            for char in cmd_line:
-                self._connection.send(char)
-                time.sleep(write_delay)
+        self._send_data(cmd_line, write_delay, timeout)
     
     ########################################################################
     # Unknown handlers.
@@ -230,6 +230,12 @@ class SBE16DataParticle(DataParticle):
     Routines for parsing raw data into a data particle structure. Override
     the building of values, and the rest should come along for free.
     """
+    __slots__ = ()
+
+    _value_schema = [(SBE16DataParticleKey.TEMP, float),
+                     (SBE16DataParticleKey.CONDUCTIVITY, float),
+                     (SBE16DataParticleKey.DEPTH, float)]
+
     def _build_parsed_values(self):
         """
         Take something in the autosample/TS format and split it into
@@ -275,6 +281,11 @@ class SBE16Protocol(CommandResponseInstrumentProtocol):
     Instrument protocol class for SBE16 driver.
     Subclasses CommandResponseInstrumentProtocol
     """
+
+    # The SBE16 sleeps after two minutes without a command, so it is taken
+    # to be awake for one minute after its last prompt.
+    _awake_window = 60
+
     def __init__(self, prompts, newline, driver_event):
         """
         SBE16Protocol constructor.
@@ -483,8 +494,12 @@ class SBE16Protocol(CommandResponseInstrumentProtocol):
         # Raise if the command not understood.
         else:
             
-            for (key, val) in params.iteritems():
-                result = self._do_cmd_resp(SBE16Command.SET, key, val, **kwargs)
+            # One wakeup for all the sets, each sent after the last is done.
+            results = self._do_cmd_resp_sequence(
+                [(SBE16Command.SET, key, val) for (key, val) in params.iteritems()],
+                **kwargs)
+            if results:
+                result = results[-1]
             self._update_params()
             
         return (next_state, result)
@@ -555,9 +570,9 @@ class SBE16Protocol(CommandResponseInstrumentProtocol):
     
     def _handler_autosample_exit(self, *args, **kwargs):
         """
-        Exit autosample state.
+        Exit autosample state. Publish the samples held in batches.
         """
-        pass
+        self._flush_sample_batches()
 
     def _handler_autosample_stop_autosample(self, *args, **kwargs):
         """
@@ -747,10 +762,10 @@ class SBE16Protocol(CommandResponseInstrumentProtocol):
         # Get old param dict config.
         old_config = self._param_dict.get_config()
         
-        # Issue display commands and parse results.
+        # Issue display commands after one wakeup and parse results.
         timeout = kwargs.get('timeout', SBE16_TIMEOUT)
-        self._do_cmd_resp(SBE16Command.DS, timeout=timeout)
-        self._do_cmd_resp(SBE16Command.DCAL, timeout=timeout)
+        self._do_cmd_resp_sequence([SBE16Command.DS, SBE16Command.DCAL],
+                                   timeout=timeout)
         
         # Get new param dict config. If it differs from the old config,
         # tell driver superclass to publish a config change event.
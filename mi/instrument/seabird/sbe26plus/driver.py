@@ -491,6 +491,8 @@ class SBE26plusDataParticle(DataParticle):
     Routines for parsing raw data into a data particle structure. Override
     the building of values, and the rest should come along for free.
     """
+    __slots__ = ()
+
     def _build_parsed_values(self):
         """
         Take something in the autosample/TS format and split it into
@@ -1416,9 +1418,9 @@ class Protocol(CommandResponseInstrumentProtocol):
 
     def _handler_autosample_exit(self, *args, **kwargs):
         """
-        Exit autosample state.
+        Exit autosample state. Publish the samples held in batches.
         """
-        pass
+        self._flush_sample_batches()
 
     def _handler_autosample_stop_autosample(self, *args, **kwargs):
         """
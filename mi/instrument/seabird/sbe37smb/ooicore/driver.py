@@ -208,6 +208,12 @@ class SBE37DataParticle(DataParticle):
     Routines for parsing raw data into a data particle structure. Override
     the building of values, and the rest should come along for free.
     """
+    __slots__ = ()
+
+    _value_schema = [(SBE37DataParticleKey.TEMP, float),
+                     (SBE37DataParticleKey.CONDUCTIVITY, float),
+                     (SBE37DataParticleKey.DEPTH, float)]
+
     def _build_parsed_values(self):
         """
         Take something in the autosample/TS format and split it into
@@ -248,6 +254,11 @@ class SBE37Protocol(CommandResponseInstrumentProtocol):
     Instrument protocol class for SBE37 driver.
     Subclasses CommandResponseInstrumentProtocol
     """
+
+    # The SBE37 sleeps after two minutes without a command, so it is taken
+    # to be awake for one minute after its last prompt.
+    _awake_window = 60
+
     def __init__(self, prompts, newline, driver_event):
         """
         SBE37Protocol constructor.
@@ -436,8 +447,11 @@ class SBE37Protocol(CommandResponseInstrumentProtocol):
         # Raise if the command not understood.
         else:
 
-            for (key, val) in params.iteritems():
-                result = self._do_cmd_resp('set', key, val, **kwargs)
+            # One wakeup for all the sets, each sent after the last is done.
+            results = self._do_cmd_resp_sequence(
+                [('set', key, val) for (key, val) in params.iteritems()], **kwargs)
+            if results:
+                result = results[-1]
             self._update_params()
 
         return (next_state, result)
@@ -520,9 +534,9 @@ class SBE37Protocol(CommandResponseInstrumentProtocol):
 
     def _handler_autosample_exit(self, *args, **kwargs):
         """
-        Exit autosample state.
+        Exit autosample state. Publish the samples held in batches.
         """
-        pass
+        self._flush_sample_batches()
 
     def _handler_autosample_stop_autosample(self, *args, **kwargs):
         """
@@ -726,24 +740,21 @@ class SBE37Protocol(CommandResponseInstrumentProtocol):
 
     def _update_params(self, *args, **kwargs):
         """
-        Update the parameter dictionary. Wake the device then issue
-        display status and display calibration commands. The parameter
-        dict will match line output and udpate itself.
+        Update the parameter dictionary. Wake the device once then issue
+        display status and display calibration commands, each after the
+        last is answered. The parameter dict will match line output and
+        udpate itself.
         @throws InstrumentTimeoutException if device cannot be timely woken.
         @throws InstrumentProtocolException if ds/dc misunderstood.
         """
-        # Get old param dict config.
-        old_config = self._param_dict.get_config()
-
         # Issue display commands and parse results.
         timeout = kwargs.get('timeout', SBE37_TIMEOUT)
-        self._do_cmd_resp('ds',timeout=timeout)
-        self._do_cmd_resp('dc',timeout=timeout)
+        (ds, dc) = self._do_cmd_resp_sequence(['ds', 'dc'], timeout=timeout)
+        changed = ds | dc
 
-        # Get new param dict config. If it differs from the old config,
-        # tell driver superclass to publish a config change event.
-        new_config = self._param_dict.get_config()
-        if new_config != old_config:
+        # If any parameter changed, tell driver superclass to publish a
+        # config change event.
+        if changed:
             self._driver_event(DriverAsyncEvent.CONFIG_CHANGE)
 
     def _build_simple_command(self, cmd):
@@ -789,13 +800,15 @@ class SBE37Protocol(CommandResponseInstrumentProtocol):
         Parse handler for dsdc commands.
         @param response command response string.
         @param prompt prompt following command response.
+        @retval The set of parameter names whose value changed, empty if
+        none did. _update_params publishes a config change if either of
+        ds and dc changed something.
         @throws InstrumentProtocolException if dsdc command misunderstood.
         """
         if prompt != SBE37Prompt.COMMAND:
             raise InstrumentProtocolException('dsdc command not recognized: %s.' % response)
 
-        for line in response.split(SBE37_NEWLINE):
-            self._param_dict.update(line)
+        return self._param_dict.update_block(response, SBE37_NEWLINE)
 
     def _parse_ts_response(self, response, prompt):
         """